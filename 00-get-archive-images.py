@@ -1,26 +1,162 @@
 '''
 Retrieve 688 images from scan of 1851 first edition Mody Dick
 Run ONCE and never again, since no need. Nobody is rescanning that book any time soon.
+In practice, a full harvest may die halfway. So harvest resumably:
+- a checkpoint manifest in PAGE_DIR records page, status, file, size and checksum of every page
+- complete pages are skipped, so an interrupted run resumes where it stopped
+- pages download on a bounded worker pool, throttled per host, written atomically by download_url
 '''
 
+import argparse
+import csv
+import hashlib
 import logging
 import os
 import shutil
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
 import utils.utilities as utl
 import utils.config as cfg
 
 logger = utl.init_logger()
 config = cfg.load_config()
 
-LIB_URL = config['ext_resource']['lib_url'] 
+LIB_URL = config['ext_resource']['lib_url']
 PAGE_DIR=config['proj_dirs']['lib_pages']
+MAX_PER_HOST = config['ext_resource'].get('max_per_host', 2)
+MIN_INTERVAL = config['ext_resource'].get('min_interval', 0.5)
 
 # Fresh start - should NOT be needed since only run once
 #utl.init_dir(PAGE_DIR)
 
 # Currently there are 687 actual pages. 0 is a blank image, and 687 is a test-pattern image
-for image in range(1):
-    url=LIB_URL.format(image=image)
-    logger.info(f"Working with URL {url}")
-    utl.download_url(url, PAGE_DIR, f"moby_dick-1851-page_{image:04d}")
+PAGES = range(688)
+SPECIAL_PAGES = {0: "blank", 687: "test pattern"}
+
+MANIFEST = os.path.join(PAGE_DIR, "harvest_manifest.csv")
+MANIFEST_FIELDS = ["page", "status", "file", "size", "sha256", "note"]
+
+def page_fname(page: int) -> str:
+    return f"moby_dick-1851-page_{page:04d}"
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while (chunk := fp.read(64 * 1024)):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def load_manifest() -> dict[int, dict]:
+    if not os.path.exists(MANIFEST):
+        return {}
+    with open(MANIFEST, encoding="utf-8", newline="") as fp:
+        return {int(row["page"]): row for row in csv.DictReader(fp)}
+
+def save_manifest(manifest: dict[int, dict]):
+    """ Checkpoint, written atomically so that an interrupted run never leaves a torn manifest """
+    tmp_path = MANIFEST + ".part"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for page in sorted(manifest):
+            writer.writerow(manifest[page])
+    os.replace(tmp_path, MANIFEST)
+
+def is_complete(row: dict | None, verify: bool = False) -> bool:
+    """ Page downloaded in a prior run, and its file still on disk with the recorded size (and checksum) """
+    if not row or row["status"] != "done":
+        return False
+    path = os.path.join(PAGE_DIR, row["file"])
+    if not os.path.exists(path) or os.path.getsize(path) != int(row["size"]):
+        return False
+    return not verify or file_sha256(path) == row["sha256"]
+
+def intact_image(path: str) -> bool:
+    """ Image file that decodes in full, as its extension says. A partial file from an interrupted download does not """
+    mime_type = {ext: mime for mime, ext in utl.image_ext.items()}.get(os.path.splitext(path)[1].lstrip("."))
+    if not mime_type or not utl.verify_image_header(path, mime_type):
+        return False
+    try:
+        with Image.open(path) as image:
+            image.load()
+        return True
+    except (OSError, SyntaxError):
+        return False
+
+def drop_unverified(page: int):
+    """ Remove a file of the page left without a "done" manifest row, e.g. by the former non-atomic downloader,
+    unless it is an intact image. download_url never overwrites, so it would otherwise be recorded as done """
+    for ext in utl.image_ext.values():
+        path = os.path.join(PAGE_DIR, f"{page_fname(page)}.{ext}")
+        if os.path.exists(path) and not intact_image(path):
+            logger.warning(f"Removing partial or corrupt page file {path}, to download it again.")
+            os.remove(path)
+
+def harvest_page(page: int, throttle: utl.HostThrottle) -> dict:
+    """ Download one page scan. Return its manifest row """
+    url = LIB_URL.format(image=page)
+    drop_unverified(page)
+    with throttle.slot(url):
+        logger.info(f"Working with URL {url}")
+        path = utl.download_url(url, PAGE_DIR, page_fname(page), verify=True)
+
+    if path is None:
+        return {"page": page, "status": "failed", "file": "", "size": "", "sha256": "", "note": url}
+    return {"page": page, "status": "done", "file": os.path.basename(path),
+            "size": os.path.getsize(path), "sha256": file_sha256(path), "note": ""}
+
+def harvest(pages=PAGES, jobs: int = 4, include_special: bool = False, verify: bool = False) -> dict[int, dict]:
+    """ Download every page not already complete per the manifest, checkpointing after each page """
+    os.makedirs(PAGE_DIR, exist_ok=True)
+    manifest = load_manifest()
+    lock = threading.Lock()
+
+    todo = []
+    for page in pages:
+        if page in SPECIAL_PAGES and not include_special:
+            manifest[page] = {"page": page, "status": "skipped", "file": "", "size": "", "sha256": "",
+                              "note": SPECIAL_PAGES[page]}
+        elif is_complete(manifest.get(page), verify):
+            logger.debug(f"Page {page:04d} already complete.")
+        else:
+            todo.append(page)
+    save_manifest(manifest)
+    logger.info(f"Harvesting {len(todo)} pages with {jobs} workers, {len(pages) - len(todo)} complete or skipped.")
+
+    throttle = utl.HostThrottle(MAX_PER_HOST, MIN_INTERVAL)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(harvest_page, page, throttle): page for page in todo}
+        try:
+            for future in as_completed(futures):
+                row = future.result()
+                with lock:
+                    manifest[row["page"]] = row
+                    save_manifest(manifest)
+                if row["status"] != "done":
+                    logger.error(f"Failed page {row['page']:04d}, retry with a later run.")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            logger.warning("Interrupted. Completed pages are checkpointed, run again to resume.")
+            raise
+
+    statuses = [row["status"] for row in manifest.values()]
+    logger.info(f"Manifest {MANIFEST}: {statuses.count('done')} done, {statuses.count('failed')} failed, "
+                f"{statuses.count('skipped')} skipped.")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable harvest of the 1851 page scans from the Internet Archive.")
+    parser.add_argument("--jobs", type=int, default=4, help="Concurrent downloads, throttled per config ext_resource.")
+    parser.add_argument("--first", type=int, default=PAGES.start, help="First page to harvest.")
+    parser.add_argument("--last", type=int, default=PAGES.stop - 1, help="Last page to harvest.")
+    parser.add_argument("--include-special", action="store_true",
+                        help=f"Also download the special pages {SPECIAL_PAGES}.")
+    parser.add_argument("--verify", action="store_true",
+                        help="Re-check checksums of complete pages before skipping them.")
+    args = parser.parse_args()
+
+    harvest(range(args.first, args.last + 1), jobs=args.jobs, include_special=args.include_special, verify=args.verify)
+    logger.info(utl.get_http_client().summary())
@@ -30,4 +30,5 @@ for index, row in df.iterrows():
         dl_fail += 1
 
 logger.info(f"Completed processing {len(df)} images from file \"{file_path}\".")
-logger.info(f":: Downloaded {dl_good} images successfully, {dl_fail} failures.")
\ No newline at end of file
+logger.info(f":: Downloaded {dl_good} images successfully, {dl_fail} failures.")
+logger.info(utl.get_http_client().summary())
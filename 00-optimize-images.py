@@ -0,0 +1,104 @@
+'''
+Resize and recompress the EPUB images per device profile, for 04-build-ebook.py to package
+- Profiles in config image_profiles: max width and height in px, JPEG quality, progressive or baseline JPEG
+- Variants of images and custom_img_sm go to img_variants/<profile>/<folder>, under the same file names
+- Images run on a process pool with --jobs. A variant is reused while its source sha256, per the image index,
+  its profile and this code are unchanged, per the build cache
+- 04-build-ebook.py packages the variants of config exe_mode image_profile, or --image-profile
+'''
+import argparse
+import logging
+import os
+import utils.utilities as utl
+import utils.config as config
+from utils.build_cache import BuildCache
+from utils.image_variants import ORIGINAL, VARIANT_EXTS, check_profile, format_report, make_variant, variant_dir
+
+# Log file set up by utl.init_logger() when run as a script. Pool workers log through utl.init_worker_logger()
+logger = logging.getLogger(__name__)
+config_data = config.load_config()
+IMAGE_PROFILES = config_data.get("image_profiles", {})
+IMAGE_PROFILE = config_data["exe_mode"].get("image_profile", ORIGINAL)  # or --profile
+
+# Source folders, and the folder of the variants
+IMG_SRC      = config_data["proj_dirs"]["img_dir"]
+CUSTOM_IMG   = config_data["proj_dirs"]["custom_img"]
+IMG_VARIANTS = config_data["proj_dirs"].get("img_variants", "img_variants")
+
+BUILD_CACHE = config_data["proj_dirs"].get("build_cache", ".build_cache")
+CODE_FILES  = [__file__, os.path.join(os.path.dirname(utl.__file__), "image_variants.py")]
+
+def load_profile(name: str) -> dict:
+    """ Settings of the profile name in config image_profiles """
+    if name not in IMAGE_PROFILES:
+        raise ValueError(f"Unknown image profile {name}. Profiles in config image_profiles: {', '.join(IMAGE_PROFILES)}")
+    return check_profile(name, IMAGE_PROFILES[name])
+
+def optimize_all(profile_name: str = IMAGE_PROFILE, src_dirs: tuple[str, ...] = (IMG_SRC, CUSTOM_IMG), jobs: int = 1,
+                 cache_dir: str = BUILD_CACHE, variants_root: str = IMG_VARIANTS) -> dict[str, list[int]]:
+    """
+    Make the variants of the images in src_dirs for the profile, reusing unchanged ones.
+    Return the size report, {folder: [images, source bytes, variant bytes]}.
+    With jobs > 1, images run on a process pool. The first failing image stops the run.
+    """
+    if profile_name == ORIGINAL:
+        logger.info("Image profile original: 04 packages the source images.")
+        return {}
+    profile = load_profile(profile_name)
+    build_cache = BuildCache(f"00-optimize-images-{profile_name}", cache_dir, CODE_FILES, unit="images")
+
+    report = {}
+    todo = {}
+    keys = {}
+    def add_sizes(item: str, sizes: list[int]):
+        folder = item.split("/")[0]
+        report[folder] = [total + size for total, size in zip(report[folder], [1, *sizes])]
+
+    for src_dir in src_dirs:
+        img_index = utl.get_image_index(src_dir)
+        dest_dir = variant_dir(src_dir, profile_name, variants_root)
+        os.makedirs(dest_dir, exist_ok=True)
+        folder = os.path.basename(os.path.normpath(src_dir))
+        report[folder] = [0, 0, 0]
+        for fname in sorted(os.listdir(src_dir)):
+            if not fname.lower().endswith(VARIANT_EXTS):
+                continue
+            item = f"{folder}/{fname}"
+            dest = os.path.join(dest_dir, fname)
+            keys[item] = build_cache.key(img_index.get(fname)["sha256"], profile)
+            if record := build_cache.lookup(item, keys[item]):
+                add_sizes(item, record["sizes"])
+            else:
+                todo[item] = (os.path.join(src_dir, fname), dest)
+    build_cache.prune(keys)
+
+    def built(item: str, sizes: tuple[int, int]):
+        add_sizes(item, sizes)
+        build_cache.store(item, keys[item], [todo[item][1]], sizes=list(sizes))
+
+    if jobs > 1:
+        logger.info(f"Optimizing {len(todo)} images with {jobs} worker processes, profile {profile_name}.")
+    try:
+        utl.run_pool(make_variant, {item: (src, dest, profile) for item, (src, dest) in todo.items()}, jobs, done=built)
+    finally:
+        build_cache.save()  # the variants made before a failure, for the next run
+    print(build_cache.summary())
+    logger.info(build_cache.summary())
+    report_lines = format_report(report, profile_name)
+    print("\n".join(report_lines))
+    for line in report_lines:
+        logger.info(line)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resize and recompress the EPUB images for a device profile.")
+    parser.add_argument("--profile", choices=[ORIGINAL, *IMAGE_PROFILES], default=IMAGE_PROFILE,
+                        help=f"Device profile, of config image_profiles. Default per config exe_mode image_profile, now {IMAGE_PROFILE}.")
+    parser.add_argument("--all", action="store_true", help="Make the variants of every profile.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Images to process in parallel, on a process pool. Default 1, sequential.")
+    args = parser.parse_args()
+
+    utl.init_logger()
+    for profile_name in (IMAGE_PROFILES if args.all else [args.profile]):
+        optimize_all(profile_name, jobs=args.jobs)
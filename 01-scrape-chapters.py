@@ -3,32 +3,52 @@ Retrieve Power Moby Dick chapter (HTML) and stylesheet (CSS). Scrape politely.
 Run ONLY when you know that the content has been improved. Retrieve latest and stash locally.
 Modify that raw content locally, iteratively as needed, in subsequent modules.
 '''
+import argparse
+import csv
+import contextlib
+import hashlib
+import html as htmllib
+import logging
 import os
 import shutil
 import re
 import requests
+import threading
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urljoin
 import utils.utilities as utl
 import utils.config as config
 
-logger = utl.init_logger()
+# Log file set up by utl.init_logger() when run as a script
+logger = logging.getLogger(__name__)
 config_data = config.load_config()
 
 debugging = config_data["exe_mode"]["debugging"]
 BASE_URL = config_data["ext_resource"]["base_url"]
+MAX_PER_HOST = config_data["ext_resource"].get("max_per_host", 2)
+MIN_INTERVAL = config_data["ext_resource"].get("min_interval", 0.5)
 
 # New Folders
 CHAP_RAW= config_data["proj_dirs"]["ch_raw"]
 CSS_DIR = config_data["proj_dirs"]["css_dir"]
 
-# Fresh start, unless debugging
-if not debugging:
-    utl.init_dir(CHAP_RAW)
-    utl.init_dir(CSS_DIR)
-    logger.info("Initialized directories for raw chapters and CSS.")
-else:
-    logger.info("Debugging mode: skipping directory initialization.")
+# Per-chapter record of URL, Last-Modified and hash of the extracted slice, for incremental scrapes
+MANIFEST = config_data["proj_dirs"].get("scrape_manifest", "scrape_manifest.csv")
+MANIFEST_FIELDS = ["chapter", "url", "last_modified", "sha256"]
+
+def init_dirs(incremental: bool = False):
+    """ Fresh start, unless debugging or scraping incrementally into existing directories """
+    if incremental:
+        os.makedirs(CHAP_RAW, exist_ok=True)
+        os.makedirs(CSS_DIR, exist_ok=True)
+        logger.info("Incremental mode: keeping existing raw chapters and CSS.")
+    elif not debugging:
+        utl.init_dir(CHAP_RAW)
+        utl.init_dir(CSS_DIR)
+        logger.info("Initialized directories for raw chapters and CSS.")
+    else:
+        logger.info("Debugging mode: skipping directory initialization.")
 
 def extract_chapter_urls(toc_html: str) -> list[tuple[int, str]]:
     """
@@ -78,35 +98,54 @@ def extract_chapter_content(html: str) -> str:
     # Slice HTML directly
     return html[start_idx:end_idx]
 
-def download_stylesheets(html: str, out_dir=CSS_DIR):
+# Stylesheet discovery by literal scan, no DOM needed just to find <link> and <style> tags
+link_re  = re.compile(r'<link\b[^>]*>', re.IGNORECASE)
+style_re = re.compile(r'<style\b([^>]*)>(.*?)</style>', re.IGNORECASE | re.DOTALL)
+attr_re  = re.compile(r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))')
+url_patt = re.compile(r'https*\:.+\.css')
+
+def tag_attrs(tag_html: str) -> dict:
+    """ Attributes of one literal start tag, names lowercased and values unescaped """
+    return {m.group(1).lower(): htmllib.unescape(next(v for v in m.groups()[1:] if v is not None))
+            for m in attr_re.finditer(tag_html)}
+
+def find_stylesheets(html: str) -> list[str]:
+    """
+    Absolute URLs of the stylesheets referenced in this HTML, in document order.
+    - <link rel="stylesheet" href="..."> tags, or if there are none
+    - @import of a .css URL inside <style type="text/css"> tags
+    """
+    css_urls = []
+    for link in link_re.findall(html):
+        attrs = tag_attrs(link)
+        if "stylesheet" in attrs.get("rel", "").split() and attrs.get("href"):
+            css_urls.append(urljoin(BASE_URL, attrs["href"]))
+
+    # There is only 1 text/css import today
+    if not css_urls:
+        for attrs, content in style_re.findall(html):
+            if tag_attrs(attrs).get("type") != "text/css":
+                continue
+            if (css_url := url_patt.search(content)):
+                css_urls.append(css_url.group(0))
+    return css_urls
+
+def download_stylesheets(html: str, out_dir=CSS_DIR, seen: set = None):
     """
     Download linked CSS files referenced in this HTML snippet. Do not replace same same-name stylesheets.
+    Optionally skip, and record, CSS URLs in the seen set, to download each stylesheet once per run.
     Today, this is the only stylesheet
 	<style type="text/css">
 	@import "http://www.powermobydick.com/MobySidenote.css";
 	</style>
     """
-    soup = BeautifulSoup(html, "html.parser")
-    links = soup.find_all("link", rel="stylesheet")
-
-    for tag in links:
-        href = tag.get("href")
-        if not href:
-            continue
-
-        css_url = urljoin(BASE_URL, href)
+    for css_url in find_stylesheets(html):
+        if seen is not None:
+            if css_url in seen:
+                continue
+            seen.add(css_url)
         utl.download_url(css_url, out_dir)
 
-    # There is only 1 text/css import today
-    if not len(links):
-        url_patt = re.compile(r'https*\:.+\.css')
-        links = soup.find_all("style", type="text/css")
-
-        for tag in links:
-            href = tag.contents[0]
-            css_url = url_patt.search(href).group(0)
-            utl.download_url(css_url, out_dir)
-
 def save_chapter(number: int, raw_html: str, out_dir=CHAP_RAW):
     """
     Write RAW chapter HTML to disk. Process further subsequently
@@ -120,37 +159,157 @@ def save_chapter(number: int, raw_html: str, out_dir=CHAP_RAW):
     except Exception as exc:
         logger.error(f"Failed to download {raw_html}: {exc}")
 
-def scrape_all():
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+def load_manifest(path: str = MANIFEST) -> dict[int, dict]:
+    """ Scrape manifest from a prior run, {chapter number: row}. Empty if none or unreadable, for a full scrape """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8", newline="") as fp:
+            manifest = {int(row["chapter"]): row for row in csv.DictReader(fp)}
+        for row in manifest.values():
+            if not all(isinstance(row.get(field), str) for field in MANIFEST_FIELDS):
+                raise ValueError(f"incomplete row for chapter {row['chapter']}")
+        return manifest
+    except (csv.Error, KeyError, ValueError, TypeError, UnicodeDecodeError) as exc:
+        logger.warning(f"Unreadable scrape manifest {path}, scraping all chapters: {exc}")
+        return {}
+
+def save_manifest(manifest: dict[int, dict], path: str = MANIFEST):
+    with open(path, "w", encoding="utf-8", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for number in sorted(manifest):
+            writer.writerow(manifest[number])
+    logger.info(f"Saved scrape manifest {path} with {len(manifest)} chapters.")
+
+def load_mod_dates(path: str) -> dict[str, str]:
+    """ {URL: ISO Last-Modified} from the chapter_mod_dates.csv of 05-pmd-updates.py, skipping errors """
+    with open(path, encoding="utf-8", newline="") as fp:
+        return {row["URL"]: row["Last-Modified"] for row in csv.DictReader(fp)
+                if not row["Last-Modified"].startswith("Error")}
+
+def process_chapter(number: int, chapter_url: str, last_mod: str, raw_html: str,
+                    manifest: dict, css_seen: set, css_lock: threading.Lock) -> bool:
+    """
+    From raw HTML, fetch any new CSS stylesheets, then extract chapter content within markers.
+    Save it, unless an identical slice is already on disk. Return True when the slice changed.
+    """
+    with css_lock:
+        download_stylesheets(raw_html, seen=css_seen)
+
+    html = extract_chapter_content(raw_html)
+    sha = content_hash(html)
+    changed = manifest.get(number, {}).get("sha256") != sha
+    if changed or not os.path.exists(os.path.join(CHAP_RAW, f"chapter-{number:03d}.html")):
+        save_chapter(number, html)
+    manifest[number] = {"chapter": number, "url": chapter_url, "last_modified": last_mod, "sha256": sha}
+    return changed
+
+def scrape_all(jobs: int = 1, incremental: bool = False, mod_dates: str = ""):
     """
     Main driver: scrape TOC, loop over chapters, extract slices, save everything.
+    Report chapters whose extracted slice changed since the scrape manifest of the prior run.
+    With jobs > 1, fetch chapters concurrently, throttled per host by max_per_host and min_interval.
+    With incremental, keep ch_raw and fetch only chapters whose Last-Modified changed since the manifest,
+    taking Last-Modified from the 05-pmd-updates.py CSV mod_dates when given, otherwise from HEAD requests.
+    Rewrite only chapters whose extracted slice changed, since some page changes never touch the slice.
     """
+    init_dirs(incremental)
+    manifest = load_manifest()
+    known_mods = load_mod_dates(mod_dates) if (incremental and mod_dates) else {}
+
     logger.info(f"Fetching TOC from base URL {BASE_URL}")
     toc_html = utl.fetch_html(BASE_URL)
 
     chapters = extract_chapter_urls(toc_html)
     logger.info(f"Found {len(chapters)} chapters in based URL.")
 
-    # The TOC home page may have stylesheets
-    download_stylesheets(toc_html)
+    # The TOC home page may have stylesheets. Fetch each stylesheet once per run.
+    css_seen = set()
+    css_lock = threading.Lock()
+    download_stylesheets(toc_html, seen=css_seen)
 
+    todo = []
     for number, chapter_url in chapters:
 
         # For debugging specific chapters or ranges of chapters
         if debugging and number > 2:
             logger.info(f"Debugging mode: skipping chapter {number}.")
             continue
-        else:
+        todo.append((number, chapter_url))
+
+    throttle = utl.HostThrottle(MAX_PER_HOST, MIN_INTERVAL) if jobs > 1 else None
+
+    def request_slot(url: str):
+        """ One throttle slot per request, so that a HEAD and its GET are spaced like any other two requests """
+        return throttle.slot(url) if throttle else contextlib.nullcontext()
+
+    def fetch_chapter(number: int, chapter_url: str) -> tuple[str, str]:
+        """ (Last-Modified, raw HTML) of a chapter, or raw HTML None when unchanged since the manifest """
+        prior = manifest.get(number)
+        if incremental and prior and prior["url"] == chapter_url:
+            last_mod = known_mods.get(chapter_url)
+            if not last_mod:
+                with request_slot(chapter_url):
+                    last_mod = utl.head_last_modified(chapter_url)
+            raw_path = os.path.join(CHAP_RAW, f"chapter-{number:03d}.html")
+            if last_mod and last_mod == prior["last_modified"] and os.path.exists(raw_path):
+                logger.info(f"Unchanged chapter {number:03d}, Last-Modified {last_mod}: {chapter_url}")
+                return last_mod, None
+
+        with request_slot(chapter_url):
             logger.info(f"Processing chapter {number:03d}: {chapter_url}")
+            rsp = utl.fetch(chapter_url)
+            return utl.last_modified_iso(rsp.headers.get("Last-Modified", "")), rsp.text
 
-        # From raw HTML, fetch any CSS stylesheets
-        raw_html = utl.fetch_html(chapter_url)
-        download_stylesheets(raw_html)
+    changed = []
+    reused = 0
 
-        # Extract chapter content within markers
-        html = extract_chapter_content(raw_html)
-        save_chapter(number, html)
+    def record(number: int, chapter_url: str, last_mod: str, raw_html: str):
+        nonlocal reused
+        if raw_html is None:
+            reused += 1
+        elif process_chapter(number, chapter_url, last_mod, raw_html, manifest, css_seen, css_lock):
+            changed.append(number)
+
+    if throttle is None:
+        for number, chapter_url in todo:
+            record(number, chapter_url, *fetch_chapter(number, chapter_url))
+    else:
+        logger.info(f"Concurrent scrape: {jobs} workers, {throttle.max_per_host} per host, {throttle.min_interval}s spacing.")
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(fetch_chapter, number, chapter_url): (number, chapter_url) for number, chapter_url in todo}
+            for future in as_completed(futures):
+                record(*futures[future], *future.result())
 
+    save_manifest(manifest)
+
+    changed.sort()
+    logger.info(f"Changed chapters ({len(changed)}): {', '.join(f'{n:03d}' for n in changed) or 'none'}.")
+    logger.info(f"Fetched {len(todo) - reused} chapters, {reused} unchanged by Last-Modified.")
+    print(f"Changed chapters ({len(changed)}): {', '.join(f'{n:03d}' for n in changed) or 'none'}")
+    logger.info(utl.get_http_client().summary())
     logger.info("SUCCESS.")
+    return changed
 
 if __name__ == "__main__":
-    scrape_all()
+    parser = argparse.ArgumentParser(description="Scrape Power Moby-Dick TOC, chapters and stylesheets.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Concurrent chapter fetches, throttled per config ext_resource. Default 1, sequential.")
+    parser.add_argument("--offline", action="store_true",
+                        help="Scrape only from the HTTP cache, never the network. Fail on cache misses.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Keep {CHAP_RAW}, and fetch only chapters changed since {MANIFEST}.")
+    parser.add_argument("--mod-dates", default="",
+                        help="Incremental Last-Modified dates from 05-pmd-updates.py, e.g. chapter_mod_dates.csv, instead of HEAD requests.")
+    args = parser.parse_args()
+
+    utl.init_logger()
+    if args.offline:
+        if (cache := utl.get_http_cache()) is None:
+            parser.error("--offline needs an HTTP cache, config proj_dirs http_cache.")
+        cache.offline = True
+    scrape_all(jobs=args.jobs, incremental=args.incremental, mod_dates=args.mod_dates)
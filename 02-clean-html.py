@@ -1,3 +1,6 @@
+import argparse
+import copy
+import logging
 import os
 import shutil
 import re
@@ -6,11 +9,16 @@ from bs4 import BeautifulSoup, Comment, NavigableString
 from urllib.parse import urljoin
 import utils.utilities as utl
 import utils.config as config
+from utils.build_cache import BuildCache, sha256_bytes
+from utils.replace import ReplaceRules
 
-logger = utl.init_logger()
+# Log file set up by utl.init_logger() when run as a script. Pool workers log through utl.init_worker_logger()
+logger = logging.getLogger(__name__)
 config_data = config.load_config()
 debugging = config_data["exe_mode"]["debugging"]
 epub_ref = config_data["exe_mode"]["epub_ref"]
+EPUB_REFS = ("foot", "link")  # the editions: EPUB footnotes, or plain hyperlinks for e-readers without them
+PARSER = utl.get_html_parser()  # config exe_mode parser, or --parser
 
 # Source Folders - DO NOT initialize (remove) these, created in prior step
 CHAP_RAW= config_data["proj_dirs"]["ch_raw"]
@@ -21,17 +29,28 @@ CHAP_RAW= config_data["proj_dirs"]["ch_raw"]
 CHAP_CLE= config_data["proj_dirs"]["ch_clean"]
 CHAP_PAT= config_data["proj_dirs"]["ch_patched"]
 
-# Fresh start, unless debugging
-if not debugging:
-    utl.init_dir(CHAP_CLE)
-    utl.init_dir(CHAP_PAT)
-    # DO NOT INITIALIZE CHAP_RAW, created in the PRIOR step
-    logger.info("Initialized directories for clean and patched HTML chapters.")
-else:
-    logger.info("Debugging mode: skipping directory initialization.")
+# Incremental builds: a chapter is rebuilt when its raw HTML, epub_ref, parser or this code changes
+BUILD_CACHE = config_data["proj_dirs"].get("build_cache", ".build_cache")
+CODE_FILES = [__file__] + [os.path.join(os.path.dirname(utl.__file__), f) for f in ("utilities.py", "replace.py")]
+
+def init_dirs(incremental: bool = False):
+    """ Fresh start, unless debugging or incremental. Not at import, since pool workers may import this module """
+    if incremental:
+        os.makedirs(CHAP_CLE, exist_ok=True)
+        os.makedirs(CHAP_PAT, exist_ok=True)
+        logger.info("Incremental build: keeping clean and patched HTML chapters.")
+    elif not debugging:
+        utl.init_dir(CHAP_CLE)
+        utl.init_dir(CHAP_PAT)
+        # DO NOT INITIALIZE CHAP_RAW, created in the PRIOR step
+        logger.info("Initialized directories for clean and patched HTML chapters.")
+    else:
+        logger.info("Debugging mode: skipping directory initialization.")
 
 # These are corrections to Power Moby HTML, for example in Chapter 35, today
-# - Delicate logic, since multiple passes of the patched_html. Get the sequence right. Debug mode is helpful.
+# - Delicate logic, since each fix applies to the output of the prior fixes. Get the sequence right. Debug mode is helpful.
+# - fix_rules applies them in a few grouped passes, with the same result as one str.replace per fix, in order.
+#   In debug mode, each chapter is checked against the sequential replacements.
 html_fixes = {"&eacute;": "é",
               "&aacute;": "á",
               "&oacute;": "ó",
@@ -122,8 +141,26 @@ Tun:&lt;/a&gt; a vast wine vat in the cellar of the castle in Heidelberg, German
 """<h1>Privacy Policy</h1>
 <p><a href="http://www.powermobydick.com/">"Power Moby-Dick: The Online Annotation"</a> does not collect or use any information about individual visitors."""
 }
+fix_rules = ReplaceRules(html_fixes)
+
+# Hits per fix, per chapter. Targeted fixes, with sources longer than this, are meant for one place in the book
+fix_hits = {}
+TARGETED_FIX_LEN = 12
+
+def report_fix_hits(hits_by_chapter: dict[int, list[int]]):
+    """ Log hits of each fix across chapters. Warn of dead fixes, and targeted fixes that hit more than once """
+    for i, (src, _) in enumerate(fix_rules.rules):
+        chapters = {num: hits[i] for num, hits in sorted(hits_by_chapter.items()) if hits[i]}
+        total = sum(chapters.values())
+        where = ", ".join(f"{num:03d}" + (f" x{n}" if n > 1 else "") for num, n in chapters.items())
+        if not total:
+            logger.warning(f"Dead fix, no hits in {len(hits_by_chapter)} chapters: {fix_rules.label(i)}")
+        elif len(src) > TARGETED_FIX_LEN and total > 1:
+            logger.warning(f"Hot fix, {total} hits for a targeted fix: {fix_rules.label(i)} in chapters {where}")
+        else:
+            logger.info(f"Fix {fix_rules.label(i)}: {total} hits in chapters {where}")
 
-def basic_html_cleanup(html_string: str, chapter_num: int) -> str:
+def basic_html_cleanup(html_string: str, chapter_num: int, parser: str = PARSER) -> str:
     """
     Basic HTML cleanup:
       - Remove OnClick attributes
@@ -132,7 +169,7 @@ def basic_html_cleanup(html_string: str, chapter_num: int) -> str:
       - Fix <a name=> to <a id=>
       - Apply other HTML fixes from html_fixes dict
     """
-    soup = BeautifulSoup(html_string, "html.parser")
+    soup = utl.parse_html(html_string, parser)
 
     # First remove all OnClick attributes
     for tag in soup.find_all(attrs={"onclick": True}):
@@ -155,16 +192,14 @@ def basic_html_cleanup(html_string: str, chapter_num: int) -> str:
         del anchor['name']
 
     # Finally, make other HTML fixes from html_fixes dict
-    patched_html = str(soup)
-    for src, rpl in html_fixes.items():
-        patched_html = patched_html.replace(src, rpl)
+    patched_html, fix_hits[chapter_num] = fix_rules.apply(str(soup), verify=debugging)
 
     logger.info(f"Performed basic HTML cleanup for chapter {chapter_num:04d}.")
     return patched_html
 
-def convert_page_paragraphs(html_string: str, chapter_num: int) -> str:
+def convert_page_paragraphs(soup: BeautifulSoup, chapter_num: int) -> BeautifulSoup:
     """
-    Convert page paragraphs like:
+    Transform the shared chapter tree, in place. Convert page paragraphs like:
         <p><...tags...>page 315<.../tags...></p>
     into uniform page paragraphs:
         <p><i>page 315</i></p>
@@ -173,8 +208,6 @@ def convert_page_paragraphs(html_string: str, chapter_num: int) -> str:
     - Ignores other paragraphs
     """
 
-    soup = BeautifulSoup(html_string, "html.parser")
-
     # Now convert page paragraphs
     for ps in soup.find_all("p"):
         # get all text inside the paragraph, ignoring any tags
@@ -189,10 +222,11 @@ def convert_page_paragraphs(html_string: str, chapter_num: int) -> str:
             ps.append(new_tag)
 
     logger.info(f"Converted 1851 page number paragraphs for chapter {chapter_num:04d}")
-    return str(soup)
+    return soup
 
-def convert_chapter_headers(html_string: str, chapter_num: int) -> str:
+def convert_chapter_headers(soup: BeautifulSoup, chapter_num: int) -> BeautifulSoup:
     """
+    Transform the shared chapter tree, in place.
     Check git tag 2.2 for prior formatting of chapter headers.
     Updated: format headers as they appear in 1851 edition (uppercase, smaller font for subtitle).
     Update all H1 and H2 tags to later add to custom nav.xhtml
@@ -200,7 +234,6 @@ def convert_chapter_headers(html_string: str, chapter_num: int) -> str:
     - force each to end with period.
     - set class to match CSS styles, title and subtitle
     """
-    soup = BeautifulSoup(html_string, "html.parser")
     ttlcnt = 0
     sttlcnt = 0
 
@@ -222,11 +255,12 @@ def convert_chapter_headers(html_string: str, chapter_num: int) -> str:
         h_tag.replace_with(new_txt)
 
     logger.info(f"Converted headers for chapter {chapter_num:04d}")
-    return str(soup)
+    return soup
 
-def transform_annotations_to_epub_footnotes(html_string: str, chapter_number: int) -> str:
+def transform_annotations_to_epub_footnotes(soup: BeautifulSoup, chapter_number: int,
+                                            ref: str = epub_ref) -> BeautifulSoup:
     """
-    Unified transformation for:
+    Transform the shared chapter tree, in place. Unified transformation for:
       1. <a class="sidenote" title="...">text</a>
       2. <span class="sidenote" title="...">text</span>
       3. <div class="sidenote" id="snNNN"> ...HTML... </div>
@@ -235,9 +269,9 @@ def transform_annotations_to_epub_footnotes(html_string: str, chapter_number: in
       - inline "noteref" anchors to tag visible text
       - <aside epub:type="footnote"><p>...</p></aside> entries
       - A single footer container per chapter.
+    For the ref "link" edition, plain anchors and <p> entries instead, without epub:type.
     """
 
-    soup = BeautifulSoup(html_string, "html.parser")
     chapter_str = f"{chapter_number:03d}"
     fn_counter = 1
     footnotes = []
@@ -256,7 +290,11 @@ def transform_annotations_to_epub_footnotes(html_string: str, chapter_number: in
     ### Helper: parse a string containing HTML and return nodes
     ### ---------------------------------------------------------
     def parse_html_fragment(html_fragment: str):
-        frag = BeautifulSoup(html_fragment, "html.parser")
+        # Plain text, without markup or entities, parses to itself. Skip the parser.
+        if "<" not in html_fragment and "&" not in html_fragment:
+            return [NavigableString(html_fragment)] if html_fragment else []
+        # Same parser backend as the chapter tree
+        frag = utl.parse_html(html_fragment, soup.builder.NAME)
         return list(frag.contents)
 
     ### ---------------------------------------------------------
@@ -277,7 +315,7 @@ def transform_annotations_to_epub_footnotes(html_string: str, chapter_number: in
         src_id, ref_id = new_ids()
 
         # Create inline source anchor, Footnotes or Links (no epub:type)
-        if epub_ref == "foot":
+        if ref == "foot":
             src_anchor = soup.new_tag(
                 "a",
                 id=src_id,
@@ -298,7 +336,7 @@ def transform_annotations_to_epub_footnotes(html_string: str, chapter_number: in
 
         # Build aside for Footnote, or simple paragraph for Links skipping outer <aside>
 
-        if epub_ref == "foot":
+        if ref == "foot":
             aside = soup.new_tag(
                 "aside",
                 id=ref_id, 
@@ -317,19 +355,19 @@ def transform_annotations_to_epub_footnotes(html_string: str, chapter_number: in
         )
         backlink.string = "◄"
 
-        if epub_ref == "foot":
+        if ref == "foot":
             p.append(backlink)
         else:
             aside.append(backlink)
 
         # Add parsed title HTML
         for node in parse_html_fragment(title_html):
-            if epub_ref == "foot":
+            if ref == "foot":
                 p.append(node)
             else:
                 aside.append(node)
 
-        if epub_ref == "foot":
+        if ref == "foot":
             aside.append(p)
 
         footnotes.append(aside)
@@ -398,16 +436,14 @@ def transform_annotations_to_epub_footnotes(html_string: str, chapter_number: in
         else:
             soup.append(container)
 
-    return str(soup)
+    return soup
 
-def transform_sidenotes_to_epub(html_string: str, chapter_number: int) -> str:
+def transform_sidenotes_to_epub(soup: BeautifulSoup, chapter_number: int) -> BeautifulSoup:
     """
+    Transform the shared chapter tree, in place.
     Convert inline <span class="sidenote" title="...">...</span>
     into EPUB footnotes.
     """
-    from bs4 import BeautifulSoup
-
-    soup = BeautifulSoup(html_string, "html.parser")
     chapter_prefix = f"ch_{chapter_number:03d}"
     fn_counter = 1000  # start at high number to avoid colliding with original snN
 
@@ -427,12 +463,55 @@ def transform_sidenotes_to_epub(html_string: str, chapter_number: int) -> str:
 
         # Create aside footnote
         aside = soup.new_tag("aside", id=fn_id, **{"epub:type": "footnote"})
-        aside.append(BeautifulSoup(note_text, "html.parser"))
+        aside.append(utl.parse_html(note_text, soup.builder.NAME))
         # Append to end of body
         body = soup.body or soup
         body.append(aside)
 
-    return str(soup)
+    return soup
+
+def compact_whitespace(soup: BeautifulSoup) -> BeautifulSoup:
+    """
+    Transform the shared chapter tree, in place.
+    Remove excessive whitespace for any non-missing text (strings).
+    As before, comments and other NavigableString subclasses become plain, compacted text.
+    Plain strings that are already compact are left in place, rather than replaced with an equal copy.
+    """
+    for element in soup.find_all(string=True):
+        if isinstance(element, NavigableString):
+            cleaned_text = ' '.join(element.string.split())
+            if type(element) is NavigableString and cleaned_text == element:
+                continue
+            element.replace_with(cleaned_text)
+    return soup
+
+def patch_editions(clean_html: str, number: int, parser: str = PARSER,
+                   refs: tuple[str, ...] = (epub_ref,)) -> dict[str, str]:
+    """
+    Parse the minimally cleaned HTML once, and convert page paragraphs and headers once, for all editions.
+    Then run the edition transforms over a copy of that tree per edition, the last over the tree itself.
+    Return {ref: patched HTML}.
+    """
+    soup = utl.parse_html(clean_html, parser)
+    convert_page_paragraphs(soup, number)
+    convert_chapter_headers(soup, number)
+
+    patched = {}
+    for idx, ref in enumerate(refs):
+        # Copying the tree is cheaper than parsing the chapter again
+        tree = soup if idx == len(refs) - 1 else copy.copy(soup)
+        transform_annotations_to_epub_footnotes(tree, number, ref)
+        transform_sidenotes_to_epub(tree, number)
+        compact_whitespace(tree)
+        patched[ref] = str(tree)
+    return patched
+
+def patch_chapter(clean_html: str, number: int, parser: str = PARSER, ref: str = epub_ref) -> str:
+    """
+    Parse the minimally cleaned HTML once, run every patch transform over that one shared tree,
+    and serialize once, for the patched dir.
+    """
+    return patch_editions(clean_html, number, parser, (ref,))[ref]
 
 def save_chapter(number: int, cleaned_html: str, out_dir: str=CHAP_PAT) -> None:
     """Write cleaned chapter HTML to disk. By default to patched dir."""
@@ -443,48 +522,87 @@ def save_chapter(number: int, cleaned_html: str, out_dir: str=CHAP_PAT) -> None:
     with open(path, "w", encoding="utf-8") as f:
         f.write(cleaned_html)
 
-def scrape_all():
-    """Main driver: scrape TOC, loop over chapters, extract slices, save everything."""
+def clean_text(raw_html: str, number: int, parser: str = PARSER) -> tuple[str, str]:
+    """ Clean and patch one raw chapter in memory. Return the minimally cleaned and the patched HTML """
+    html = basic_html_cleanup(raw_html, number, parser)
 
-    for fname in sorted(os.listdir(CHAP_RAW)):
-        if not fname.endswith(".html"):
-            continue
+    # Page paragraphs, headers, annotations and sidenotes, then compact whitespace, all on one parsed tree
+    return html, patch_chapter(html, number, parser)
 
-        number = int(fname.replace("chapter-", "").replace(".html", ""))
+def clean_chapter(fname: str, raw_dir: str = CHAP_RAW, clean_dir: str = CHAP_CLE,
+                  patched_dir: str = CHAP_PAT, parser: str = PARSER) -> tuple[int, list[int]]:
+    """ Clean and patch one raw chapter file, save both. Return the chapter number and its html_fixes hits """
+    number = int(fname.replace("chapter-", "").replace(".html", ""))
+    utl.log_tag.tag = f"chapter {number:03d}"
+    logger.info(f"Processing chapter {number:03d}: {fname}")
 
-        # For debugging specific chapters or ranges
-        if debugging and number != 141:
-            logger.info(f"Skipping chapter {number:03d} in debugging mode.")
-            continue
-        else:
-            logger.info(f"Processing chapter {number:03d}: {fname}")
-
-        with open(os.path.join(CHAP_RAW, fname), encoding="utf-8") as fp:
-            raw_html = fp.read()
+    with open(os.path.join(raw_dir, fname), encoding="utf-8") as fp:
+        raw_html = fp.read()
 
-        html = raw_html
-        html = basic_html_cleanup(html, number)
+    html, patched_html = clean_text(raw_html, number, parser)
 
-        # Save minimally cleaned HTML, for comparison with raw and with patched, to test that processes do not degrade content
-        save_chapter(number, html, out_dir=CHAP_CLE)
+    # Save minimally cleaned HTML, for comparison with raw and with patched, to test that processes do not degrade content
+    save_chapter(number, html, out_dir=clean_dir)
+    save_chapter(number, patched_html, out_dir=patched_dir)
+    return number, fix_hits[number]
 
-        html = convert_page_paragraphs(html, number)
-        html = convert_chapter_headers(html, number)
-        html = transform_annotations_to_epub_footnotes(html, number)
-        html = transform_sidenotes_to_epub(html, number)
-
-        # Compact HTML with html formatter
-        soup = BeautifulSoup(html, "html.parser")   
+def scrape_all(jobs: int = 1, raw_dir: str = CHAP_RAW, clean_dir: str = CHAP_CLE, patched_dir: str = CHAP_PAT,
+               parser: str = PARSER, incremental: bool = False, cache_dir: str = BUILD_CACHE):
+    """
+    Main driver: loop over raw chapters, clean and patch each, save everything.
+    With jobs > 1, chapters run on a process pool. Outputs are the same, since chapters are independent.
+    The first failing chapter stops the run.
+    With incremental, reuse the outputs of chapters unchanged since the last build, per the build cache.
+    """
+    build_cache = BuildCache("02-clean-html", cache_dir, CODE_FILES)
+    raw_fnames = sorted(fname for fname in os.listdir(raw_dir) if fname.endswith(".html"))
+    build_cache.prune(int(fname.replace("chapter-", "").replace(".html", "")) for fname in raw_fnames)
 
-        # Remove excessive whitespace for any non-missing text (strings)
-        for element in soup.find_all(string=True):
-            if isinstance(element, NavigableString):
-                cleaned_text = ' '.join(element.string.split())
-                element.replace_with(cleaned_text)
+    fnames = []
+    keys = {}
+    for fname in raw_fnames:
+        number = int(fname.replace("chapter-", "").replace(".html", ""))
 
-        save_chapter(number, str(soup), out_dir=CHAP_PAT)
+        # For debugging specific chapters or ranges
+        if debugging and number != 141:
+            logger.info(f"Skipping chapter {number:03d} in debugging mode.")
+            continue
 
+        with open(os.path.join(raw_dir, fname), "rb") as fp:
+            keys[number] = build_cache.key(sha256_bytes(fp.read()), epub_ref, parser)
+        if incremental and (record := build_cache.lookup(number, keys[number])):
+            fix_hits[number] = record["fix_hits"]
+            logger.info(f"Reused chapter {number:03d}, unchanged since the last build.")
+            continue
+        fnames.append(fname)
+
+    def built(number: int, hits: list[int]):
+        fix_hits[number] = hits
+        outputs = [os.path.join(out_dir, f"chapter-{number:03d}.html") for out_dir in (clean_dir, patched_dir)]
+        build_cache.store(number, keys[number], outputs, fix_hits=hits)
+
+    if jobs > 1:
+        logger.info(f"Cleaning {len(fnames)} chapters with {jobs} worker processes, parser {parser}.")
+    try:
+        utl.run_pool(clean_chapter, {fname: (fname, raw_dir, clean_dir, patched_dir, parser) for fname in fnames},
+                     jobs, done=lambda fname, result: built(*result))
+    finally:
+        build_cache.save()  # the chapters built before a failure, for the next run
+    print(build_cache.summary())
+    logger.info(build_cache.summary())
+    report_fix_hits(fix_hits)
     logger.info("SUCCESS.")
 
 if __name__ == "__main__":
-    scrape_all()
+    parser = argparse.ArgumentParser(description="Clean and patch raw chapters for the EPUB.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Chapters to clean in parallel, on a process pool. Default 1, sequential.")
+    parser.add_argument("--parser", choices=utl.html_parsers, default="",
+                        help=f"BeautifulSoup parser backend. Default per config exe_mode parser, now {PARSER}.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Keep prior output, and rebuild only chapters changed since the last build, per {BUILD_CACHE}.")
+    args = parser.parse_args()
+
+    utl.init_logger()
+    init_dirs(args.incremental)
+    scrape_all(jobs=args.jobs, parser=utl.get_html_parser(args.parser), incremental=args.incremental)
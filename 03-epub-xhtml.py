@@ -1,16 +1,19 @@
+import argparse
 import logging
 import csv
-from bs4 import BeautifulSoup
+from bs4.formatter import XMLFormatter
 import os
 import utils.utilities as utl
 import utils.config as config
+from utils.build_cache import BuildCache, sha256_bytes
 
-logger = utl.init_logger()
-# logger = utl.init_logger(level=logging.DEBUG)
-
+# Log file set up by utl.init_logger() when run as a script. Pool workers log through utl.init_worker_logger()
+logger = logging.getLogger(__name__)
 
 config_data = config.load_config()
 debugging = config_data["exe_mode"]["debugging"]
+PARSER = utl.get_html_parser()  # config exe_mode parser, or --parser
+XHTML_FORMAT = config_data["exe_mode"].get("xhtml_format", "pretty")  # or --xhtml-format
 
 # Source Folders
 CHAPTER_SRC = config_data["proj_dirs"]["ch_patched"]  # patched HTML chapters
@@ -22,118 +25,223 @@ CSS_FILES   = sorted(os.listdir(CSS_SRC))
 # New Folders
 OUTPUT_DIR = config_data["proj_dirs"]["ch_xhtml"]     # output XHTML
 
-# Load custom image insertion data, as list of tuples from CSV columns:
-# - img-file: filename of the image to insert (assumed to be in 'images/' directory)
-# - juxtaposition: where to insert the image ('left', 'right', 'center')
-# - anchor-text: Book text used to locate insertion point
-with open(os.path.join(CUSTOM_IMG, "custom_img_locations_final.csv"), encoding="utf-8") as img_csv:
-    custom_img_locations = []
-    reader = csv.DictReader(img_csv)
-    for row in reader:
-        custom_img_locations.append(row)
-
-# make image_insertions a global object, accessible to utilities
-utl.custom_img_locations = custom_img_locations
-
-# Fresh start, unless debugging
-if not debugging:
-    utl.init_dir(OUTPUT_DIR)
-    logger.info("Initialized directory for EPUB XHTML output.")
-else:
-    logger.info("Debugging mode: skipping directory initialization.")
-
-def make_epub_xhtml(chapter_html: str, chapter_number: int, css_files=None, image_insertions=None) -> str:
+# XHTML skeleton, as prettify() of a BeautifulSoup lxml-xml tree would lay it out, or compact.
+# Chapter bodies are serialized into it once, with the XML formatter prettify() used
+XHTML_ROOT = ('<?xml version="1.0" encoding="utf-8"?>\n'
+              '<html lang="en-US" xml:lang="en-US" xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n')
+XHTML_TEMPLATES = {
+    "pretty":  (XHTML_ROOT + " <head>\n  <title>\n   {title}\n  </title>\n{links} </head>\n <body>\n{body} </body>\n</html>\n",
+                '  <link href="{href}" rel="stylesheet" type="text/css"/>\n'),
+    "compact": (XHTML_ROOT + "<head><title>{title}</title>{links}</head><body>{body}</body></html>\n",
+                '<link href="{href}" rel="stylesheet" type="text/css"/>'),
+}
+XHTML_FORMATTER = XMLFormatter.REGISTRY["minimal"]
+
+# Incremental builds: a chapter is rebuilt when its patched HTML, its image rows or images, CSS files, parser,
+# XHTML format or this code changes
+BUILD_CACHE = config_data["proj_dirs"].get("build_cache", ".build_cache")
+CODE_FILES  = [__file__, utl.__file__]
+
+def load_img_locations() -> list[dict]:
+    """
+    Load custom image insertion data, as list of dicts from CSV columns:
+    - img-file: filename of the image to insert (assumed to be in 'images/' directory)
+    - juxtaposition: where to insert the image ('left', 'right', 'center')
+    - anchor-text: Book text used to locate insertion point
+    """
+    with open(os.path.join(CUSTOM_IMG, "custom_img_locations_final.csv"), encoding="utf-8") as img_csv:
+        custom_img_locations = []
+        reader = csv.DictReader(img_csv)
+        for row in reader:
+            custom_img_locations.append(row)
+    return custom_img_locations
+
+def init_dirs(incremental: bool = False):
+    """ Fresh start, unless debugging or incremental """
+    if incremental:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        logger.info("Incremental build: keeping EPUB XHTML output.")
+    elif not debugging:
+        utl.init_dir(OUTPUT_DIR)
+        logger.info("Initialized directory for EPUB XHTML output.")
+    else:
+        logger.info("Debugging mode: skipping directory initialization.")
+
+def make_epub_xhtml(chapter_html: str, chapter_number: int, css_files=None, image_insertions=None,
+                    parser: str = PARSER, xhtml_format: str = XHTML_FORMAT) -> str:
     """
     Wraps cleaned chapter HTML into valid XHTML suitable for EPUB3.
     - chapter_html: cleaned HTML (annotations converted, page anchors inserted)
     - chapter_number: used for title and IDs
     - css_files: list of relative CSS filenames to include (optional)
-    - image_insertions: list of image insertion instructions (optional)
+    - image_insertions: list of image insertion instructions, of this chapter or all (optional)
+    - parser: BeautifulSoup parser backend for the chapter HTML
+    - xhtml_format: "pretty", indented as BeautifulSoup prettify(), or "compact", without added whitespace
     Returns updated image_insertions list and a string containing valid XHTML.
     """
-
-    # Create XHTML skeleton
-    xhtml = BeautifulSoup("", "lxml-xml")
-    html_tag = xhtml.new_tag(
-        "html", **{
-        "xmlns": "http://www.w3.org/1999/xhtml",
-        "xmlns:epub": "http://www.idpf.org/2007/ops",
-        "xml:lang": "en-US",
-        "lang": "en-US"
-    })
-    xhtml.append(html_tag)
-
-    head_tag = xhtml.new_tag("head")
-    html_tag.append(head_tag)
+    if xhtml_format not in XHTML_TEMPLATES:
+        raise ValueError(f"Unknown XHTML format {xhtml_format!r}, expected one of {', '.join(XHTML_TEMPLATES)}")
+    template, link_template = XHTML_TEMPLATES[xhtml_format]
 
     # Title from H1 and H2, title and subtitle classes added in cleaning step
-    chapter_soup = BeautifulSoup(chapter_html, "html.parser")
+    chapter_soup = utl.parse_html(chapter_html, parser)
     h1 = chapter_soup.find("h1", class_="title")
     h2 = chapter_soup.find("h2", class_="subtitle")
 
-    title_tag = xhtml.new_tag("title")
     if h1 and h2:
-        title_tag.string = f"{h1.get_text(strip=True)} {h2.get_text(strip=True)}"
+        title = f"{h1.get_text(strip=True)} {h2.get_text(strip=True)}"
     elif h1:
-        title_tag.string = f"{h1.get_text(strip=True)}"
+        title = f"{h1.get_text(strip=True)}"
     else:
-        title_tag.string = f"Chapter {chapter_number}"
-    head_tag.append(title_tag)
+        title = f"Chapter {chapter_number}"
 
     # Link CSS files if any
-    if css_files:
-        for css in css_files:
-            if css.endswith(".css"):
-                link_tag = xhtml.new_tag("link", rel="stylesheet", type="text/css", href='/'.join([CSS_BOOK, css]))
-                head_tag.append(link_tag)
-
-    # Body
-    body_tag = xhtml.new_tag("body")
-    html_tag.append(body_tag)
+    links = "".join(link_template.format(href=XHTML_FORMATTER.substitute('/'.join([CSS_BOOK, css])))
+                    for css in css_files or [] if css.endswith(".css"))
 
-    # Insert custom images into HTML, added later to body tag in xhtml
-    image_insertions, chapter_html = utl.insert_custom_images(chapter_number, chapter_html, 
-                                                              img_dir=CUSTOM_IMG, img_instructions=image_insertions)
-
-    # Insert the cleaned chapter content into body tag of xhtml
-    chapter_soup = BeautifulSoup(chapter_html, "html.parser")
-    for elem in list(chapter_soup.contents):
-        body_tag.append(elem)
+    # Insert custom images into the parsed chapter, then serialize it once as the body
+    image_insertions = utl.insert_soup_images(chapter_number, chapter_soup, img_dir=CUSTOM_IMG,
+                                              img_instructions=image_insertions or [])
+    indent_level = 2 if xhtml_format == "pretty" else None
+    body = chapter_soup.decode(indent_level=indent_level, formatter=XHTML_FORMATTER)
 
     # Return string representation (XHTML)
-    return image_insertions, xhtml.prettify()
-
-for fname in sorted(os.listdir(CHAPTER_SRC)):
-    if not fname.endswith(".html"):
-        continue
+    return image_insertions, template.format(title=XHTML_FORMATTER.substitute(title.strip()), links=links, body=body)
+
+def chapter_key(build_cache: BuildCache, html_path: str, img_rows: list[dict], parser: str,
+                xhtml_format: str = XHTML_FORMAT) -> str:
+    """ Build key of a chapter: its patched HTML, the image rows that target it and their images """
+    with open(html_path, "rb") as fp:
+        html_sha = sha256_bytes(fp.read())
+    img_index = utl.get_image_index(CUSTOM_IMG)
+    img_shas = [(img_index.get(row["img_rename"]) or {}).get("sha256", "") for row in img_rows]
+    return build_cache.key(html_sha, CSS_FILES, img_rows, img_shas, parser, xhtml_format)
+
+def save_img_log(custom_img_locations: list[dict]):
+    """ Final log of image insertions, overwrite any prior, alongside insert_img.csv """
+    with open(os.path.join(CUSTOM_IMG, "log_insert_img.csv"), "w", encoding="utf-8", newline='') as log_csv:
+        fieldnames = ["text_file","img_name","img_rename","chapter","target_chapter","location",
+                      "preceding_text","following_text","preceding_simp","following_simp","chapters"]
+        writer = csv.DictWriter(log_csv, fieldnames=fieldnames)
+        writer.writeheader()
+        for insertion in custom_img_locations:
+            writer.writerow(insertion)
+
+def report_unplaced(custom_img_locations: list[dict]) -> list[dict]:
+    """ Log the image rows placed in no chapter, and a summary. Return them """
+    unplaced = [row for row in custom_img_locations if not row.get("chapters")]
+    for row in unplaced:
+        logger.warning(f"Unplaced image {row['img_rename']}, chapter {row['chapter']}, location {row['location']}.")
+    summary = f"Placed {len(custom_img_locations) - len(unplaced)} of {len(custom_img_locations)} custom images"
+    if unplaced:
+        summary += f", unplaced: {', '.join(row['img_rename'] for row in unplaced)}"
+    print(f"{summary}.")
+    logger.info(f"{summary}.")
+    return unplaced
+
+def convert_chapter(fname: str, chapter_src: str, output_dir: str, img_rows: list[dict], parser: str = PARSER,
+                    xhtml_format: str = XHTML_FORMAT) -> tuple[int, list[int]]:
+    """ Wrap one patched chapter file in EPUB XHTML, save it. Return the chapter number and the indexes of its placed img_rows """
     number = int(fname.replace("chapter-", "").replace(".html", ""))
+    utl.log_tag.tag = f"chapter {number:03d}"
+    logger.info(f"Processing chapter {number:03d}: {fname}")
 
-    # For debugging specific chapters or ranges
-    if debugging and number != 8:
-        logger.info(f"Skipping chapter {number:03d} in debugging mode.")
-        continue
-    else:
-        logger.info(f"Processing chapter {number:03d}: {fname}")
-
-    with open(os.path.join(CHAPTER_SRC, fname), encoding="utf-8") as fp:
+    with open(os.path.join(chapter_src, fname), encoding="utf-8") as fp:
         html = fp.read()
 
-    # Wrap in EPUB XHTML, update image insertions with locations of any inserted images
-    custom_img_locations, xhtml = make_epub_xhtml(html, number, css_files=CSS_FILES, image_insertions=custom_img_locations)
+    # Wrap in EPUB XHTML, with images inserted in copies of the image rows. build_all merges the placements,
+    # since the changes of a pool worker would not reach it
+    img_rows, xhtml = make_epub_xhtml(html, number, css_files=CSS_FILES, image_insertions=[dict(row) for row in img_rows],
+                                      parser=parser, xhtml_format=xhtml_format)
 
     # Save
     out_fname = f"chapter_{number:03d}.xhtml"
-    with open(os.path.join(OUTPUT_DIR, out_fname), "w", encoding="utf-8") as out_f:
+    with open(os.path.join(output_dir, out_fname), "w", encoding="utf-8") as out_f:
         out_f.write(xhtml)
     logger.info(f"Saved {out_fname}")
+    return number, [idx for idx, row in enumerate(img_rows) if "chapters" in row]
 
-# Final log of image insertions, overwrite any prior, alongside insert_img.csv
-with open(os.path.join(CUSTOM_IMG, "log_insert_img.csv"), "w", encoding="utf-8", newline='') as log_csv:
-    fieldnames = ["text_file","img_name","img_rename","chapter","target_chapter","location",
-                  "preceding_text","following_text","preceding_simp","following_simp","chapters"]
-    writer = csv.DictWriter(log_csv, fieldnames=fieldnames)
-    writer.writeheader()
-    for insertion in custom_img_locations:
-        writer.writerow(insertion)
-
-logger.info("SUCCESS.")
+def build_all(chapter_src: str = CHAPTER_SRC, output_dir: str = OUTPUT_DIR, parser: str = PARSER,
+              incremental: bool = False, cache_dir: str = BUILD_CACHE, xhtml_format: str = XHTML_FORMAT,
+              jobs: int = 1) -> list[dict]:
+    """
+    Wrap every patched chapter in EPUB XHTML, with custom images. Return the image insertions, as logged.
+    With incremental, reuse the XHTML of chapters unchanged since the last build, per the build cache.
+    With jobs > 1, chapters run on a process pool. Each returns the image rows it placed, merged into the same
+    image insertions as a sequential run. The first failing chapter stops the run.
+    """
+    custom_img_locations = load_img_locations()
+
+    # make image_insertions a global object, accessible to utilities
+    utl.custom_img_locations = custom_img_locations
+    img_by_chapter = utl.group_by_chapter(custom_img_locations)
+
+    build_cache = BuildCache("03-epub-xhtml", cache_dir, CODE_FILES)
+    fnames = sorted(fname for fname in os.listdir(chapter_src) if fname.endswith(".html"))
+    build_cache.prune(int(fname.replace("chapter-", "").replace(".html", "")) for fname in fnames)
+
+    def placed(number: int, inserted: list[int]):
+        """ Merge the image rows placed in a chapter. Rows are per chapter, so the merge order does not matter """
+        for idx in inserted:
+            img_by_chapter[number][idx]["chapters"] = [number]
+
+    todo = []
+    keys = {}
+    for fname in fnames:
+        number = int(fname.replace("chapter-", "").replace(".html", ""))
+
+        # For debugging specific chapters or ranges
+        if debugging and number != 8:
+            logger.info(f"Skipping chapter {number:03d} in debugging mode.")
+            continue
+
+        # Image rows of this chapter, before insertion adds their "chapters". Restored from the cache when reused
+        img_rows = img_by_chapter.get(number, [])
+        keys[number] = chapter_key(build_cache, os.path.join(chapter_src, fname), img_rows, parser, xhtml_format)
+        if incremental and (record := build_cache.lookup(number, keys[number])):
+            placed(number, record["inserted"])
+            logger.info(f"Reused chapter {number:03d}, unchanged since the last build.")
+            continue
+        todo.append(fname)
+
+    def built(number: int, inserted: list[int]):
+        placed(number, inserted)
+        build_cache.store(number, keys[number], [os.path.join(output_dir, f"chapter_{number:03d}.xhtml")],
+                          inserted=inserted)
+
+    def chapter_args(fname: str) -> tuple:
+        number = int(fname.replace("chapter-", "").replace(".html", ""))
+        return fname, chapter_src, output_dir, img_by_chapter.get(number, []), parser, xhtml_format
+
+    if jobs > 1:
+        logger.info(f"Converting {len(todo)} chapters with {jobs} worker processes, parser {parser}.")
+    try:
+        utl.run_pool(convert_chapter, {fname: chapter_args(fname) for fname in todo}, jobs,
+                     done=lambda fname, result: built(*result))
+    finally:
+        build_cache.save()  # the chapters built before a failure, for the next run
+    print(build_cache.summary())
+    logger.info(build_cache.summary())
+
+    save_img_log(custom_img_locations)
+    report_unplaced(custom_img_locations)
+    logger.info("SUCCESS.")
+    return custom_img_locations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wrap patched chapters in EPUB XHTML, with custom images.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Chapters to convert in parallel, on a process pool. Default 1, sequential.")
+    parser.add_argument("--parser", choices=utl.html_parsers, default="",
+                        help=f"BeautifulSoup parser backend. Default per config exe_mode parser, now {PARSER}.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Keep prior output, and rebuild only chapters changed since the last build, per {BUILD_CACHE}.")
+    parser.add_argument("--xhtml-format", choices=list(XHTML_TEMPLATES), default=XHTML_FORMAT,
+                        help=f"Indented XHTML, as prettify(), or compact. Default per config exe_mode xhtml_format, now {XHTML_FORMAT}.")
+    args = parser.parse_args()
+
+    utl.init_logger()
+    # utl.init_logger(level=logging.DEBUG)
+    init_dirs(args.incremental)
+    build_all(parser=utl.get_html_parser(args.parser), incremental=args.incremental, xhtml_format=args.xhtml_format,
+              jobs=args.jobs)
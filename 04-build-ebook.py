@@ -4,24 +4,33 @@ A few manual steps are required in the final EPUB book
 - Remove IE6 fixes from the .css stylesheet
 - Replace named-entities like &eacute; in the text, since some e-readers do not support
 """
+import argparse
+import logging
 import os
 import shutil
-import subprocess
-import zipfile
 import uuid
 
-from bs4 import BeautifulSoup
-from epubcheck import EpubCheck
+from concurrent.futures import ThreadPoolExecutor
 import utils.utilities as utl
 import utils.config as config
-
-logger = utl.init_logger()
+import utils.epub_check as epub_check
+from utils.build_cache import BuildCache, sha256_bytes
+from utils.epub_lint import lint_entries
+from utils.epub_zip import EpubEntry, epub_chunks, format_report
+from utils.image_variants import ORIGINAL, variant_dir
+
+# Log file set up by utl.init_logger() when run as a script
+logger = logging.getLogger(__name__)
 config_data = config.load_config()
 version = config_data["exe_mode"]["version"]
 book_id = config_data["exe_mode"]["uuid"]
 debugging = config_data["exe_mode"]["debugging"]
 epub_ref = config_data["exe_mode"]["epub_ref"]
 ttl_lower = config_data["proj_dirs"]["ttl_lower"]
+TTL_IGNORE = utl.ignore_set(ttl_lower)  # lowercased once, for every subtitle
+PARSER = utl.get_html_parser()  # config exe_mode parser, or --parser
+STAGE_EPUB = config_data["exe_mode"].get("stage_epub", False)  # or --stage
+IMAGE_PROFILE = config_data["exe_mode"].get("image_profile", ORIGINAL)  # or --image-profile
 
 # Folders
 IMG_SRC   = config_data["proj_dirs"]["img_dir"]      # source images
@@ -29,257 +38,127 @@ CSS_SRC   = config_data["proj_dirs"]["custom_dir"]   # Custom CSS for EPUB
 XHTML_SRC = config_data["proj_dirs"]["ch_xhtml"]
 CUSTOM_SRC= config_data["proj_dirs"]["custom_dir"]   # custom front and back matter
 CUSTOM_IMG= config_data["proj_dirs"]["custom_img"]   # custom images for EPUB
+IMG_VARIANTS = config_data["proj_dirs"].get("img_variants", "img_variants")  # image variants per profile, of 00-optimize-images.py
+BUILD_CACHE = config_data["proj_dirs"].get("build_cache", ".build_cache")
 
-# EPUB structure - separate releases for Footnotes and Hyperlinks
+# EPUB structure - separate releases for Footnotes and Hyperlinks, per edition_paths(ref)
 EPUB_BOOK = config_data["epub_dirs"]["epub_book"].format(epub_ref)
-EPUB_DIR  = config_data["epub_dirs"]["book_dir"].format(epub_ref)
-MET_DIR   = os.path.join(EPUB_DIR, config_data["epub_dirs"]["meta_dir"])
-OEB_DIR   = os.path.join(EPUB_DIR, config_data["epub_dirs"]["oeb_dir"])
-CSS_DIR   = os.path.join(OEB_DIR, config_data["epub_dirs"]["css_dir"])
-IMG_DIR   = os.path.join(OEB_DIR, config_data["epub_dirs"]["img_dir"])
-
-# contents.opf manifest and spine entries
-chapters = ['<li><a href="ca-001.xhtml">Cover 1851.</a></li>',
-            '        <li><a href="ca-002.xhtml">Front pages 1851.</a></li>',
-            '        <li><a href="ca-003.xhtml">Notes from the editor.</a></li>',
-            '        <li><a href="toc.xhtml">Contents.</a></li>'
-           ]
-opf_mani = ['<item id="ca-001" href="ca-001.xhtml" media-type="application/xhtml+xml" properties="svg"/>', 
-            '    <item id="ca-002" href="ca-002.xhtml" media-type="application/xhtml+xml" properties="svg"/>',
-            '    <item id="ca-003" href="ca-003.xhtml" media-type="application/xhtml+xml"/>',
-            '    <item id="toc" href="toc.xhtml" media-type="application/xhtml+xml"/>'
-            ]
-opf_spin = ['<itemref idref="ca-001"/>', 
-            '    <itemref idref="ca-002"/>',
-            '    <itemref idref="ca-003"/>',
-            '    <itemref idref="toc"/>'
-            ]
-
-# 1. Create temp folder structure, fresh start - so remove EPUB_DIR target dir
-if os.path.exists(EPUB_BOOK):
-  os.remove(EPUB_BOOK)
-  logger.info(f"Removed prior epub \"{EPUB_BOOK}\".")
-
-utl.init_dir(EPUB_DIR)
-utl.init_dir(MET_DIR)
-utl.init_dir(OEB_DIR)
-utl.init_dir(CSS_DIR)
-utl.init_dir(IMG_DIR)
-
-# 2. Copy XHTML chapter(s) into OEBPS
-for fname in os.listdir(XHTML_SRC):
+
+# Paths in the EPUB zip. META-INF and OEBPS as in container.xml, below
+CSS_ARC   = "/".join(["OEBPS", config_data["epub_dirs"]["css_dir"]])
+IMG_ARC   = "/".join(["OEBPS", config_data["epub_dirs"]["img_dir"]])
+
+# contents.opf manifest and spine entries, and TOC entries, of the front matter. build_epub adds the rest
+toc_front = ['<li><a href="ca-001.xhtml">Cover 1851.</a></li>',
+             '        <li><a href="ca-002.xhtml">Front pages 1851.</a></li>',
+             '        <li><a href="ca-003.xhtml">Notes from the editor.</a></li>',
+             '        <li><a href="toc.xhtml">Contents.</a></li>'
+             ]
+opf_mani_front = ['<item id="ca-001" href="ca-001.xhtml" media-type="application/xhtml+xml" properties="svg"/>', 
+                  '    <item id="ca-002" href="ca-002.xhtml" media-type="application/xhtml+xml" properties="svg"/>',
+                  '    <item id="ca-003" href="ca-003.xhtml" media-type="application/xhtml+xml"/>',
+                  '    <item id="toc" href="toc.xhtml" media-type="application/xhtml+xml"/>'
+                  ]
+opf_spin_front = ['<itemref idref="ca-001"/>', 
+                  '    <itemref idref="ca-002"/>',
+                  '    <itemref idref="ca-003"/>',
+                  '    <itemref idref="toc"/>'
+                  ]
+
+def toc_headers(content: str, parser: str = PARSER) -> list[tuple[str, list[str]]]:
+    """ [(H1 title, without a leading "CHAPTER ", [texts of its sibling H2 subtitles])] of one chapter_xxx.xhtml """
+    return [(h1_tag.get_text().replace("CHAPTER ", "").strip(),
+             [h2_tag.get_text().strip() for h2_tag in h1_tag.find_next_siblings("h2")])
+            for h1_tag in utl.parse_html(content, parser).find_all("h1")]
+
+def build_toc_entry(fname: str, headers: list[tuple[str, list[str]]], subtitles: dict[str, str]) -> str:
     '''
-    Copy each chapter_xxx.xhtml into OEBPS, and build TOC entries from H1 Title and H2 Subtitle tags.
+    TOC entry of one chapter_xxx.xhtml, from its H1 Title and H2 Subtitle tags, per toc_headers.
+    subtitles: {H2 text: Title Case}, of every single H2 subtitle, per toc_entries.
     - Rules for TOC entries:
       - Remove any leading "CHAPTER " from H1, UPPERCASED during previous cleaning
       - If only H1 title, TOC entry is H1-text (without the leading "CHAPTER ")
       - If exactly one H2 subtitle, collapse to one entry, H1-text. - H2-text.
       - Otherwise nest sibling H2 subtitles as ordered list within H1 title entry
     - Title Case for H2 text, only (leave H1 as-is)
-    - Add each chapter to manifest and spine in contents.opf
     '''
-    if fname.endswith(".xhtml"):
-        chapter_number = int(fname.replace("chapter_", "").replace(".xhtml", ""))
-
-        # For debugging
-        if debugging and chapter_number != 0:
-            continue
-
-        with open(os.path.join(XHTML_SRC, fname), "r", encoding="utf-8") as f:
-            content = f.read()
-
-            # For back-reference to header IDs in chapters
-            ttlcnt  = 0
-            sttlcnt = 0
-
-            soup = BeautifulSoup(content, "html.parser")
-            h1_tags = soup.find_all("h1")
-
-            # Build a TOC entry for every H1 title
-            toc_entry = ""
-            for h1_tag in h1_tags:
-                ttl = h1_tag.get_text().replace("CHAPTER ", "").strip()
-                ttlcnt += 1
-
-                extra_br = ""
-                if ttlcnt > 1:
-                    extra_br = "\n"
-
-                h2_tags = h1_tag.find_next_siblings("h2")
-
-                if not h2_tags:
-                    # No Subtitles, only the Chapter entry for PMD "chapters" like 137 through 150
-                    ttl = ttl.title()
-                    toc_entry += f'{extra_br}        <li><a href="{fname}#title_{ttlcnt:03d}">{ttl}</a></li>'
-                    logger.info(f'Created Title-only TOC entry for {fname}, from title "{ttl}".')
+    # For back-reference to header IDs in chapters
+    ttlcnt  = 0
+    sttlcnt = 0
+
+    # Build a TOC entry for every H1 title
+    toc_entry = ""
+    for ttl, h2_texts in headers:
+        ttlcnt += 1
+
+        extra_br = ""
+        if ttlcnt > 1:
+            extra_br = "\n"
+
+        if not h2_texts:
+            # No Subtitles, only the Chapter entry for PMD "chapters" like 137 through 150
+            ttl = ttl.title()
+            toc_entry += f'{extra_br}        <li><a href="{fname}#title_{ttlcnt:03d}">{ttl}</a></li>'
+            logger.info(f'Created Title-only TOC entry for {fname}, from title "{ttl}".')
+        else:
+            # Handle custom TOC entry cases for PMD chapters, below.
+            # Case-insensitive comparison, while preserving original PMD casing in toc_entry
+            if len(h2_texts) == 1:
+                sttlcnt += 1
+                # User custom Title Case, that handles contractions, and lowercases small words
+                subtitle = subtitles[h2_texts[0]]
+                if subtitle:
+                    # Exactly one Subtitle for most PMD chapters, 1 through 135
+                    # Handle custom TOC entry cases for PMD chapter
+                    # 1:   I. - LOOMINGS.
+                    if ttl.upper() == "I." and subtitle.upper() == "LOOMINGS.":
+                        toc_entry += f'{extra_br}        <li><a href="{fname}#Page_Loomings">{ttl} - {subtitle}</a></li>'
+                    else:
+                        toc_entry += f'{extra_br}        <li><a href="{fname}#title_{ttlcnt:03d}">{ttl} - {subtitle}</a></li>'
+                    logger.info(f'Created Title - Subtitle TOC entry for {fname}, from title "{ttl}" and "{subtitle}".')
                 else:
-                    # Handle custom TOC entry cases for PMD chapters, below.
-                    # Case-insensitive comparison, while preserving original PMD casing in toc_entry
-                    len_h2_tags = len(h2_tags)
-
-                    if len_h2_tags == 1:
-                        sttlcnt += 1
-                        # User custom Title Case function that handles contractions, and lowercases small words
-                        subtitle = utl.titlecase(h2_tags[0].get_text().strip(), ignore=ttl_lower)
-                        if subtitle:
-                            # Exactly one Subtitle for most PMD chapters, 1 through 135
-                            # Handle custom TOC entry cases for PMD chapter
-                            # 1:   I. - LOOMINGS.
-                            if ttl.upper() == "I." and subtitle.upper() == "LOOMINGS.":
-                                toc_entry += f'{extra_br}        <li><a href="{fname}#Page_Loomings">{ttl} - {subtitle}</a></li>'
-                            else:
-                                toc_entry += f'{extra_br}        <li><a href="{fname}#title_{ttlcnt:03d}">{ttl} - {subtitle}</a></li>'
-                            logger.info(f'Created Title - Subtitle TOC entry for {fname}, from title "{ttl}" and "{subtitle}".')
-                        else:
-                            # Title only, empty H2 Subtitle tag, for Epilogue chapter 136
-                            # Handle custom TOC entry cases for PMD chapter
-                            # 136: CXXXVI. EPILOGUE.
-                            if ttl.upper() == "CXXXVI. EPILOGUE.":
-                                toc_entry += f'{extra_br}        <li><a href="{fname}#Page_Epilogue">CXXXVI. Epilogue.</a></li>'
-                            else:
-                                ttl = ttl.title()
-                                toc_entry += f'{extra_br}        <li><a href="{fname}#title_{ttlcnt:03d}">{ttl}</a></li>'
-                            logger.info(f'Created Title-only TOC entry for {fname}, from title "{ttl}" and "{subtitle}".')
+                    # Title only, empty H2 Subtitle tag, for Epilogue chapter 136
+                    # Handle custom TOC entry cases for PMD chapter
+                    # 136: CXXXVI. EPILOGUE.
+                    if ttl.upper() == "CXXXVI. EPILOGUE.":
+                        toc_entry += f'{extra_br}        <li><a href="{fname}#Page_Epilogue">CXXXVI. Epilogue.</a></li>'
                     else:
-                        # Multiple Subtitle sections. Nest the subtitles in PMD front-matter "chapter" 0
-                        # 0:   (H1)FRONT MATTER., (H2)ETYMOLOGY AND EXTRACTS., (H2)ETYMOLOGY., (H2)EXTRACTS.
-                        if ttl.upper() == "FRONT MATTER.":
-                            ttl = "Front Matter."
-                            toc_entry += f'{extra_br}        <li><a href="{fname}#Page_FrontMatter">{ttl}</a><ol class="nav-toc">'
-                        else:
-                            ttl = ttl.title()
-                            toc_entry += f'{extra_br}        <li><a href="{fname}#title_{ttlcnt:03d}">{ttl}</a><ol class="nav-toc">'
-
-                        for h2_tag in h2_tags:
-                            sttlcnt += 1
-                            subtitle = h2_tag.get_text().strip().title()
-                            if subtitle:
-                                if ttl.upper() == "FRONT MATTER.":
-                                    if subtitle.upper() == "ETYMOLOGY AND EXTRACTS.":
-                                        subtitle = "Dedication."
-                                        toc_entry += f'\n            <li><a href="{fname}#Page_Dedication">{subtitle}</a></li>'
-                                    elif subtitle.upper() == "ETYMOLOGY.":
-                                        toc_entry += f'\n            <li><a href="{fname}#Page_Etymology">{subtitle}</a></li>'
-                                    elif subtitle.upper() == "EXTRACTS.":
-                                        toc_entry += f'\n            <li><a href="{fname}#Page_Extracts">{subtitle}</a></li>'
-                                else:
-                                    toc_entry += f'\n            <li><a href="{fname}#subtitle_{sttlcnt:03d}">{subtitle}</a></li>'
-                        toc_entry += '\n        </ol></li>'
-                        logger.info(f'Created Title nested Subtitle TOC entries for {fname}.')
-
-        chapters.append(toc_entry)
-
-        with open(os.path.join(OEB_DIR, fname), "w", encoding="utf-8") as f:
-            f.write(content)
-
-        # Log manifest and spine for each chapter, for contents.opf
-        opf_mani.append(f'    <item id="chapter_{chapter_number:03d}" href="chapter_{chapter_number:03d}.xhtml" media-type="application/xhtml+xml"/>')
-        opf_spin.append(f'    <itemref idref="chapter_{chapter_number:03d}"/>')
-    logger.info(f"Copied chapter {chapter_number:03d} to EPUB {OEB_DIR}.")
-
-# add in the custom pages and fonts
-for fname in os.listdir(CUSTOM_SRC):
-    if fname.endswith('.xhtml') or fname.endswith('.ttf'):
-      shutil.copy(os.path.join("custom", fname), OEB_DIR)
-    logger.info(f"Copied custom file {fname} to EPUB {OEB_DIR}.")
-
-chapters.append('        <li><a href="license.xhtml">Ebook license.</a></li>')
-chapters.append('        <li><a href="cz-001.xhtml">Back pages and cover 1851.</a></li>')
-
-opf_mani.append('    <item id="license" href="license.xhtml" media-type="application/xhtml+xml"/>')
-opf_mani.append('    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>')
-opf_mani.append('    <item id="cz-001" href="cz-001.xhtml" media-type="application/xhtml+xml" properties="svg"/>')
-
-opf_spin.append('    <itemref idref="license"/>')
-opf_spin.append('    <itemref idref="cz-001"/>')
-# Do not add navigation doc to spine
-# opf_spin.append('    <itemref idref="nav"/>')
-
-# 3. Copy CSS from CSS_SRC to CSS_DIR in EPUB_DIR
-cssidx=0
-for fname in os.listdir(CSS_SRC):
-    if fname.endswith(".css"):
-        cssidx+=1
-        with open(os.path.join(CSS_SRC, fname), "r", encoding="utf-8") as f:
-            css_content = f.read()
-        with open(os.path.join(CSS_DIR, fname), "w", encoding="utf-8") as f:
-            f.write(css_content)
-        opf_mani.append(f'    <item id="css_{cssidx:03d}" href="css/{fname}" media-type="text/css"/>')
-
-# 3. Copy images, jpg, from IMG_SRC and from CUSTOM_IMG to IMG_DIR in EPUB_DIR
-for dirpath in [IMG_SRC, CUSTOM_IMG]:
-    for fname in os.listdir(dirpath):
-        if fname.endswith('.jpg'):
-            try:
-                shutil.copy(os.path.join(dirpath, fname), IMG_DIR)
-                if fname == "cover.jpg":
-                    prop_cover='properties="cover-image"'
+                        ttl = ttl.title()
+                        toc_entry += f'{extra_br}        <li><a href="{fname}#title_{ttlcnt:03d}">{ttl}</a></li>'
+                    logger.info(f'Created Title-only TOC entry for {fname}, from title "{ttl}" and "{subtitle}".')
+            else:
+                # Multiple Subtitle sections. Nest the subtitles in PMD front-matter "chapter" 0
+                # 0:   (H1)FRONT MATTER., (H2)ETYMOLOGY AND EXTRACTS., (H2)ETYMOLOGY., (H2)EXTRACTS.
+                if ttl.upper() == "FRONT MATTER.":
+                    ttl = "Front Matter."
+                    toc_entry += f'{extra_br}        <li><a href="{fname}#Page_FrontMatter">{ttl}</a><ol class="nav-toc">'
                 else:
-                    prop_cover=""
-                opf_mani.append(f'    <item id="{fname.replace(".jpg", "")}" href="images/{fname}" media-type="image/jpeg" {prop_cover}/>')
-            except Exception as exc:
-                logger.error(f"Failed to copy image {fname} from {dirpath} to EPUB images: {exc}")
-
-# 4. Create mimetype (must be uncompressed)
-with open(f"{EPUB_DIR}/mimetype", "w", encoding="utf-8") as f:
-    f.write("application/epub+zip")
-
-# 5. Create META-INF/container.xml
-container_xml = '''<?xml version="1.0" encoding="UTF-8" ?>
-<container version="1.0"
-           xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
-  <rootfiles>
-    <rootfile full-path="OEBPS/content.opf"
-              media-type="application/oebps-package+xml"/>
-  </rootfiles>
-</container>
-'''
-with open(os.path.join(MET_DIR, "container.xml"), "w", encoding="utf-8") as f:
-    f.write(container_xml)
-
-# 6. Create content.opf
-
-opf_mani.append('    <item id="id-4" href="font_CSIL.ttf" media-type="application/vnd.ms-opentype"/>')
-opf_mani.append('    <item id="id-2" href="font_DanteMT.ttf" media-type="application/vnd.ms-opentype"/>')
-
-created_date = utl.get_utc_now().strip()
-
-opf_all=f'''<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="uuid_id" version="3.0">
-  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" 
-            xmlns:epub="http://www.idpf.org/2007/ops" xmlns:opf="http://www.idpf.org/2007/opf" 
-            xmlns:svg="http://www.w3.org/2000/svg" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
-    <dc:title id="title">Moby-Dick; Or, The Whale (Power)</dc:title>
-    <dc:title id="fulltitle">Moby-Dick; Or, The Whale (Power, {epub_ref}, v{version})</dc:title>
-    <dc:creator id="author">Herman Melville</dc:creator>
-    <dc:publisher>Power Moby Dick</dc:publisher>
-    <dc:language>en</dc:language>
-    <dc:identifier id="uuid_id">urn:uuid:{book_id}</dc:identifier>
-    <dc:date>1851-11-14T00:00:00+00:00</dc:date>
-    <opf:meta property="dcterms:modified">{created_date}</opf:meta>
-    <opf:meta refines="#title" property="title-type">main</opf:meta>
-    <opf:meta refines="#title" property="file-as">Moby-Dick; Or, The Whale (Power)</opf:meta>
-    <opf:meta refines="#fulltitle" property="title-type">extended</opf:meta>
-    <opf:meta refines="#author" property="role" scheme="marc:relators">aut</opf:meta>
-    <opf:meta refines="#author" property="file-as">Melville, Herman</opf:meta>
-  </metadata>
-
-  <manifest>
-    {"\n".join([next for next in opf_mani])}
-  </manifest>
+                    ttl = ttl.title()
+                    toc_entry += f'{extra_br}        <li><a href="{fname}#title_{ttlcnt:03d}">{ttl}</a><ol class="nav-toc">'
 
-  <spine>
-    {"\n".join([next for next in opf_spin])}
-  </spine>
-</package>
-'''
-with open(os.path.join(OEB_DIR, "content.opf"), "w", encoding="utf-8") as f:
-    f.write(opf_all)
+                for h2_text in h2_texts:
+                    sttlcnt += 1
+                    subtitle = h2_text.title()
+                    if subtitle:
+                        if ttl.upper() == "FRONT MATTER.":
+                            if subtitle.upper() == "ETYMOLOGY AND EXTRACTS.":
+                                subtitle = "Dedication."
+                                toc_entry += f'\n            <li><a href="{fname}#Page_Dedication">{subtitle}</a></li>'
+                            elif subtitle.upper() == "ETYMOLOGY.":
+                                toc_entry += f'\n            <li><a href="{fname}#Page_Etymology">{subtitle}</a></li>'
+                            elif subtitle.upper() == "EXTRACTS.":
+                                toc_entry += f'\n            <li><a href="{fname}#Page_Extracts">{subtitle}</a></li>'
+                        else:
+                            toc_entry += f'\n            <li><a href="{fname}#subtitle_{sttlcnt:03d}">{subtitle}</a></li>'
+                toc_entry += '\n        </ol></li>'
+                logger.info(f'Created Title nested Subtitle TOC entries for {fname}.')
+    return toc_entry
 
 # 7. Create toc.xhtml chapter, and nav.xhtml navigation element
 # Create separate TOC and Nav, with similar content, since e-readers don't agree
 # 1 - as an OEBPS/toc.xhtml, with images and without item attribute properties="nav"
 # 2 - without images, as a root nav.xhtml and with item attribute properties="nav"
-def write_nav_xhtml (dest="nav") -> int:
+def make_nav_xhtml (chapters: list[str], dest="nav") -> tuple[str, str]:
     nav_id="nav"
     head='''<head>
         <title>Navigation</title>
@@ -318,52 +197,309 @@ def write_nav_xhtml (dest="nav") -> int:
     </body>
     </html>
     '''
-    with open(os.path.join(OEB_DIR, f"{nav_id}.xhtml"), "w", encoding="utf-8") as f:
-        f.write(nav_xhtml)
+    logger.info(f"{dest.upper()} created for epub as {nav_id}.xhtml")
+
+    return f"{nav_id}.xhtml", nav_xhtml
+
+def edition_paths(ref: str = epub_ref) -> tuple[str, str]:
+    """ EPUB book and staging folder of the edition ref, foot or link """
+    return config_data["epub_dirs"]["epub_book"].format(ref), config_data["epub_dirs"]["book_dir"].format(ref)
+
+def load_xhtml(xhtml_dir: str = XHTML_SRC) -> dict[str, str]:
+    """ {file name: XHTML} of the chapters from 03-epub-xhtml.py, in book order """
+    xhtml_chapters = {}
+    for fname in sorted(os.listdir(xhtml_dir)):
+        if fname.endswith(".xhtml"):
+            with open(os.path.join(xhtml_dir, fname), "r", encoding="utf-8") as f:
+                xhtml_chapters[fname] = f.read()
+    return xhtml_chapters
+
+def toc_entries(xhtml_chapters: dict[str, str], parser: str = PARSER, incremental: bool = False,
+                cache_dir: str = BUILD_CACHE) -> dict[str, str]:
+    """
+    {file name: TOC entry} of the XHTML chapters, {file name: XHTML}, with build_toc_entry.
+    The same for both editions, which differ in their notes only, not in their headers.
+    Incremental builds: reuse the TOC entry of a chapter while its XHTML, ttl_lower, parser and this code are unchanged
+    The single subtitles of all the chapters to build are Title Cased at once, with titlecase_many
+    """
+    build_cache = BuildCache("04-build-ebook", cache_dir, [__file__, utl.__file__])
+    build_cache.prune(int(fname.replace("chapter_", "").replace(".xhtml", "")) for fname in xhtml_chapters)
+    entries, todo = {}, {}
+    for fname, content in xhtml_chapters.items():
+        chapter_number = int(fname.replace("chapter_", "").replace(".xhtml", ""))
 
-    logger.info(f"{dest.upper()} written successfully to epub as {nav_id}.xhtml")
+        # For debugging
+        if debugging and chapter_number != 0:
+            continue
 
-    return 0
+        key = build_cache.key(sha256_bytes(content.encode("utf-8")), ttl_lower, parser)
+        if incremental and (record := build_cache.lookup(chapter_number, key)):
+            entries[fname] = record["toc_entry"]
+        else:
+            entries[fname] = None  # in chapter order, built below
+            todo[fname] = (chapter_number, key, toc_headers(content, parser))
+
+    texts = list(dict.fromkeys(h2_texts[0] for _, _, headers in todo.values()
+                               for _, h2_texts in headers if len(h2_texts) == 1))
+    subtitles = dict(zip(texts, utl.titlecase_many(texts, ignore=TTL_IGNORE)))
+    for fname, (chapter_number, key, headers) in todo.items():
+        entries[fname] = build_toc_entry(fname, headers, subtitles)
+        build_cache.store(chapter_number, key, [], toc_entry=entries[fname])
+    build_cache.save()
+    print(build_cache.summary())
+    logger.info(build_cache.summary())
+    return entries
+
+def build_epub(xhtml_chapters: dict[str, str], parser: str = PARSER, incremental: bool = False,
+               cache_dir: str = BUILD_CACHE, stage: bool = STAGE_EPUB, jobs: int = 1,
+               ref: str = epub_ref, toc: dict[str, str] | None = None, image_profile: str = IMAGE_PROFILE) -> str:
+    """
+    Zip the EPUB of the edition ref from XHTML chapters, {file name: XHTML} in book order, and the custom files,
+    CSS and images. Entries go straight from their sources into the zip. Return its path.
+    With stage, also copy the entries into the EPUB-{ref} folder, to inspect them. With jobs > 1, compress entries on threads.
+    toc, {file name: TOC entry}, as from toc_entries, or else toc_entries runs here.
+    Images are the variants of image_profile from 00-optimize-images.py, or the source images for original.
+    Before zipping, utils/epub_lint checks ids, links, manifest and spine. Its errors raise RuntimeError.
+    With incremental, reuse the TOC entries of chapters unchanged since the last build, per the build cache.
+    """
+    chapters = list(toc_front)
+    opf_mani = list(opf_mani_front)
+    opf_spin = list(opf_spin_front)
+
+    epub_book, epub_dir = edition_paths(ref)
+    met_dir = os.path.join(epub_dir, config_data["epub_dirs"]["meta_dir"])
+    oeb_dir = os.path.join(epub_dir, config_data["epub_dirs"]["oeb_dir"])
+    css_dir = os.path.join(oeb_dir, config_data["epub_dirs"]["css_dir"])
+    img_dir = os.path.join(oeb_dir, config_data["epub_dirs"]["img_dir"])
+
+    # 1. Remove the prior EPUB. With stage, create the temp folder structure, fresh start - so remove epub_dir target dir
+    if os.path.exists(epub_book):
+      os.remove(epub_book)
+      logger.info(f"Removed prior epub \"{epub_book}\".")
+
+    if stage:
+        utl.init_dir(epub_dir)
+        utl.init_dir(met_dir)
+        utl.init_dir(oeb_dir)
+        utl.init_dir(css_dir)
+        utl.init_dir(img_dir)
+
+    # {path in the zip: entry}. A later entry of the same path replaces the earlier, as a copy over it would
+    entries = {}
+    def add(arcname: str, stage_dir: str, data: bytes = None, src: str = ""):
+        """ Add an EPUB entry, from data or from the file src. With stage, also copy it into stage_dir """
+        entries[arcname] = EpubEntry(arcname, data, src)
+        if stage:
+            if src:
+                shutil.copy(src, stage_dir)
+            else:
+                with open(os.path.join(stage_dir, arcname.split("/")[-1]), "wb") as f:
+                    f.write(data)
+
+    # 2. Copy XHTML chapter(s) into OEBPS, with their TOC entries from build_toc_entry
+    if toc is None:
+        toc = toc_entries(xhtml_chapters, parser, incremental, cache_dir)
+    for fname, content in xhtml_chapters.items():
+        chapter_number = int(fname.replace("chapter_", "").replace(".xhtml", ""))
 
-# Write these directly to EPUB location
-write_nav_xhtml("nav")
-write_nav_xhtml("toc")
+        # For debugging
+        if debugging and chapter_number != 0:
+            continue
 
-# 8. Create EPUB zip
-with zipfile.ZipFile(EPUB_BOOK, 'w') as epub:
-    # mimetype must be first and uncompressed
-    epub.write(f"{EPUB_DIR}/mimetype", "mimetype", compress_type=zipfile.ZIP_STORED)
+        chapters.append(toc[fname])
 
-    # nav.xhtml with NAV property to same ebook destination
-    # epub.write(f"{OEB_DIR}/nav.xhtml", "OEBPS/nav.xhtml")
+        add(f"OEBPS/{fname}", oeb_dir, content.encode("utf-8"))
 
-    # Add META-INF folder
-    for root, dirs, files in os.walk(MET_DIR):
-        for file in files:
-            epub.write(os.path.join(root, file),
-                       os.path.join("META-INF", file))
+        # Log manifest and spine for each chapter, for contents.opf
+        opf_mani.append(f'    <item id="chapter_{chapter_number:03d}" href="chapter_{chapter_number:03d}.xhtml" media-type="application/xhtml+xml"/>')
+        opf_spin.append(f'    <itemref idref="chapter_{chapter_number:03d}"/>')
+        logger.info(f"Copied chapter {chapter_number:03d} to EPUB {oeb_dir}.")
+
+    # add in the custom pages and fonts
+    for fname in os.listdir(CUSTOM_SRC):
+        if fname.endswith('.xhtml') or fname.endswith('.ttf'):
+          add(f"OEBPS/{fname}", oeb_dir, src=os.path.join("custom", fname))
+        logger.info(f"Copied custom file {fname} to EPUB {oeb_dir}.")
+
+    chapters.append('        <li><a href="license.xhtml">Ebook license.</a></li>')
+    chapters.append('        <li><a href="cz-001.xhtml">Back pages and cover 1851.</a></li>')
+
+    opf_mani.append('    <item id="license" href="license.xhtml" media-type="application/xhtml+xml"/>')
+    opf_mani.append('    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>')
+    opf_mani.append('    <item id="cz-001" href="cz-001.xhtml" media-type="application/xhtml+xml" properties="svg"/>')
+
+    opf_spin.append('    <itemref idref="license"/>')
+    opf_spin.append('    <itemref idref="cz-001"/>')
+    # Do not add navigation doc to spine
+    # opf_spin.append('    <itemref idref="nav"/>')
+
+    # 3. Copy CSS from CSS_SRC to css_dir in epub_dir
+    cssidx=0
+    for fname in os.listdir(CSS_SRC):
+        if fname.endswith(".css"):
+            cssidx+=1
+            with open(os.path.join(CSS_SRC, fname), "r", encoding="utf-8") as f:
+                css_content = f.read()
+            add(f"{CSS_ARC}/{fname}", css_dir, css_content.encode("utf-8"))
+            opf_mani.append(f'    <item id="css_{cssidx:03d}" href="css/{fname}" media-type="text/css"/>')
+
+    # 3. Copy images, jpg, from IMG_SRC and from CUSTOM_IMG, or their variants for image_profile, to img_dir in epub_dir
+    for dirpath in [IMG_SRC, CUSTOM_IMG]:
+        img_index = utl.get_image_index(dirpath)
+        pkg_dir = variant_dir(dirpath, image_profile, IMG_VARIANTS)
+        if not os.path.isdir(pkg_dir):
+            raise FileNotFoundError(f"No {image_profile} images in {pkg_dir}. Run 00-optimize-images.py --profile {image_profile}")
+        for fname in os.listdir(pkg_dir):
+            if fname.endswith('.jpg'):
+                try:
+                    add(f"{IMG_ARC}/{fname}", img_dir, src=os.path.join(pkg_dir, fname))
+                    if fname == "cover.jpg":
+                        prop_cover='properties="cover-image"'
+                    else:
+                        prop_cover=""
+                    opf_mani.append(f'    <item id="{fname.replace(".jpg", "")}" href="images/{fname}" media-type="{img_index.media_type(fname)}" {prop_cover}/>')
+                except Exception as exc:
+                    logger.error(f"Failed to copy image {fname} from {pkg_dir} to EPUB images: {exc}")
 
-    # Add OEBPS folder
-    for root, dirs, files in os.walk(OEB_DIR):
-        for file in files:
-            full_path = os.path.join(root, file)
-            arc_path = os.path.join("OEBPS", os.path.relpath(full_path, OEB_DIR))
-            epub.write(full_path, arc_path)
+    # 4. Create mimetype (must be uncompressed)
+    add("mimetype", epub_dir, b"application/epub+zip")
 
-# Book created
-logger.info(f"EPUB created: {EPUB_BOOK}")
+    # 5. Create META-INF/container.xml
+    container_xml = '''<?xml version="1.0" encoding="UTF-8" ?>
+<container version="1.0"
+           xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf"
+              media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+    add("META-INF/container.xml", met_dir, container_xml.encode("utf-8"))
 
-# pyresult.valid for log
-pyresult = EpubCheck(EPUB_BOOK)
+    # 6. Create content.opf
 
-if pyresult.valid:
-    logger.info("EpubCheck validation SUCCESS!")
-else:
-    logger.warning(f"EpubCheck validation FAIL! Messages {pyresult.messages}")
+    opf_mani.append('    <item id="id-4" href="font_CSIL.ttf" media-type="application/vnd.ms-opentype"/>')
+    opf_mani.append('    <item id="id-2" href="font_DanteMT.ttf" media-type="application/vnd.ms-opentype"/>')
 
-# Create XLS as record of any epubcheck messages
-sysresult = subprocess.run(f"epubcheck -x EPUB-{epub_ref}.xls \"{EPUB_BOOK}\"")
-logger.info(f"System EpubCheck stdout: {sysresult.stdout}, stderr: {sysresult.stderr}") 
+    created_date = utl.get_utc_now().strip()
 
-logger.info(f"EPUB created and checked: {EPUB_BOOK}.")
-logger.info(f"See EPUB-{epub_ref}.xls.")
+    opf_all=f'''<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="uuid_id" version="3.0">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" 
+            xmlns:epub="http://www.idpf.org/2007/ops" xmlns:opf="http://www.idpf.org/2007/opf" 
+            xmlns:svg="http://www.w3.org/2000/svg" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+    <dc:title id="title">Moby-Dick; Or, The Whale (Power)</dc:title>
+    <dc:title id="fulltitle">Moby-Dick; Or, The Whale (Power, {ref}, v{version})</dc:title>
+    <dc:creator id="author">Herman Melville</dc:creator>
+    <dc:publisher>Power Moby Dick</dc:publisher>
+    <dc:language>en</dc:language>
+    <dc:identifier id="uuid_id">urn:uuid:{book_id}</dc:identifier>
+    <dc:date>1851-11-14T00:00:00+00:00</dc:date>
+    <opf:meta property="dcterms:modified">{created_date}</opf:meta>
+    <opf:meta refines="#title" property="title-type">main</opf:meta>
+    <opf:meta refines="#title" property="file-as">Moby-Dick; Or, The Whale (Power)</opf:meta>
+    <opf:meta refines="#fulltitle" property="title-type">extended</opf:meta>
+    <opf:meta refines="#author" property="role" scheme="marc:relators">aut</opf:meta>
+    <opf:meta refines="#author" property="file-as">Melville, Herman</opf:meta>
+  </metadata>
+
+  <manifest>
+    {"\n".join([next for next in opf_mani])}
+  </manifest>
+
+  <spine>
+    {"\n".join([next for next in opf_spin])}
+  </spine>
+</package>
+'''
+    add("OEBPS/content.opf", oeb_dir, opf_all.encode("utf-8"))
+
+    for dest in ("nav", "toc"):
+        nav_fname, nav_xhtml = make_nav_xhtml(chapters, dest)
+        add(f"OEBPS/{nav_fname}", oeb_dir, nav_xhtml.encode("utf-8"))
+
+    # 8. Pre-validate ids, internal links, manifest and spine, in well under a second. Errors stop the build, unzipped
+    lint = lint_entries(entries)
+    for warning in lint.warnings:
+        logger.warning(warning)
+    for error in lint.errors:
+        logger.error(error)
+    print(lint.summary())
+    logger.info(lint.summary())
+    if lint.errors:
+        raise RuntimeError(f"EPUB pre-validation failed, {len(lint.errors)} errors, first: {lint.errors[0]}")
+
+    # 9. Create EPUB zip: mimetype first and uncompressed, text and fonts deflated, images stored
+    size_report = {}
+    size = utl.write_atomic(epub_chunks(list(entries.values()), jobs=jobs, report=size_report), epub_book)
+    os.chmod(epub_book, 0o644)  # not the 0o600 of the temp file
+    report_lines = format_report(size_report, size)
+    print("\n".join([f"{epub_book}:"] + report_lines))  # one write, not to interleave with another edition's
+    for line in report_lines:
+        logger.info(line)
+
+    # Book created
+    logger.info(f"EPUB created: {epub_book}")
+    return epub_book
+
+def check_epubs(epub_books: dict[str, str], cache_dir: str = BUILD_CACHE) -> dict[str, bool]:
+    """
+    Validate the EPUBs, {ref: path}, with EpubCheck, log the results, and record any messages as XLS, EPUB-{ref}.xls.
+    Return {ref: valid}.
+    - One EpubCheck run per book gives both the verdict and the messages
+    - A book unchanged since its last check, per epub_check.content_hash, reuses that result, without Java
+    - Books run concurrently, each in its own EpubCheck process
+    """
+    build_cache = BuildCache("04-epubcheck", cache_dir, [epub_check.__file__], unit="books")
+    keys, results = {}, {}
+    for ref, epub_book in epub_books.items():
+        keys[ref] = build_cache.key(epub_check.content_hash(epub_book), epub_check.EPUBCHECK_VERSION)
+        if record := build_cache.lookup(ref, keys[ref]):
+            results[ref] = record
+            logger.info(f"EpubCheck of {epub_book}: reused the result of the unchanged book.")
+
+    todo = [ref for ref in epub_books if ref not in results]
+    with ThreadPoolExecutor(max_workers=max(1, len(todo))) as pool:
+        for ref, result in zip(todo, pool.map(epub_check.run_epubcheck, [epub_books[ref] for ref in todo])):
+            results[ref] = result
+            build_cache.store(ref, keys[ref], [], **result)
+    build_cache.save()
+    logger.info(build_cache.summary())
+
+    for ref, epub_book in epub_books.items():
+        if results[ref]["valid"]:
+            logger.info(f"EpubCheck validation SUCCESS! {epub_book}")
+        else:
+            logger.warning(f"EpubCheck validation FAIL! {epub_book} Messages {epub_check.messages(results[ref]['result'])}")
+
+        # Create XLS as record of any epubcheck messages
+        epub_check.write_xls(results[ref]["result"], f"EPUB-{ref}.xls")
+        logger.info(f"EPUB created and checked: {epub_book}.")
+        logger.info(f"See EPUB-{ref}.xls.")
+    return {ref: results[ref]["valid"] for ref in epub_books}
+
+def check_epub(epub_book: str = EPUB_BOOK, ref: str = epub_ref, cache_dir: str = BUILD_CACHE) -> bool:
+    """ Validate one EPUB, per check_epubs """
+    return check_epubs({ref: epub_book}, cache_dir)[ref]
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Build and check the EPUB from the XHTML chapters.")
+    arg_parser.add_argument("--parser", choices=utl.html_parsers, default="",
+                            help="BeautifulSoup parser backend for the TOC scan. Default per config exe_mode parser.")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help="Reuse TOC entries of chapters unchanged since the last build, per the build cache.")
+    arg_parser.add_argument("--stage", action="store_true", default=STAGE_EPUB,
+                            help="Also copy the EPUB entries into the EPUB-{ref} folder. Default per config exe_mode stage_epub.")
+    arg_parser.add_argument("--jobs", type=int, default=1,
+                            help="EPUB entries to compress in parallel, on threads. Default 1, sequential.")
+    arg_parser.add_argument("--image-profile", choices=[ORIGINAL, *config_data.get("image_profiles", {})], default=IMAGE_PROFILE,
+                            help="original, or a profile of config image_profiles, made by 00-optimize-images.py. "
+                                 "Default per config exe_mode image_profile.")
+    arg_parser.add_argument("--no-check", dest="check", action="store_false",
+                            help="Skip EpubCheck. Else the EPUB is checked, an unchanged book not again.")
+    args = arg_parser.parse_args()
+
+    utl.init_logger()
+    epub_book = build_epub(load_xhtml(), parser=utl.get_html_parser(args.parser), incremental=args.incremental,
+                           stage=args.stage, jobs=args.jobs, image_profile=args.image_profile)
+    if args.check:
+        check_epub(epub_book)
@@ -1,34 +1,109 @@
-import csv 
-import datetime as dt
-import requests
+'''
+Check Power Moby-Dick periodically for updated annotations.
+- HEAD every chapter, and the non-chapter pages the build uses, concurrently and politely
+- Append every observation to an append-only history, and report pages changed since the last sweep
+- Save the latest Last-Modified dates to chapter_mod_dates.csv, for 01-scrape-chapters.py --incremental --mod-dates
+'''
+import argparse
+import csv
+import os
+import utils.utilities as utl
+import utils.config as config
 
-def last_mod_dt (last_mod_str: str) -> str:
-    return dt.datetime.strptime(last_mod_str, '%a, %d %b %Y %H:%M:%S %Z').isoformat(timespec="seconds")
+logger = utl.init_logger()
+config_data = config.load_config()
 
-# Base URL and chapter range 
-base_url = "http://www.powermobydick.com/Moby{:03d}.html" 
+# Last-Modified as ISO date-time, shared with incremental scrapes in 01-scrape-chapters.py --mod-dates
+last_mod_dt = utl.last_modified_iso
+
+# Base URL and chapter range
+BASE_URL = config_data["ext_resource"]["base_url"]
+base_url = BASE_URL + "Moby{:03d}.html"
 chapter_range = range(1, 151)
 # chapter_range = range(1, 5)
-results = [] 
-
-for i in chapter_range: 
-    url = base_url.format(i)
-    print(f"Checking last-modified for chapter {i}, {url}")
-    try: 
-        response = requests.head(url, timeout=10) 
-        last_str = response.headers.get("Last-Modified", "No date available")
-        last_iso = last_mod_dt(last_str)
-
-        results.append((url, last_iso)) 
-    except Exception as e: 
-        results.append((url, f"Error: {e}")) 
-
-# Sort results from latest to oldest last-modified date
-results = sorted(results, key=lambda x: x[1], reverse=True)
-
-# Save results to CSV 
-with open("chapter_mod_dates.csv", "w", newline="", encoding="utf-8") as csvfile: 
-    writer = csv.writer(csvfile) 
-    writer.writerow(["URL", "Last-Modified"]) 
-    writer.writerows(results) 
-    print("Results saved to chapter_mod_dates.csv")
\ No newline at end of file
+
+# Non-chapter pages of the build, beyond the numbered chapters
+extra_pages = {"Contents":     "",
+               "Front Matter": "Moby0001.html",
+               "Glossary":     "Moby138.html",
+               "Resources":    "Moby141.html"}
+
+MOD_DATES = "chapter_mod_dates.csv"
+HISTORY = config_data["proj_dirs"].get("mod_history", "chapter_mod_history.csv")
+HISTORY_FIELDS = ["sweep", "page", "URL", "Last-Modified"]
+
+def sweep_pages() -> dict[str, str]:
+    """ {URL: page label} for every page to check, chapters first """
+    pages = {base_url.format(i): f"Chapter {i}" for i in chapter_range}
+    for label, page in extra_pages.items():
+        url = BASE_URL + page
+        pages[url] = label if url not in pages else f"{pages[url]}, {label}"
+    return pages
+
+def load_prior(path: str = HISTORY) -> dict[str, str]:
+    """
+    {URL: Last-Modified} as last observed without error, across the history, empty if none.
+    A page whose HEAD failed on the latest sweep keeps its prior good observation
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8", newline="") as fp:
+        rows = sorted(csv.DictReader(fp), key=lambda row: row["sweep"])  # stable, appended in sweep order
+    return {row["URL"]: row["Last-Modified"] for row in rows if not row["Last-Modified"].startswith("Error")}
+
+def append_history(sweep: str, pages: dict[str, str], results: dict[str, str], path: str = HISTORY):
+    """ Append this sweep's observations. Never rewrite prior sweeps. """
+    new_file = not os.path.exists(path)
+    with open(path, "a", encoding="utf-8", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=HISTORY_FIELDS)
+        if new_file:
+            writer.writeheader()
+        for url, last_mod in results.items():
+            writer.writerow({"sweep": sweep, "page": pages[url], "URL": url, "Last-Modified": last_mod})
+
+def changed_since(prior: dict[str, str], results: dict[str, str]) -> list[tuple[str, str, str]]:
+    """ (URL, prior, current Last-Modified) of pages new or changed since their prior good observation, ignoring errors """
+    return [(url, prior.get(url, ""), last_mod) for url, last_mod in results.items()
+            if not last_mod.startswith("Error") and prior.get(url) != last_mod]
+
+def sweep(jobs: int = 8) -> list[tuple[str, str, str]]:
+    pages = sweep_pages()
+    prior = load_prior()
+    sweep_time = utl.get_utc_now()
+
+    print(f"Checking last-modified for {len(pages)} pages with {jobs} workers.")
+    ext = config_data["ext_resource"]
+    throttle = utl.HostThrottle(ext.get("max_per_host", 2), ext.get("min_interval", 0.5))
+    results = utl.sweep_last_modified(list(pages), jobs=jobs, throttle=throttle)
+    append_history(sweep_time, pages, results)
+    for url, last_mod in results.items():
+        logger.info(f"{pages[url]}, {url}: {last_mod}")
+
+    # Sort results from latest to oldest last-modified date
+    ordered = sorted(results.items(), key=lambda x: x[1], reverse=True)
+
+    # Save results to CSV
+    with open(MOD_DATES, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["URL", "Last-Modified"])
+        writer.writerows(ordered)
+        print(f"Results saved to {MOD_DATES}, history appended to {HISTORY}")
+
+    changes = changed_since(prior, results)
+    if not prior:
+        print("First sweep recorded, nothing to compare.")
+    elif changes:
+        print(f"Changed since last sweep ({len(changes)}):")
+        for url, before, after in changes:
+            print(f"  {pages[url]}: {before or 'new'} -> {after}  {url}")
+            logger.info(f"Changed since last sweep: {pages[url]}, {url}: {before or 'new'} -> {after}")
+    else:
+        print("No changes since last sweep.")
+    logger.info(utl.get_http_client().summary())
+    return changes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check Power Moby-Dick pages for updates since the last sweep.")
+    parser.add_argument("--jobs", type=int, default=8, help="Concurrent HEAD requests, throttled per config ext_resource.")
+    args = parser.parse_args()
+    sweep(jobs=args.jobs)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+'''
+Stage benchmarks over the synthetic corpus of benchmarks/corpus.py, offline: 02, 03 and 04 one by one, as their
+scripts run, then end to end, build.py in one process. EpubCheck skipped. Per stage, best of --repeat runs:
+- wall_s:       wall time, seconds
+- peak_rss_mb:  peak resident memory of the stage process, or of its largest pool worker. Linux, macOS and BSD only,
+                else null
+- output_bytes: size of the stage output, chapter directories or EPUB
+Results go to a JSON file. --save-baseline keeps them as the baseline, --compare flags the metrics worse than
+the baseline by more than --tolerance, and exits 1 if any.
+Run from the project root: python -m benchmarks.bench_stages [--compare] [--save-baseline]
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import utils.config as config
+from benchmarks.corpus import make_corpus
+
+config_data = config.load_config()
+proj_dirs = config_data["proj_dirs"]
+ROOT = Path(__file__).parent.parent
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# Stage: script and arguments, and its outputs in the project directory
+STAGES = {
+    "02":    (["02-clean-html.py"], [proj_dirs["ch_clean"], proj_dirs["ch_patched"]]),
+    "03":    (["03-epub-xhtml.py"], [proj_dirs["ch_xhtml"]]),
+    "04":    (["04-build-ebook.py", "--no-check"], ["*.epub"]),
+    "build": (["build.py", "--no-check"], ["*.epub"]),
+}
+METRICS = ("wall_s", "peak_rss_mb", "output_bytes")
+MIN_WALL_DELTA = 0.05  # seconds, below which a slower stage is noise, not a regression
+
+def output_bytes(workspace: Path, patterns: list[str]) -> int:
+    """ Bytes of the files matching patterns in workspace, directories recursively """
+    total = 0
+    for pattern in patterns:
+        for path in workspace.glob(pattern):
+            files = path.rglob("*") if path.is_dir() else [path]
+            total += sum(file.stat().st_size for file in files if file.is_file())
+    return total
+
+def rss_mb(maxrss: int) -> float | None:
+    """ MB of a ru_maxrss: bytes on macOS, KiB on Linux and the BSDs. None elsewhere, its unit not known """
+    if sys.platform == "darwin":
+        return round(maxrss / 1024 / 1024, 1)
+    if sys.platform.startswith(("linux", "freebsd", "openbsd", "netbsd")):
+        return round(maxrss / 1024, 1)
+    return None
+
+def run_stage(workspace: Path, stage: str, jobs: int = 1) -> dict:
+    """ Run one stage script in the project directory workspace. Its metrics """
+    args, outputs = STAGES[stage]
+    for pattern in outputs:
+        for path in workspace.glob(pattern):
+            shutil.rmtree(path) if path.is_dir() else path.unlink()
+    shutil.rmtree(workspace / proj_dirs.get("build_cache", ".build_cache"), ignore_errors=True)
+
+    with open(workspace / f"bench-{stage}.out", "wb") as out:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, str(ROOT / args[0]), *args[1:], "--jobs", str(jobs)],
+                                cwd=workspace, stdout=out, stderr=subprocess.STDOUT)
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            returncode, peak_rss = os.waitstatus_to_exitcode(status), rss_mb(usage.ru_maxrss)
+        else:
+            returncode, peak_rss = proc.wait(), None
+        wall = time.perf_counter() - start
+    if returncode:
+        raise RuntimeError(f"Stage {stage} failed with exit code {returncode}, see {workspace / f'bench-{stage}.out'}")
+    return {"wall_s": round(wall, 3), "peak_rss_mb": peak_rss, "output_bytes": output_bytes(workspace, outputs)}
+
+def run_all(workspace: Path, stages: list[str], repeat: int = 3, jobs: int = 1) -> dict[str, dict]:
+    """ Best wall time, and highest peak memory, of repeat runs of each stage, in order """
+    results = {stage: {} for stage in stages}
+    for run in range(repeat):
+        for stage in stages:
+            metrics = run_stage(workspace, stage, jobs)
+            print(f"Run {run + 1}/{repeat} {stage:5} {metrics['wall_s']:8.2f} s")
+            best = results[stage]
+            best["wall_s"] = min(best.get("wall_s", metrics["wall_s"]), metrics["wall_s"])
+            best["peak_rss_mb"] = max(best.get("peak_rss_mb") or 0, metrics["peak_rss_mb"] or 0) or None
+            best["output_bytes"] = metrics["output_bytes"]
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """ Regressions of results against baseline: metrics worse by more than tolerance, a fraction """
+    regressions = []
+    for stage, metrics in results["stages"].items():
+        base = baseline["stages"].get(stage)
+        if not base:
+            continue
+        for metric in METRICS:
+            value, base_value = metrics.get(metric), base.get(metric)
+            if not value or not base_value:
+                continue
+            if value > base_value * (1 + tolerance) and (metric != "wall_s" or value - base_value > MIN_WALL_DELTA):
+                regressions.append(f"{stage} {metric}: {value} vs {base_value} baseline, {value / base_value - 1:+.1%}")
+    return regressions
+
+def print_table(results: dict, baseline: dict | None = None):
+    print(f"{'stage':6} {'wall s':>9} {'peak RSS MB':>12} {'output bytes':>14}" + ("   vs baseline" if baseline else ""))
+    for stage, metrics in results["stages"].items():
+        line = f"{stage:6} {metrics['wall_s']:9.2f} {metrics['peak_rss_mb'] or 0:12.1f} {metrics['output_bytes']:14,}"
+        if baseline and (base := baseline["stages"].get(stage)):
+            line += "   " + " ".join(f"{metrics[metric] / base[metric] - 1:+.1%}" if metrics[metric] and base.get(metric)
+                                     else "n/a" for metric in METRICS)
+        print(line)
+
+def prepare_corpus(workspace: Path, chapters: int, seed: int) -> dict[str, int]:
+    """ The corpus of chapters and seed in workspace, generated unless already there. Its counts """
+    marker = workspace / "corpus.json"
+    if marker.exists():
+        with open(marker, encoding="utf-8") as fp:
+            corpus = json.load(fp)
+        if (corpus["chapters"], corpus["seed"]) == (chapters, seed):
+            return corpus
+    print(f"Generating the synthetic corpus in {workspace} ...")
+    corpus = make_corpus(workspace, chapters=chapters, seed=seed)
+    with open(marker, "w", encoding="utf-8") as fp:
+        json.dump(corpus, fp)
+    return corpus
+
+def main(args) -> int:
+    workspace = Path(args.workspace or tempfile.mkdtemp(prefix="pmd-bench-"))
+    try:
+        corpus = prepare_corpus(workspace, args.chapters, args.seed)
+        results = {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "python": platform.python_version(), "platform": platform.platform(),
+                   "repeat": args.repeat, "jobs": args.jobs, "corpus": corpus,
+                   "stages": run_all(workspace, args.stages, args.repeat, args.jobs)}
+    finally:
+        if not args.workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as fp:
+        json.dump(results, fp, indent=2)
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Saved baseline {args.baseline}.")
+
+    baseline = None
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as fp:
+            baseline = json.load(fp)
+    print_table(results, baseline)
+    print(f"Results in {args.output}.")
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"{len(regressions)} regressions against {args.baseline}, tolerance {args.tolerance:.0%}.")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark stages 02 to 04, and build.py, over a synthetic corpus.")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES),
+                        help="Stages to run, in order. Default all. 03 needs the output of 02, and 04 that of 03.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each stage, the best one counts. Default 3.")
+    parser.add_argument("--jobs", type=int, default=1, help="--jobs of each stage. Default 1.")
+    parser.add_argument("--chapters", type=int, default=151, help="Chapters of the corpus filled with text. Default 151, as the book. The rest keep their headers.")
+    parser.add_argument("--seed", type=int, default=1851, help="Seed of the corpus. Default 1851.")
+    parser.add_argument("--workspace", default="",
+                        help="Project directory to generate the corpus and run the stages in, kept. Default a temporary one.")
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR / "latest.json", help="Results JSON file.")
+    parser.add_argument("--baseline", type=Path, default=RESULTS_DIR / "baseline.json", help="Baseline JSON file.")
+    parser.add_argument("--save-baseline", action="store_true", help="Also save the results as the baseline.")
+    parser.add_argument("--compare", action="store_true", help="Flag regressions against the baseline, exit 1 if any.")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Fraction by which a metric may exceed the baseline before it is flagged. Default 0.10.")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+'''
+Microbenchmark of utils.utilities titlecase: titlecase_many over many titles, against titlecase per title
+and the former per-call implementation, kept below as the reference. Outputs must match the reference.
+Run from the project root: python -m benchmarks.bench_titlecase [--titles N] [--repeat N]
+'''
+import argparse
+import random
+import re
+import time
+import utils.utilities as utl
+import utils.config as config
+
+config_data = config.load_config()
+ttl_lower = config_data["proj_dirs"]["ttl_lower"]
+
+WORDS = ("whale ship sea Ahab's Ishmael QUEEQUEG harpoon voyage Pequod mast-head captain SAILOR oil "
+         "blubber leviathan ocean wave spout boat line crew Starbuck Stubb Flask mate cabin lance "
+         "white hump jaw bone sperm right fin fluke tail storm wind calm night day morning "
+         '"big" (definitely not) [i mean *you\'re*] shouldn\'t DaVinci J.R.R. 1851 ALOFT—THUNDER PERISH?–WILL').split()
+
+def reference_titlecase_word(word: str, idx: int, ignore: list = []) -> str:
+    """ titlecase_word as before titlecase_many: regexes compiled, ignore list lowercased, at every call """
+    if re.search(r'[0-9]', word):
+        return word
+    elif re.search(r'\.[^\.]', word):
+        return word
+    elif (re.match(r'^[a-z]+(_[A-Z]+)+$', word) or
+        re.match(r'^[A-Z][a-z]+([A-Z_]+)', word) or
+        re.match(r'^[a-z][A-Z]+([A-Z_]+)', word)):
+        return word
+    elif idx>0 and word.lower() in [w.lower() for w in ignore]:
+        return word.lower()
+
+    if (regexp := re.match(r'^(.+)([\-–—])(.+)$', word)):
+        return (reference_titlecase_word(regexp.group(1), idx, ignore) + regexp.group(2) +
+                reference_titlecase_word(regexp.group(3), idx, ignore))
+    elif (regexp := re.match(r'^([\*\'"<\[\(\{]+)(.+)', word)):
+        leading_quote = regexp.group(1)
+        core_word = regexp.group(2)
+        if (regexp := re.match(r'(.+)([\*\'">\]\)\}])$', core_word)):
+            core_word = regexp.group(1)
+            trailing_quote = regexp.group(2)
+        else:
+            trailing_quote = ''
+        return leading_quote + reference_titlecase_word(core_word, idx, ignore) + trailing_quote
+    elif "'\"" in word:
+        parts = word.split("'\"")
+        return "'".join([parts[0].capitalize()] + [part.lower() for part in parts[1:]])
+    else:
+        return word.capitalize()
+
+def reference_titlecase(text: str, ignore: list = []) -> str:
+    return ' '.join(reference_titlecase_word(word, idx, ignore) for idx, word in enumerate(re.findall(r'[\S]+', text)))
+
+def make_titles(count: int, seed: int = 1851) -> list[str]:
+    """ Subtitle-like titles of 3 to 12 words, with the small words of ttl_lower among them """
+    rng = random.Random(seed)
+    vocabulary = list(WORDS) + ttl_lower * 2
+    return [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(3, 12))) for _ in range(count)]
+
+def timed(func, repeat: int) -> float:
+    """ Best wall time of repeat runs, in seconds """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(titles: int, repeat: int) -> dict[str, float]:
+    texts = make_titles(titles)
+    expected = [reference_titlecase(text, ttl_lower) for text in texts]
+    if utl.titlecase_many(texts, ttl_lower) != expected:
+        raise AssertionError("titlecase_many differs from the reference titlecase")
+
+    def cold_many():
+        utl._titlecase_word.cache_clear()
+        utl.titlecase_many(texts, ttl_lower)
+    results = {"reference titlecase": timed(lambda: [reference_titlecase(text, ttl_lower) for text in texts], repeat),
+               "titlecase per title": timed(lambda: [utl.titlecase(text, ttl_lower) for text in texts], repeat),
+               "titlecase_many, cold cache": timed(cold_many, repeat),
+               "titlecase_many": timed(lambda: utl.titlecase_many(texts, ttl_lower), repeat)}
+    reference = results["reference titlecase"]
+    print(f"{titles} titles, best of {repeat}:")
+    for name, seconds in results.items():
+        print(f"  {name:28} {seconds * 1000:9.2f} ms  {reference / seconds:6.1f}x")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark of titlecase over many titles.")
+    parser.add_argument("--titles", type=int, default=20000, help="Titles to title case. Default 20000.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each variant, the best one counts. Default 5.")
+    args = parser.parse_args()
+    main(args.titles, args.repeat)
@@ -0,0 +1,143 @@
+'''
+Synthetic, offline corpus shaped like Power Moby-Dick, for the stage benchmarks: the 01 scrape output and the
+custom images 03 inserts, in a project directory laid out per config.yaml proj_dirs.
+- 151 raw chapters, chapter-000.html to chapter-150.html, as 01-scrape-chapters.py slices them from the site:
+  h1 title and h2 subtitle, page paragraphs, about one sidenote in three sentences, their title attributes
+  holding escaped HTML, entities and mis-decoded UTF-8, links with onclick handlers, comments and spacer images.
+  A smaller corpus fills the first chapters only, the rest keep their headers, since the custom pages link to them
+- custom_img_sm: JPEG images and custom_img_locations_final.csv rows that place them, TOP, MID or BOTTOM
+- custom and images: copied from the project, as 04 packages them
+The same seed makes the same corpus.
+'''
+import csv
+import random
+import shutil
+from pathlib import Path
+from PIL import Image
+import utils.utilities as utl
+import utils.config as config
+
+config_data = config.load_config()
+ROOT = Path(__file__).parent.parent
+
+WORDS = ("whale ship sea Ahab Ishmael Queequeg harpoon voyage Pequod mast deck captain sailor oil "
+         "blubber leviathan ocean wave spout boat line crew Starbuck Stubb Flask mate cabin lance "
+         "white hump jaw bone sperm right fin fluke tail storm wind calm night day morning").split()
+ROMAN = ["I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "X"]
+BOOK_CHAPTERS = 151  # chapter-000 to chapter-150, as the custom pages link to them
+BACK_MATTER = ["Sources", "Glossary", "Blogs", "Other Press", "A Note on the Text", "Resources"]
+CSV_FIELDS = ["text_file", "img_name", "img_rename", "chapter", "target_chapter", "location",
+              "preceding_text", "following_text", "preceding_simp", "following_simp"]
+
+def sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 25))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rng.choice([".", ".", "!", "?", ";"])
+
+def note_title(rng: random.Random) -> str:
+    """ Sidenote text, as the site escapes it into the title attribute """
+    kind = rng.random()
+    text = sentence(rng)
+    if kind < 0.3:
+        return f"&lt;a href='http://en.wikipedia.org/wiki/{rng.choice(WORDS)}'target='_blank'&gt;{rng.choice(WORDS)}:&lt;/a&gt; {text}"
+    if kind < 0.5:
+        return f"{rng.choice(WORDS)}: &lt;i&gt;{rng.choice(WORDS)}&lt;/i&gt; {text} Caf&eacute; &amp; more"
+    return text + " HonshÅ« â dash"
+
+def paragraph(rng: random.Random, notes: float, plain: list[str]) -> str:
+    """ A paragraph of sentences, some with a sidenote or a link. Sentences without markup are added to plain """
+    sentences = []
+    for _ in range(rng.randint(2, 6)):
+        text = sentence(rng)
+        draw = rng.random()
+        if draw < notes:
+            words = text.split()
+            idx = rng.randrange(len(words))
+            tag = "span" if rng.random() < 0.85 else "a"
+            words[idx] = f'<{tag} class="sidenote" title="{note_title(rng)}\n">{words[idx]}</{tag}>'
+            text = " ".join(words)
+        elif draw < notes + 0.05:
+            text += ' <a href="http://www.powermobydick.com/Moby002.html" onclick="window.open(this.href); return false;">link</a>'
+        else:
+            plain.append(text)
+        sentences.append(text)
+    return "<p>" + "\n".join(sentences) + "</p>"
+
+def chapter(number: int, rng: random.Random, notes: float = 0.35, filled: bool = True) -> tuple[str, list[str]]:
+    """ Raw HTML of a chapter, and its sentences without markup, to anchor images to. Headers only unless filled """
+    out = ['<div id="container"', '>\n<div id="content">\n']
+    plain = []
+    if number == 0:
+        out.append("<h1>Moby-Dick </h1>\n<h2>Front Matter</h2>\n<p><i>page xxxv</i></p>\n"
+                   "<p>in token of my admiration for his genius</p>\n<h2>Etymology</h2>\n<p><i>page xxxvii</i></p>\n"
+                   "<h2>Extracts</h2>\n<p><i>page xxxix</i></p>\n")
+    elif number == 1:
+        out.append("<h1>Chapter I</h1>\n<h2>Loomings</h2>\n")
+    elif number == 136:
+        out.append("<h1>Epilogue</h1>\n<h2>\xa0</h2>\n")
+    elif number > 136:
+        out.append(f"<h2>{BACK_MATTER[number % len(BACK_MATTER)]}</h2>\n")
+    else:
+        out.append(f"<h1>Chapter {ROMAN[number % 10]}</h1>\n"
+                   f"<h2>The {rng.choice(WORDS).capitalize()}—and {rng.choice(WORDS)}'s {rng.choice(WORDS)}</h2>\n")
+    page = number * 5 + 1
+    for idx in range(rng.randint(15, 45) if filled else 0):
+        if rng.random() < 0.12:
+            page += 1
+            out.append(rng.choice([f"<p><b>page {page}</b></p>", f"<p><i>Page  {page}</i></p>",
+                                   f"<p><font size=2>page {page}</font></p>"]))
+        if rng.random() < 0.05:
+            out.append(rng.choice(["<!-- dead link to old site -->", "<!-- keep this comment -->",
+                                   '<img src="images/spacer.gif" width="10">', '<img src="x.jpg" height="1">',
+                                   f'<a name="anchor{idx}"></a>', '<p>&eacute;t&eacute; &amp; caf&eacute;</p>']))
+        out.append(paragraph(rng, notes, plain))
+    out.append("\n</div>\n</div>\n")
+    return "\n".join(out), plain
+
+def write_image(path: Path, rng: random.Random):
+    """ A photo-like JPEG: noise over a gradient, narrow or wide, to weigh about as the custom images do """
+    width, height = rng.choice([(300, 420), (560, 300), (560, 420), (560, 600), (930, 1290)])
+    noise = Image.effect_noise((width, height), rng.randint(20, 60))
+    gradient = Image.linear_gradient("L").resize((width, height))
+    Image.merge("RGB", (noise, gradient, Image.blend(noise, gradient, 0.5))).save(path, "JPEG", quality=85)
+
+def make_corpus(root: str, chapters: int = 151, images_per_chapter: float = 1.8, seed: int = 1851) -> dict[str, int]:
+    """ Write the corpus into the project directory root, its first chapters filled. Return its counts """
+    proj_dirs = config_data["proj_dirs"]
+    root = Path(root)
+    raw_dir, img_dir = root / proj_dirs["ch_raw"], root / proj_dirs["custom_img"]
+    for path in (raw_dir, img_dir):
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+    for name in (proj_dirs["custom_dir"], proj_dirs["img_dir"]):
+        shutil.copytree(ROOT / name, root / name, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns(proj_dirs.get("image_index", "image_index.csv")))
+
+    rng = random.Random(seed)
+    rows = []
+    sidenotes = 0
+    for number in range(max(chapters, BOOK_CHAPTERS)):
+        html, plain = chapter(number, rng, filled=number < chapters)
+        sidenotes += html.count('class="sidenote"')
+        with open(raw_dir / f"chapter-{number:03d}.html", "w", encoding="utf-8") as fp:
+            fp.write(html)
+        count = int(images_per_chapter) + (rng.random() < images_per_chapter % 1) if number < chapters else 0
+        for img in range(1, count + 1):
+            location = rng.choice(["MID"] * 6 + ["TOP", "BOTTOM"]) if plain else "TOP"
+            anchor = rng.choice(plain).lower() if location != "TOP" else ""
+            rows.append({"text_file": f"text_{number:03d}.xhtml", "img_name": f"mdtw_img_{len(rows) + 1:03d}.jpg",
+                         "img_rename": f"chap{number:03d}_img{img:03d}.jpg", "chapter": str(number),
+                         "target_chapter": f"chapter_{number:03d}.xhtml", "location": location,
+                         "preceding_text": anchor if location == "BOTTOM" else "",
+                         "following_text": anchor if location == "MID" else "",
+                         "preceding_simp": utl.simplify_text(anchor) if location == "BOTTOM" else "",
+                         "following_simp": utl.simplify_text(anchor) if location == "MID" else ""})
+            write_image(img_dir / rows[-1]["img_rename"], rng)
+
+    with open(img_dir / "custom_img_locations_final.csv", "w", encoding="utf-8", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return {"chapters": chapters, "seed": seed, "sidenotes": sidenotes, "images": len(rows),
+            "raw_bytes": sum(path.stat().st_size for path in raw_dir.iterdir()),
+            "image_bytes": sum(path.stat().st_size for path in img_dir.glob("*.jpg"))}
@@ -0,0 +1,156 @@
+'''
+Run the stages 01 to 04 in one process: scrape (optional), clean and patch, wrap in EPUB XHTML, build and check the EPUB.
+- Chapters pass from stage to stage in memory, not through chapters_02_clean, chapters_03_patched and chapters_04_xhtml
+- config exe_mode write_intermediate, or --write-intermediate, also writes those directories, to debug or diff
+- Each numbered script still runs on its own, through those directories, with its own options
+- --image-profile packages images resized and recompressed for a device profile, made first by 00-optimize-images.py
+- --editions foot link builds both editions in one run. Cleanup, page paragraphs, headers and the TOC entries
+  are done once. The notes, EPUB XHTML and packaging run per edition, in parallel, into EPUB-foot and EPUB-link
+'''
+import argparse
+import logging
+import os
+import utils.utilities as utl
+import utils.config as config
+
+# Log file set up by utl.init_logger() when run as a script
+logger = logging.getLogger(__name__)
+config_data = config.load_config()
+WRITE_INTERMEDIATE = config_data["exe_mode"].get("write_intermediate", False)
+
+# The stage scripts, imported as modules: optimize_images, scrape_chapters, clean_html, epub_xhtml and build_ebook
+optimize_images = utl.load_script("00-optimize-images.py")
+scrape_chapters = utl.load_script("01-scrape-chapters.py")
+clean_html = utl.load_script("02-clean-html.py")
+epub_xhtml = utl.load_script("03-epub-xhtml.py")
+build_ebook = utl.load_script("04-build-ebook.py")
+
+def load_raw(raw_dir: str = clean_html.CHAP_RAW) -> dict[int, str]:
+    """ {chapter number: raw HTML} of the chapters from 01-scrape-chapters.py """
+    raw_chapters = {}
+    for fname in sorted(os.listdir(raw_dir)):
+        if fname.endswith(".html"):
+            with open(os.path.join(raw_dir, fname), encoding="utf-8") as fp:
+                raw_chapters[int(fname.replace("chapter-", "").replace(".html", ""))] = fp.read()
+    return raw_chapters
+
+def clean_editions(raw_chapters: dict[int, str], parser: str = clean_html.PARSER,
+                   write_intermediate: bool = WRITE_INTERMEDIATE,
+                   refs: tuple[str, ...] = (clean_html.epub_ref,)) -> dict[str, dict[int, str]]:
+    """
+    Stage 02: clean every raw chapter once, and patch it for each edition from one parsed tree.
+    Return {ref: {chapter number: patched HTML}}. write_intermediate writes the first edition.
+    """
+    if write_intermediate:
+        clean_html.init_dirs()
+    patched_editions = {ref: {} for ref in refs}
+    for number, raw_html in raw_chapters.items():
+        logger.info(f"Cleaning chapter {number:03d}")
+        clean = clean_html.basic_html_cleanup(raw_html, number, parser)
+        for ref, patched in clean_html.patch_editions(clean, number, parser, refs).items():
+            patched_editions[ref][number] = patched
+        if write_intermediate:
+            clean_html.save_chapter(number, clean, out_dir=clean_html.CHAP_CLE)
+            clean_html.save_chapter(number, patched_editions[refs[0]][number], out_dir=clean_html.CHAP_PAT)
+    clean_html.report_fix_hits(clean_html.fix_hits)
+    return patched_editions
+
+def clean_all(raw_chapters: dict[int, str], parser: str = clean_html.PARSER,
+              write_intermediate: bool = WRITE_INTERMEDIATE) -> dict[int, str]:
+    """ Stage 02: clean and patch every raw chapter. Return {chapter number: patched HTML} """
+    return clean_editions(raw_chapters, parser, write_intermediate)[clean_html.epub_ref]
+
+def xhtml_all(patched_chapters: dict[int, str], parser: str = epub_xhtml.PARSER,
+              write_intermediate: bool = WRITE_INTERMEDIATE, log_images: bool = True) -> dict[str, str]:
+    """
+    Stage 03: wrap every patched chapter in EPUB XHTML, with custom images. Return {file name: XHTML}
+    log_images writes log_insert_img.csv and reports unplaced images. Once per build, not per edition.
+    """
+    custom_img_locations = epub_xhtml.load_img_locations()
+    utl.custom_img_locations = custom_img_locations
+    img_by_chapter = utl.group_by_chapter(custom_img_locations)
+    if write_intermediate:
+        epub_xhtml.init_dirs()
+    xhtml_chapters = {}
+    for number, html in patched_chapters.items():
+        logger.info(f"Wrapping chapter {number:03d} in EPUB XHTML")
+        _, xhtml = epub_xhtml.make_epub_xhtml(html, number, css_files=epub_xhtml.CSS_FILES,
+                                              image_insertions=img_by_chapter.get(number, []), parser=parser)
+        fname = f"chapter_{number:03d}.xhtml"
+        xhtml_chapters[fname] = xhtml
+        if write_intermediate:
+            with open(os.path.join(epub_xhtml.OUTPUT_DIR, fname), "w", encoding="utf-8") as fp:
+                fp.write(xhtml)
+    if log_images:
+        epub_xhtml.save_img_log(custom_img_locations)
+        epub_xhtml.report_unplaced(custom_img_locations)
+    return xhtml_chapters
+
+def build_editions(patched_editions: dict[str, dict[int, str]], parser: str = build_ebook.PARSER,
+                   write_intermediate: bool = WRITE_INTERMEDIATE,
+                   image_profile: str = build_ebook.IMAGE_PROFILE) -> dict[str, str]:
+    """
+    Stages 03 and 04 of each edition, {ref: {chapter number: patched HTML}}. Return {ref: path of the EPUB}
+    - With two editions, on a process pool, one edition per worker
+    - Images are placed per edition, since 03 places them in the final chapter tree. Both place alike,
+      since the editions differ only in the note markup, and the first edition writes the image log
+    - TOC entries once, from the first edition. The editions have the same headers
+    """
+    refs = list(patched_editions)
+    if len(refs) > 1:
+        logger.info(f"Building the editions {', '.join(refs)} with {len(refs)} worker processes.")
+    xhtml_editions = utl.run_pool(xhtml_all, {ref: (patched_editions[ref], parser, write_intermediate and ref == refs[0],
+                                                    ref == refs[0]) for ref in refs}, jobs=len(refs))
+    toc = build_ebook.toc_entries(xhtml_editions[refs[0]], parser)
+    epub_args = {ref: (xhtml_editions.pop(ref), parser, ref, toc, image_profile) for ref in refs}
+    return utl.run_pool(epub_edition, epub_args, jobs=len(refs))
+
+def epub_edition(xhtml_chapters: dict[str, str], parser: str, ref: str, toc: dict[str, str], image_profile: str) -> str:
+    """ Stage 04 of one edition, on a pool worker. Return the path of the EPUB """
+    return build_ebook.build_epub(xhtml_chapters, parser, ref=ref, toc=toc, image_profile=image_profile)
+
+def build(scrape: bool = False, jobs: int = 1, parser: str = "", write_intermediate: bool = WRITE_INTERMEDIATE,
+          check: bool = True, editions: tuple[str, ...] = (clean_html.epub_ref,),
+          image_profile: str = build_ebook.IMAGE_PROFILE) -> dict[str, str]:
+    """
+    Run the stages, 01 only with scrape, 00-optimize-images.py only for an image_profile other than original,
+    for each edition, foot or link. Return {ref: path of the EPUB}
+    """
+    parser = utl.get_html_parser(parser)
+    if scrape:
+        scrape_chapters.scrape_all(jobs=jobs)
+    optimize_images.optimize_all(image_profile, jobs=jobs)
+    editions = tuple(dict.fromkeys(editions))
+    patched_editions = clean_editions(load_raw(), parser, write_intermediate, editions)
+    epub_books = build_editions(patched_editions, parser, write_intermediate, image_profile)
+    if check:
+        build_ebook.check_epubs(epub_books)
+    for ref, epub_book in epub_books.items():
+        logger.info(f"SUCCESS. Built {epub_book} from {len(patched_editions[ref])} chapters.")
+    return epub_books
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the EPUB in one process, passing chapters between stages in memory.")
+    parser.add_argument("--scrape", action="store_true",
+                        help="Run 01-scrape-chapters.py first. Default: build from the raw chapters on disk.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Concurrent chapter fetches, with --scrape, and image processes, with --image-profile.")
+    parser.add_argument("--parser", choices=utl.html_parsers, default="",
+                        help="BeautifulSoup parser backend. Default per config exe_mode parser.")
+    parser.add_argument("--write-intermediate", action="store_true", default=WRITE_INTERMEDIATE,
+                        help="Also write the clean, patched and XHTML chapter directories. Default per config exe_mode write_intermediate.")
+    parser.add_argument("--no-check", dest="check", action="store_false",
+                        help="Skip EpubCheck. Else the editions are checked concurrently, unchanged books not again.")
+    parser.add_argument("--editions", nargs="+", choices=clean_html.EPUB_REFS, default=[clean_html.epub_ref],
+                        help="Editions to build, foot and/or link, in parallel from shared work. "
+                             "Default per config exe_mode epub_ref. Intermediate directories hold the first.")
+    parser.add_argument("--image-profile", choices=[build_ebook.ORIGINAL, *optimize_images.IMAGE_PROFILES],
+                        default=build_ebook.IMAGE_PROFILE,
+                        help="Images to package: original, or resized for a device profile of config image_profiles. "
+                             "Default per config exe_mode image_profile.")
+    args = parser.parse_args()
+
+    utl.init_logger()
+    build(scrape=args.scrape, jobs=args.jobs, parser=args.parser,
+          write_intermediate=args.write_intermediate, check=args.check, editions=tuple(args.editions),
+          image_profile=args.image_profile)
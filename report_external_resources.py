@@ -1,6 +1,19 @@
 #!/usr/bin/env python3
-import re
+'''
+Report the external resources of the EPUB XHTML chapters: URLs, onclick handlers and JavaScript sources
+- One regex pass per file, over its memory-mapped bytes, finds where a match of any topic opens.
+  The topic's own pattern then matches there, so the matches are those of a findall per topic
+- Files scan on a process pool with --jobs
+- log-rpt_ext_by_filename.log and log-rpt_ext_by_resource.log to read, log-rpt_ext_resources.json to process
+- --incremental rescans only the XHTML files changed since the last JSON report, by size and mtime
+'''
+import argparse
+import json
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import re
 import utils.config as config
 
 config_data = config.load_config()
@@ -10,57 +23,99 @@ pattern_url = re.compile(r'(?:https?|ftps?)://[^"\s\'<>\)]*')
 pattern_oc = re.compile(r'onclick="[^"]*')
 pattern_js = re.compile(r'src="[^"]+\.js"')
 
-mtx_pattern = {"URLs": pattern_url, 
+mtx_pattern = {"URLs": pattern_url,
                "OnClick": pattern_oc,
                "JavaScript": pattern_js}
 
-# Named lists to hold matches of each type
-match_url = {}
-match_oc = {}
-match_js = {}
-
-counts = {topic: 0 for topic in mtx_pattern.keys()}
-unicnt = {topic: 0 for topic in mtx_pattern.keys()}
-
-fncount = 0
-
-mtx_by_file = {"URLs": match_url,
-               "OnClick": match_oc,
-               "JavaScript": match_js}
-
-for xhtml_file in sorted(xhtml_dir.glob("*.xhtml")):
-    with open(xhtml_file, 'r', encoding='utf-8', errors='ignore') as fn:
-        fncount += 1
-        content = fn.read()
-        for topic, pat in mtx_pattern.items():
-            tcount = counts[topic]
-            mtx = pat.findall(content)
-            count = len(mtx)
-            tcount += count
-            if count > 0:
-                mtx_by_file[topic].update({xhtml_file.name: mtx})
-                counts[topic] = tcount
-
-# For each topic, accumulate {"unique match": [filenames]}
-# and sort each list by filename
-unique_matches = {topic: {} for topic in mtx_pattern.keys()}
-for topic, files in mtx_by_file.items():
-    for filename, matches in files.items():
-        for match in matches:
-            unique_matches[topic].setdefault(match, []).append(filename)
-    for match, filenames in unique_matches[topic].items():
-        unique_matches[topic][match] = sorted(filenames)
-        unicnt[topic] += len(filenames)
-
-# Write to log file
+# Where a match of each topic opens, combined in one pattern over bytes. And the topic patterns over bytes, to match
+# as the str ones do on the UTF-8 text. Bytes \s is ASCII only: a bytes URL also ends at the UTF-8 of the rest of str \s,
+# up to U+3000, the last Unicode whitespace. Matches are decoded for the reports only
+unicode_space = b"|".join(re.escape(chr(c).encode("utf-8")) for c in range(0x3001)
+                          if re.match(r"\s", chr(c)) and not re.match(rb"\s", chr(c).encode("utf-8")))
+mtx_opening = re.compile(rb'(?P<URLs>(?:https?|ftps?)://)|(?P<OnClick>onclick=")|(?P<JavaScript>src=")')
+mtx_pattern_bytes = {topic: re.compile(pat.pattern.encode("ascii")) for topic, pat in mtx_pattern.items()}
+mtx_pattern_bytes["URLs"] = re.compile(rb'(?:https?|ftps?)://(?:(?!' + unicode_space + rb')[^"\s\'<>\)])*')
+
 log1_path = Path(r"log-rpt_ext_by_filename.log")
 log2_path = Path(r"log-rpt_ext_by_resource.log")
-with open(log1_path, 'w', encoding='utf-8') as log:
-    log.write(f"External URLs Found in XHTML Files\n")
-    log.write(f"Logged external resources from {fncount} files:\n -  URLs ({counts['URLs']})\n - OnClick ({counts['OnClick']})\n - JavaScript ({counts['JavaScript']}).\n")
-    log.write(f"{'=' * 80}\n\n")
+json_path = Path(r"log-rpt_ext_resources.json")
+
+def scan_file(path: str) -> dict[str, list[str]]:
+    """ {topic: matches, in file order} of one file """
+    matches = {topic: [] for topic in mtx_pattern}
+    if not os.path.getsize(path):
+        return matches  # nothing to map
+    ends = dict.fromkeys(mtx_pattern, 0)
+    with open(path, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        for opening in mtx_opening.finditer(content):
+            topic, start = opening.lastgroup, opening.start()
+            # Not within the prior match of the topic, as its findall would not be
+            if start < ends[topic] or not (match := mtx_pattern_bytes[topic].match(content, start)):
+                continue
+            matches[topic].append(match.group().decode("utf-8", errors="ignore"))
+            ends[topic] = match.end()
+    return matches
+
+def scan_all(src_dir: Path = xhtml_dir, jobs: int = 1, prior: dict | None = None) -> dict[str, dict]:
+    """
+    {file name: {size, mtime_ns, matches}} of the XHTML files in src_dir, in name order.
+    Files of prior, a former result, with the same size and mtime are not scanned again.
+    """
+    files = {}
+    todo = []
+    for xhtml_file in sorted(src_dir.glob("*.xhtml")):
+        stat = xhtml_file.stat()
+        record = (prior or {}).get(xhtml_file.name)
+        if record and (record["size"], record["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            files[xhtml_file.name] = record
+        else:
+            files[xhtml_file.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            todo.append(xhtml_file)
+
+    if jobs <= 1:
+        scanned = [scan_file(xhtml_file) for xhtml_file in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            scanned = list(pool.map(scan_file, todo, chunksize=max(1, len(todo) // (jobs * 4))))
+    for xhtml_file, matches in zip(todo, scanned):
+        files[xhtml_file.name]["matches"] = matches
+    print(f"Scanned {len(todo)} of {len(files)} files.")
+    return files
+
+def load_report(path: Path = json_path) -> dict:
+    """ Files of the prior JSON report, if any """
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as fp:
+        return json.load(fp)["files"]
+
+def write_reports(files: dict[str, dict]):
+    """ The two text logs, by file and by resource, and the JSON report """
+    fncount = len(files)
+
+    # Named lists of matches of each type, {file name: matches} of the files with any
+    mtx_by_file = {topic: {} for topic in mtx_pattern}
+    counts = {topic: 0 for topic in mtx_pattern}
+    for filename, record in files.items():
+        for topic, matches in record["matches"].items():
+            if matches:
+                mtx_by_file[topic][filename] = matches
+                counts[topic] += len(matches)
+
+    # For each topic, {"unique match": [filenames]}, a file once per match. Files in name order already
+    unique_matches = {topic: {} for topic in mtx_pattern}
+    unicnt = {topic: 0 for topic in mtx_pattern}
+    for topic, by_file in mtx_by_file.items():
+        for filename, matches in by_file.items():
+            for match in matches:
+                unique_matches[topic].setdefault(match, []).append(filename)
+            unicnt[topic] += len(matches)
+
+    with open(log1_path, 'w', encoding='utf-8') as log:
+        log.write(f"External URLs Found in XHTML Files\n")
+        log.write(f"Logged external resources from {fncount} files:\n -  URLs ({counts['URLs']})\n - OnClick ({counts['OnClick']})\n - JavaScript ({counts['JavaScript']}).\n")
+        log.write(f"{'=' * 80}\n\n")
 
-    if mtx_by_file:
         for topic, mtx in mtx_by_file.items():
             log.write(f"{topic}:\n")
             log.write(f"{'-' * 80}\n")
@@ -76,15 +131,12 @@ with open(log1_path, 'w', encoding='utf-8') as log:
         for tpc in counts.keys():
             cnt = counts[tpc]
             log.write(f"Total {tpc} matches: {cnt}\n")
-    else:
-        log.write("No external URLs found.\n")
 
-with open(log2_path, 'w', encoding='utf-8') as log:
-    log.write(f"External URLs by Resource\n")
-    log.write(f"Logged unique ext resources:\n   - URLs ({unicnt['URLs']})\n  - OnClick ({unicnt['OnClick']})\n  - JavaScript ({unicnt['JavaScript']}).\n")
-    log.write(f"{'=' * 80}\n\n")
+    with open(log2_path, 'w', encoding='utf-8') as log:
+        log.write(f"External URLs by Resource\n")
+        log.write(f"Logged unique ext resources:\n   - URLs ({unicnt['URLs']})\n  - OnClick ({unicnt['OnClick']})\n  - JavaScript ({unicnt['JavaScript']}).\n")
+        log.write(f"{'=' * 80}\n\n")
 
-    if unique_matches:
         for topic, matches in unique_matches.items():
             log.write(f"{topic}:\n")
             log.write(f"{'-' * 80}\n")
@@ -96,7 +148,22 @@ with open(log2_path, 'w', encoding='utf-8') as log:
                     log.write("\n")
             else:
                 log.write("  None found.\n\n")
-    else:
-        log.write("No external URLs found.\n")
 
-print(f"See {log1_path} and {log2_path} for details.")
\ No newline at end of file
+    tmp_path = json_path.with_name(json_path.name + ".part")
+    with open(tmp_path, "w", encoding="utf-8") as fp:
+        json.dump({"counts": counts, "files": files,
+                   "resources": {topic: {match: sorted(set(filenames)) for match, filenames in matches.items()}
+                                 for topic, matches in unique_matches.items()}},
+                  fp, indent=1, ensure_ascii=False)
+    os.replace(tmp_path, json_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the external resources of the EPUB XHTML chapters.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Files to scan in parallel, on a process pool. Default 1, sequential.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Rescan only the files changed since the last report, {json_path}.")
+    args = parser.parse_args()
+
+    write_reports(scan_all(jobs=args.jobs, prior=load_report() if args.incremental else None))
+    print(f"See {log1_path}, {log2_path} and {json_path} for details.")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''
+Parser parity: run the cleaning and XHTML stages over every raw chapter with html.parser, and with lxml,
+then diff the normalized outputs. Switch config exe_mode parser to lxml once this reports no divergences.
+- 02 clean:   basic_html_cleanup of the raw chapter
+- 02 patched: patch_chapter of the html.parser clean chapter, so that each stage sees the same input
+- 03 xhtml:   make_epub_xhtml of the html.parser patched chapter, with custom images
+- 04 toc:     the H1 titles and sibling H2 subtitles that 04-build-ebook.py builds the TOC from
+Normalized output collapses whitespace runs to one space, and drops whitespace between tags.
+'''
+import argparse
+import copy
+import difflib
+import logging
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+import utils.utilities as utl
+import utils.config as config
+
+config_data = config.load_config()
+CHAP_RAW = config_data["proj_dirs"]["ch_raw"]
+REF = "html.parser"
+STAGES = ["02 clean", "02 patched", "03 xhtml", "04 toc"]
+
+clean_html = utl.load_script("02-clean-html.py")
+epub_xhtml = utl.load_script("03-epub-xhtml.py")
+
+def normalize(html: str) -> str:
+    """ One tag per line, whitespace runs collapsed, for diffs that ignore layout only """
+    html = re.sub(r"\s+", " ", html)
+    return re.sub(r">\s*<", ">\n<", html).strip()
+
+def toc_headers(xhtml: str, parser: str) -> str:
+    """ H1 titles and their sibling H2 subtitles, as 04-build-ebook.py reads them """
+    soup = utl.parse_html(xhtml, parser)
+    lines = []
+    for h1_tag in soup.find_all("h1"):
+        lines.append(f"h1 {h1_tag.get_text().strip()}")
+        lines.extend(f"  h2 {h2_tag.get_text().strip()}" for h2_tag in h1_tag.find_next_siblings("h2"))
+    return "\n".join(lines)
+
+def chapter_parity(fname: str, raw_html: str, alt: str, img_locations: dict, timings: dict) -> dict[str, tuple]:
+    """ {stage: (reference output, alternate output)} for one raw chapter """
+    number = int(fname.replace("chapter-", "").replace(".html", ""))
+
+    def timed(stage, backend, func, *args, **kwargs):
+        begin = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage, backend] += time.perf_counter() - begin
+        return result
+
+    outputs = {}
+    clean = {p: timed("02 clean", p, clean_html.basic_html_cleanup, raw_html, number, p) for p in (REF, alt)}
+    outputs["02 clean"] = clean[REF], clean[alt]
+    patched = {p: timed("02 patched", p, clean_html.patch_chapter, clean[REF], number, p) for p in (REF, alt)}
+    outputs["02 patched"] = patched[REF], patched[alt]
+    xhtml = {p: timed("03 xhtml", p, epub_xhtml.make_epub_xhtml, patched[REF], number, css_files=epub_xhtml.CSS_FILES,
+                      image_insertions=img_locations[p], parser=p)[1] for p in (REF, alt)}
+    outputs["03 xhtml"] = xhtml[REF], xhtml[alt]
+    outputs["04 toc"] = tuple(timed("04 toc", p, toc_headers, xhtml[REF], p) for p in (REF, alt))
+    return outputs
+
+def report(raw_dir: str, alt: str, max_diff: int, log_path: Path) -> int:
+    """ Compare every chapter, write the divergences to log_path. Return the number of diverging chapter stages """
+    fnames = sorted(f for f in os.listdir(raw_dir) if f.endswith(".html"))
+    locations = epub_xhtml.load_img_locations()
+    img_locations = {REF: locations, alt: copy.deepcopy(locations)}
+    timings = defaultdict(float)
+    counts = {stage: {"identical": 0, "normalized": 0, "diverged": 0} for stage in STAGES}
+    divergences = []
+
+    for fname in fnames:
+        with open(os.path.join(raw_dir, fname), encoding="utf-8") as fp:
+            raw_html = fp.read()
+        for stage, (ref, other) in chapter_parity(fname, raw_html, alt, img_locations, timings).items():
+            if ref == other:
+                counts[stage]["identical"] += 1
+            elif normalize(ref) == normalize(other):
+                counts[stage]["normalized"] += 1
+            else:
+                counts[stage]["diverged"] += 1
+                diff = difflib.unified_diff(normalize(ref).splitlines(), normalize(other).splitlines(),
+                                            REF, alt, n=1, lineterm="")
+                divergences.append((fname, stage, list(diff)))
+
+    with open(log_path, "w", encoding="utf-8") as log:
+        log.write(f"Parser parity, {REF} vs {alt}, {len(fnames)} chapters from {raw_dir}\n")
+        log.write(f"{'=' * 80}\n\n")
+        for stage in STAGES:
+            log.write(f"{stage:<11} identical {counts[stage]['identical']:>4}, equal once normalized "
+                      f"{counts[stage]['normalized']:>4}, diverged {counts[stage]['diverged']:>4}.  "
+                      f"Seconds {REF} {timings[stage, REF]:.2f}, {alt} {timings[stage, alt]:.2f}\n")
+        log.write("\n")
+        for fname, stage, diff in divergences:
+            log.write(f"{fname}, {stage}:\n{'-' * 80}\n")
+            log.write("\n".join(diff[:max_diff]) + "\n")
+            if len(diff) > max_diff:
+                log.write(f"  ... {len(diff) - max_diff} more diff lines\n")
+            log.write("\n")
+        if not divergences:
+            log.write(f"No divergences. {alt} is safe to select in config exe_mode parser.\n")
+    return len(divergences)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diff chapter outputs of html.parser against another parser backend.")
+    parser.add_argument("--raw-dir", default=CHAP_RAW, help="Raw chapters from 01-scrape-chapters.py.")
+    parser.add_argument("--parser", choices=[p for p in utl.html_parsers if p != REF], default="lxml",
+                        help="Parser backend to compare against html.parser.")
+    parser.add_argument("--max-diff", type=int, default=40, help="Most diff lines to log per chapter stage.")
+    args = parser.parse_args()
+
+    utl.init_logger(level=logging.WARNING)  # stage chatter, apart from the report
+    log_path = Path(r"log-rpt_parser_parity.log")
+    diverged = report(args.raw_dir, args.parser, args.max_diff, log_path)
+    print(f"{diverged} diverging chapter stages. See {log_path} for details.")
+    sys.exit(1 if diverged else 0)
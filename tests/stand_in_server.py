@@ -0,0 +1,88 @@
+# Local HTTP server standing in for powermobydick.com and archive.org in tests
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StandInServer:
+    """
+    Serve canned responses from localhost, on a free port, in a background thread.
+    - add(path, body, headers): a page, revalidated by its ETag / Last-Modified headers
+    - statuses: optional list of (status, headers) to answer first, before the page, e.g. 503 retries
+    - delay: optional seconds to wait before answering, e.g. read timeouts
+    - log: (method, path, request headers) for every request received
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.log = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.respond(send_body=False)
+
+            def do_GET(self):
+                self.respond(send_body=True)
+
+            def respond(self, send_body: bool):
+                server.log.append((self.command, self.path, dict(self.headers)))
+                route = server.routes.get(self.path)
+                if route is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                if route["delay"]:
+                    time.sleep(route["delay"])
+
+                if route["statuses"]:
+                    status, headers = route["statuses"].pop(0)
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                headers = route["headers"]
+                etag = headers.get("ETag")
+                last_mod = headers.get("Last-Modified")
+                if ((etag and self.headers.get("If-None-Match") == etag) or
+                        (not etag and last_mod and self.headers.get("If-Modified-Since") == last_mod)):
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(route["body"])))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(route["body"])
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.handle_error = lambda request, client_address: None  # clients that time out hang up early
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def add(self, path: str, body: bytes, headers: dict = None, statuses: list = None, delay: float = 0):
+        self.routes[path] = {"body": body, "headers": headers or {}, "statuses": list(statuses or []), "delay": delay}
+
+    def url(self, path: str) -> str:
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}{path}"
+
+    def hits(self, path: str, method: str = "GET") -> int:
+        return sum(1 for cmd, req_path, _ in self.log if cmd == method and req_path == path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,60 @@
+# Test 20 - Test benchmarks/corpus.py function make_corpus writes a project directory the stages run on, the same per seed,
+# and benchmarks/bench_stages.py runs stages 02 to 04 on a small one, and function compare flags only the metrics worse
+# than the baseline beyond tolerance
+import csv
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+from benchmarks.corpus import make_corpus
+from benchmarks.bench_stages import compare, rss_mb, run_stage
+
+class TestBenchmarks(unittest.TestCase):
+    def test_corpus(self):
+        with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as again:
+            counts = make_corpus(tmp, chapters=3)
+            self.assertEqual(sorted(os.listdir(Path(tmp, "chapters_01_raw"))),
+                             [f"chapter-{number:03d}.html" for number in range(151)])
+            self.assertTrue(os.listdir(Path(tmp, "custom")) and os.listdir(Path(tmp, "images")))
+            with open(Path(tmp, "custom_img_sm", "custom_img_locations_final.csv"), encoding="utf-8") as fp:
+                rows = list(csv.DictReader(fp))
+            self.assertEqual(len(rows), counts["images"])
+            for row in rows:
+                self.assertTrue(Path(tmp, "custom_img_sm", row["img_rename"]).is_file())
+                raw = Path(tmp, "chapters_01_raw", f"chapter-{int(row['chapter']):03d}.html").read_text(encoding="utf-8")
+                self.assertIn(row["following_text"] or row["preceding_text"], raw.lower())
+            self.assertGreater(counts["sidenotes"], 0)
+            self.assertNotIn("<p>", Path(tmp, "chapters_01_raw", "chapter-140.html").read_text(encoding="utf-8"))
+
+            make_corpus(again, chapters=3)
+            for name in ("chapter-001.html", "chapter-002.html"):
+                self.assertEqual(Path(tmp, "chapters_01_raw", name).read_bytes(), Path(again, "chapters_01_raw", name).read_bytes())
+
+    def test_small_corpus_stages(self):
+        """ A corpus of a few chapters runs through 02, 03 and 04, whose custom pages link to later chapters """
+        with tempfile.TemporaryDirectory() as tmp:
+            make_corpus(tmp, chapters=3)
+            for stage in ("02", "03", "04"):
+                self.assertGreater(run_stage(Path(tmp), stage)["output_bytes"], 0)
+
+    def test_rss_mb(self):
+        with mock.patch.object(sys, "platform", "darwin"):
+            self.assertEqual(rss_mb(200 * 1024 * 1024), 200.0)
+        with mock.patch.object(sys, "platform", "linux"):
+            self.assertEqual(rss_mb(200 * 1024), 200.0)
+        with mock.patch.object(sys, "platform", "win32"):
+            self.assertIsNone(rss_mb(200 * 1024))
+
+    def test_compare(self):
+        baseline = {"stages": {"02": {"wall_s": 5.0, "peak_rss_mb": 50.0, "output_bytes": 1000},
+                               "03": {"wall_s": 0.2, "peak_rss_mb": 50.0, "output_bytes": 1000}}}
+        results = {"stages": {"02": {"wall_s": 5.4, "peak_rss_mb": 60.0, "output_bytes": 1000},
+                              "03": {"wall_s": 0.24, "peak_rss_mb": None, "output_bytes": 900},
+                              "04": {"wall_s": 9.0, "peak_rss_mb": 70.0, "output_bytes": 5000}}}
+        self.assertEqual(compare(results, baseline, tolerance=0.10), ["02 peak_rss_mb: 60.0 vs 50.0 baseline, +20.0%"])
+        self.assertEqual(len(compare(results, baseline, tolerance=0.05)), 2)
+
+if __name__ == "__main__":
+    unittest.main()
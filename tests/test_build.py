@@ -0,0 +1,67 @@
+# Test 11 - Test build.py runs stages in memory, as the stage scripts do through their files, for one or both editions,
+# and 04 builds the TOC entries alike incrementally or not
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+import build
+
+ROOT = Path(__file__).parent.parent
+
+chapter = """<div id="content">
+<h1>Chapter XLII</h1>
+<h2>The Whiteness of  the Whale</h2>
+<p><b>page 188</b></p>
+<p>What the white whale was to Ahab, has been hinted; what, at times, he was to me, as yet remains unsaid.</p>
+<p><a name="note188"></a>Caf&eacute; and <a href="Moby041.html" onclick="window.open(this.href)">albatross</a>.</p>
+<p>The <a class="sidenote" title="Moby Dick &lt;i&gt;himself&lt;/i&gt;">white whale</a> appalled me.</p>
+</div>
+"""
+
+class TestBuild(unittest.TestCase):
+    def test_import_quiet(self):
+        """ Importing the stages neither logs to file nor touches the chapter directories """
+        before = sorted(os.listdir(ROOT))
+        result = subprocess.run([sys.executable, "-c", "import build"], cwd=ROOT, capture_output=True, text=True)
+        self.assertEqual((result.returncode, result.stdout), (0, ""))
+        self.assertEqual(sorted(os.listdir(ROOT)), before)
+
+    def test_clean_in_memory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for sub in ("raw", "clean", "patched"):
+                os.makedirs(os.path.join(tmp, sub))
+            with open(os.path.join(tmp, "raw", "chapter-042.html"), "w", encoding="utf-8") as fp:
+                fp.write(chapter)
+            build.clean_html.clean_chapter("chapter-042.html", *(os.path.join(tmp, sub) for sub in ("raw", "clean", "patched")))
+            with open(os.path.join(tmp, "patched", "chapter-042.html"), encoding="utf-8") as fp:
+                patched = fp.read()
+        self.assertEqual(build.clean_all({42: chapter}, write_intermediate=False), {42: patched})
+
+    def test_editions(self):
+        """ Both editions from one parse, each as patch_chapter makes it on its own """
+        editions = build.clean_editions({42: chapter}, write_intermediate=False, refs=("foot", "link"))
+        clean = build.clean_html.basic_html_cleanup(chapter, 42)
+        for ref in ("foot", "link"):
+            self.assertEqual(editions[ref][42], build.clean_html.patch_chapter(clean, 42, ref=ref))
+        self.assertIn('epub:type="footnote"', editions["foot"][42])
+        self.assertNotIn("epub:type", editions["link"][42])
+        self.assertIn('<p id="c042_ref0001">', editions["link"][42])
+
+    def test_toc_entries(self):
+        """ TOC entries in chapter order, alike with some from the build cache and all built at once """
+        xhtml = {f"chapter_{number:03d}.xhtml": f"<html><body><h1>CHAPTER {title}</h1>\n<h2>{subtitle}</h2></body></html>"
+                 for number, title, subtitle in ((1, "I.", "LOOMINGS."), (2, "II.", "THE CARPET-BAG."),
+                                                 (3, "III.", "THE SPOUTER-INN OF THE WHALE."))}
+        toc_entries = build.build_ebook.toc_entries
+        with tempfile.TemporaryDirectory() as tmp:
+            toc_entries({fname: xhtml[fname] for fname in ("chapter_001.xhtml", "chapter_003.xhtml")}, cache_dir=tmp)
+            entries = toc_entries(xhtml, cache_dir=tmp, incremental=True)
+            self.assertEqual(entries, toc_entries(xhtml, cache_dir=tmp))
+        self.assertEqual(list(entries), list(xhtml))
+        self.assertIn(">II. - The Carpet-Bag.<", entries["chapter_002.xhtml"])
+        self.assertIn(">III. - The Spouter-Inn of the Whale.<", entries["chapter_003.xhtml"])
+
+if __name__ == "__main__":
+    unittest.main()
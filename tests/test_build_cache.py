@@ -0,0 +1,61 @@
+# Test 10 - Test utils/build_cache.py class BuildCache reuse, invalidation and pruning
+import os
+import tempfile
+import unittest
+from utils.build_cache import BuildCache
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.code = self.path("02-clean-html.py", "def patch(): pass\n")
+        self.cache_dir = os.path.join(self.tmp.name, ".build_cache")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, fname: str, text: str = "") -> str:
+        path = os.path.join(self.tmp.name, fname)
+        if text:
+            with open(path, "w", encoding="utf-8") as fp:
+                fp.write(text)
+        return path
+
+    def build(self, chapters: dict[int, str], epub_ref: str = "foot") -> BuildCache:
+        """ Stand-in stage: uppercase each chapter, reusing unchanged ones """
+        cache = BuildCache("02-clean-html", self.cache_dir, [self.code])
+        cache.prune(chapters)
+        for number, html in chapters.items():
+            key = cache.key(html, epub_ref)
+            if not cache.lookup(number, key):
+                out = self.path(f"chapter-{number:03d}.html", html.upper())
+                cache.store(number, key, [out], fix_hits=[number])
+        cache.save()
+        return cache
+
+    def test_reuse_and_invalidate(self):
+        chapters = {1: "<h1>Loomings</h1>", 2: "<h1>The Carpet-Bag</h1>", 3: "<h1>The Spouter-Inn</h1>"}
+        self.assertEqual(self.build(chapters).rebuilt, [1, 2, 3])
+        self.assertEqual(self.build(chapters).reused, [1, 2, 3])
+
+        chapters[2] = "<h1>The Carpet-Bag.</h1>"                    # changed input
+        self.path("chapter-003.html", "tampered")                   # changed output
+        cache = self.build(chapters)
+        self.assertEqual((cache.rebuilt, cache.reused), ([2, 3], [1]))
+        self.assertEqual(cache.records["1"]["fix_hits"], [1])
+
+        self.assertEqual(self.build(chapters, epub_ref="link").rebuilt, [1, 2, 3])   # changed config
+
+    def test_code_version(self):
+        self.build({1: "<p>page 1</p>"})
+        self.path("02-clean-html.py", "def patch(): return 1\n")
+        self.assertEqual(self.build({1: "<p>page 1</p>"}).rebuilt, [1])
+
+    def test_prune(self):
+        self.build({1: "<p>a</p>", 2: "<p>b</p>"})
+        cache = self.build({1: "<p>a</p>"})
+        self.assertEqual(cache.removed, [2])
+        self.assertFalse(os.path.exists(self.path("chapter-002.html")))
+        self.assertIn("rebuilt 0, reused 1, removed 1", cache.summary())
+
+if __name__ == "__main__":
+    unittest.main()
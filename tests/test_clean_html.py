@@ -0,0 +1,59 @@
+# Test 08 - Test 02-clean-html.py parallel chapter cleaning matches sequential cleaning
+import filecmp
+import multiprocessing
+import os
+import tempfile
+import unittest
+import utils.utilities as utl
+
+clean_html = utl.load_script("02-clean-html.py")
+
+chapter = """<div id="content">
+<h1>Chapter {roman}</h1>
+<h2>The  Spouter-Inn</h2>
+<p><b>page {page}</b></p>
+<!-- dead link to old site -->
+<p>Entering that gable-ended <span class="sidenote" title="Spouter: a whale that spouts.&lt;i&gt;Sic&lt;/i&gt;
+">Spouter</span>-Inn, you found yourself in a wide, low, straggling entry &amp; old-fashioned wainscots.</p>
+<img src="images/spacer.gif" width="10">
+<p><a name="note{page}"></a>Caf&eacute; and <a href="Moby003.html" onclick="window.open(this.href)">tavern</a>.</p>
+</div>
+"""
+
+@unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs fork to share the test module")
+class TestCleanHtml(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.raw = os.path.join(self.tmp.name, "raw")
+        os.makedirs(self.raw)
+        for num, roman in enumerate(["I", "II", "III", "IV", "V"], start=1):
+            with open(os.path.join(self.raw, f"chapter-{num:03d}.html"), "w", encoding="utf-8") as fp:
+                fp.write(chapter.format(roman=roman, page=num * 7))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_02(self, jobs: int) -> tuple[str, str]:
+        clean, patched = (os.path.join(self.tmp.name, f"{kind}-{jobs}") for kind in ("clean", "patched"))
+        os.makedirs(clean)
+        os.makedirs(patched)
+        clean_html.scrape_all(jobs=jobs, raw_dir=self.raw, clean_dir=clean, patched_dir=patched,
+                              cache_dir=os.path.join(self.tmp.name, ".build_cache"))
+        return clean, patched
+
+    def test_parallel_identical(self):
+        for serial, parallel in zip(self.run_02(1), self.run_02(3)):
+            names = sorted(os.listdir(serial))
+            self.assertEqual(len(names), 5)
+            self.assertEqual(names, sorted(os.listdir(parallel)))
+            _, mismatch, errors = filecmp.cmpfiles(serial, parallel, names, shallow=False)
+            self.assertEqual((mismatch, errors), ([], []))
+
+    def test_fail_fast(self):
+        with open(os.path.join(self.raw, "chapter-004.html"), "wb") as fp:
+            fp.write(b"<p>\xff\xfe not utf-8</p>")
+        with self.assertRaisesRegex(RuntimeError, "chapter-004.html"):
+            self.run_02(2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+# Test 05 - Test utils/utilities.py download_url streaming of PHP images, against a local stand-in server
+import os
+import tempfile
+import unittest
+import requests
+from io import BytesIO
+from unittest import mock
+from PIL import Image
+import utils.utilities as utl
+from tests.stand_in_server import StandInServer
+from utils.fetch import HttpCache
+
+def jpeg_bytes() -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", (40, 60), (200, 180, 150)).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+php_path = "/BookReader/BookReaderImages.php?file=mobydickorwhale01melv_0001.jp2&id=mobydickorwhale01melv"
+
+class TestDownloadUrl(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = StandInServer().__enter__()
+        self.jpeg = jpeg_bytes()
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.tmp.cleanup()
+
+    def test_sniff(self):
+        self.assertEqual(utl.sniff_image_mimetype(self.jpeg), "image/jpeg")
+        self.assertEqual(utl.sniff_image_mimetype(b"\x89PNG\r\n\x1a\n...."), "image/png")
+        self.assertEqual(utl.sniff_image_mimetype(b"????", "image/gif; charset=binary"), "image/gif")
+        self.assertIsNone(utl.sniff_image_mimetype(b"<html>", "text/html"))
+
+    def test_php_image_bytes_unchanged(self):
+        self.server.add(php_path, self.jpeg, {"Content-Type": "text/html"})  # archive.org does not say image/jpeg
+        cache_dir = os.path.join(self.tmp.name, "cache")
+        for cache in (None, HttpCache(cache_dir)):
+            out_dir = tempfile.mkdtemp(dir=self.tmp.name)
+            with mock.patch.object(utl, "get_http_cache", return_value=cache):
+                utl.download_url(self.server.url(php_path), out_dir, "moby_dick-1851-page_0001", verify=True)
+            self.assertEqual(os.listdir(out_dir), ["moby_dick-1851-page_0001.jpg"])
+            with open(os.path.join(out_dir, "moby_dick-1851-page_0001.jpg"), "rb") as fp:
+                self.assertEqual(fp.read(), self.jpeg)
+        self.assertEqual([name for _, _, names in os.walk(cache_dir) for name in names], [])  # one copy, not cached
+
+    def test_present_file_not_fetched(self):
+        self.server.add(php_path, self.jpeg, {"Content-Type": "text/html"})
+        with open(os.path.join(self.tmp.name, "moby_dick-1851-page_0001.jpg"), "wb") as fp:
+            fp.write(self.jpeg)
+        with mock.patch.object(utl, "get_http_cache", return_value=None):
+            path = utl.download_url(self.server.url(php_path), self.tmp.name, "moby_dick-1851-page_0001")
+        self.assertEqual(path, os.path.join(self.tmp.name, "moby_dick-1851-page_0001.jpg"))
+        self.assertEqual(self.server.log, [])
+
+    def test_error_stream_closed(self):
+        """ A streamed response with an error status is closed, not left holding its pooled connection """
+        close = requests.Response.close
+        with mock.patch.object(utl, "get_http_cache", return_value=None), \
+             mock.patch.object(requests.Response, "close", autospec=True, side_effect=close) as closed:
+            with self.assertRaises(requests.HTTPError):
+                utl.fetch(self.server.url("/missing.jpg"), stream=True, cache=False)
+        self.assertEqual(closed.call_args.args[0].status_code, 404)
+
+    def test_php_not_an_image(self):
+        self.server.add(php_path, b"<html>Not found</html>", {"Content-Type": "text/html"})
+        with mock.patch.object(utl, "get_http_cache", return_value=None):
+            utl.download_url(self.server.url(php_path), self.tmp.name, "moby_dick-1851-page_0001")
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+if __name__ == "__main__":
+    unittest.main()
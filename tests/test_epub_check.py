@@ -0,0 +1,72 @@
+# Test 17 - Test 04-build-ebook.py function check_epubs validates each book once, reuses the result of an unchanged
+# book, and writes the XLS report from that one result. EpubCheck itself replaced by its sample JSON reports
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+import xlrd
+from epubcheck import samples
+import utils.utilities as utl
+import utils.epub_check as epub_check
+from utils.epub_zip import EpubEntry, epub_chunks
+
+build_ebook = utl.load_script("04-build-ebook.py")
+
+opf = '<package><metadata><opf:meta property="dcterms:modified">{}</opf:meta></metadata></package>'
+
+def write_epub(path: str, modified: str, chapter: bytes = b"<p>Call me Ishmael.</p>"):
+    entries = [EpubEntry("mimetype", b"application/epub+zip"),
+               EpubEntry("OEBPS/content.opf", opf.format(modified).encode("utf-8")),
+               EpubEntry("OEBPS/chapter_001.xhtml", chapter)]
+    utl.write_atomic(epub_chunks(entries), path)
+
+def sample_result(path: str) -> dict:
+    with open(path, encoding="utf-8") as fp:
+        return {"valid": path == samples.RESULT_VALID, "result": json.load(fp)}
+
+class TestEpubCheck(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.books = {"foot": os.path.join(self.tmp.name, "foot.epub"), "link": os.path.join(self.tmp.name, "link.epub")}
+        write_epub(self.books["foot"], "2026-10-18T10:00:00Z")
+        write_epub(self.books["link"], "2026-10-18T10:00:00Z", b"<p>Call me <a>Ishmael</a>.</p>")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def check(self) -> tuple[dict[str, bool], list[str]]:
+        checked = []
+        def run_epubcheck(epub_path: str) -> dict:
+            checked.append(os.path.basename(epub_path))
+            return sample_result(samples.RESULT_VALID if "foot" in epub_path else samples.RESULT_INVALID)
+        with mock.patch.object(epub_check, "run_epubcheck", run_epubcheck):
+            return build_ebook.check_epubs(self.books, cache_dir=".build_cache"), sorted(checked)
+
+    def test_content_hash(self):
+        before = epub_check.content_hash(self.books["foot"])
+        with open(self.books["foot"], "rb") as fp:
+            zip_bytes = fp.read()
+        write_epub(self.books["foot"], "2026-10-19T08:30:00Z")
+        with open(self.books["foot"], "rb") as fp:
+            self.assertNotEqual(fp.read(), zip_bytes)
+        self.assertEqual(epub_check.content_hash(self.books["foot"]), before)
+        self.assertNotEqual(epub_check.content_hash(self.books["link"]), before)
+
+    def test_check_once(self):
+        self.assertEqual(self.check(), ({"foot": True, "link": False}, ["foot.epub", "link.epub"]))
+        self.assertEqual(self.check(), ({"foot": True, "link": False}, []))  # unchanged books, not checked again
+
+        write_epub(self.books["link"], "2026-10-19T08:30:00Z", b"<p>Call me Ishmael!</p>")
+        self.assertEqual(self.check()[1], ["link.epub"])
+
+        report = xlrd.open_workbook("EPUB-link.xls")
+        messages = report.sheet_by_index(1)
+        self.assertEqual(messages.row_values(0), ["id", "level", "location", "message", "suggestion"])
+        self.assertIn("OPF-049", messages.col_values(0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# Test 18 - Test utils/epub_lint.py function lint_entries finds broken links and ids, manifest and spine errors,
+# and orphans, in the entries of a book before zipping
+import unittest
+from utils.epub_lint import lint_entries
+from utils.epub_zip import EpubEntry
+
+xhtml = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops"><head><title>T</title>
+<link href="css/book.css" rel="stylesheet" type="text/css"/></head><body>{}</body></html>"""
+
+chapter_001 = """<h1 id="title_001">I.</h1><p>Call me <a class="class_source" epub:type="noteref" id="c001_src0001"
+href="chapter_001.xhtml#c001_ref0001">Ishmael</a>, see <a href="chapter_002.xhtml#title_001">II.</a> and
+<a href="http://www.powermobydick.com/">PMD</a>.</p><img src="images/whale.jpg"/>
+<aside epub:type="footnote" id="c001_ref0001"><p><a href="chapter_001.xhtml#c001_src0001">&#9668;</a> Note.</p></aside>"""
+
+opf = """<package xmlns="http://www.idpf.org/2007/opf" version="3.0"><manifest>
+<item id="chapter_001" href="chapter_001.xhtml" media-type="application/xhtml+xml"/>
+<item id="chapter_002" href="chapter_002.xhtml" media-type="application/xhtml+xml"/>
+<item id="css_001" href="css/book.css" media-type="text/css"/>
+<item id="font" href="font.ttf" media-type="application/vnd.ms-opentype"/>
+<item id="whale" href="images/whale.jpg" media-type="image/jpeg"/>
+<item id="cover" href="images/cover.jpg" media-type="image/jpeg" properties="cover-image"/>{}
+</manifest><spine><itemref idref="chapter_001"/><itemref idref="chapter_002"/>{}</spine></package>"""
+
+def book(chapter: str = chapter_001, manifest: str = "", spine: str = "", **extra: bytes) -> dict[str, EpubEntry]:
+    files = {"mimetype": b"application/epub+zip",
+             "OEBPS/content.opf": opf.format(manifest, spine).encode("utf-8"),
+             "OEBPS/chapter_001.xhtml": xhtml.format(chapter).encode("utf-8"),
+             "OEBPS/chapter_002.xhtml": xhtml.format('<h1 id="title_001">II.</h1>').encode("utf-8"),
+             "OEBPS/css/book.css": b"@font-face { src: url('../font.ttf'); }",
+             "OEBPS/font.ttf": b"\x00", "OEBPS/images/whale.jpg": b"\xff\xd8", "OEBPS/images/cover.jpg": b"\xff\xd8"}
+    files.update({name.replace("__", "/").replace("_dot_", "."): data for name, data in extra.items()})
+    return {arcname: EpubEntry(arcname, data) for arcname, data in files.items()}
+
+class TestEpubLint(unittest.TestCase):
+    def test_clean(self):
+        report = lint_entries(book())
+        self.assertEqual((report.errors, report.warnings), ([], []))
+        self.assertEqual((report.documents, report.ids, report.links), (2, 4, 6))
+
+    def test_broken(self):
+        chapter = (chapter_001.replace('href="chapter_001.xhtml#c001_ref0001"', 'href="chapter_001.xhtml#c001_ref0002"')
+                   .replace("images/whale.jpg", "images/shark.jpg") + '<p id="title_001">Again.</p>')
+        report = lint_entries(book(chapter, manifest='<item id="map" href="images/map.jpg" media-type="image/jpeg"/>',
+                                   spine='<itemref idref="chapter_003"/>', OEBPS__notes_dot_txt=b"notes"))
+        self.assertEqual(sorted(report.errors), [
+            "OEBPS/chapter_001.xhtml: id title_001 2 times",
+            "OEBPS/chapter_001.xhtml: link to missing OEBPS/images/shark.jpg",
+            "OEBPS/chapter_001.xhtml: link to missing id OEBPS/chapter_001.xhtml#c001_ref0002",
+            "OEBPS/content.opf: manifest item map without file OEBPS/images/map.jpg",
+            "OEBPS/content.opf: spine itemref chapter_003 not in the manifest"])
+        self.assertEqual(sorted(report.warnings), [
+            "OEBPS/images/whale.jpg: orphan, nothing refers to manifest item whale",
+            "OEBPS/notes.txt: not in the manifest"])
+
+    def test_not_well_formed(self):
+        report = lint_entries(book(chapter_001 + "<p>Unclosed"))
+        self.assertEqual(len(report.errors), 1)
+        self.assertIn("not well-formed", report.errors[0])
+
+if __name__ == "__main__":
+    unittest.main()
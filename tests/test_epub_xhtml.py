@@ -0,0 +1,111 @@
+# Test 14 - Test 03-epub-xhtml.py function make_epub_xhtml renders as prettify() of an XHTML soup did, or compact,
+# and build_all on a process pool matches build_all sequential
+import csv
+import filecmp
+import multiprocessing
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+from bs4 import BeautifulSoup
+from lxml import etree
+from PIL import Image
+import utils.utilities as utl
+
+epub_xhtml = utl.load_script("03-epub-xhtml.py")
+
+chapter = """<div id="container"><div id="content"><h1 class="title" id="title_001">CHAPTER IX.</h1>
+<h2 class="subtitle" id="subtitle_001">THE TAIL—AND LANCE'S WIND &amp; WAVE.</h2>
+<p>Ship Stubb <i>tail</i> Queequeg<br/>right <a class="class_source" epub:type="noteref" href="chapter_008.xhtml#c008_ref0001"
+id="c008_src0001">harpoon</a> &lt;oil&gt;.</p><!-- page 42 --><pre>  keep   this  </pre></div></div>"""
+
+def prettify_xhtml(chapter_html: str, css_files: list[str]) -> str:
+    """ The prior make_epub_xhtml: chapter nodes moved into an lxml-xml skeleton, then prettify() """
+    xhtml = BeautifulSoup("", "lxml-xml")
+    html_tag = xhtml.new_tag("html", **{"xmlns": "http://www.w3.org/1999/xhtml", "xmlns:epub": "http://www.idpf.org/2007/ops",
+                                        "xml:lang": "en-US", "lang": "en-US"})
+    xhtml.append(html_tag)
+    head_tag = xhtml.new_tag("head")
+    html_tag.append(head_tag)
+    chapter_soup = utl.parse_html(chapter_html)
+    title_tag = xhtml.new_tag("title")
+    title_tag.string = f"{chapter_soup.h1.get_text(strip=True)} {chapter_soup.h2.get_text(strip=True)}"
+    head_tag.append(title_tag)
+    for css in css_files:
+        head_tag.append(xhtml.new_tag("link", rel="stylesheet", type="text/css", href=f"css/{css}"))
+    body_tag = xhtml.new_tag("body")
+    html_tag.append(body_tag)
+    for elem in list(chapter_soup.contents):
+        body_tag.append(elem)
+    return xhtml.prettify()
+
+def normalize(xhtml: str) -> str:
+    return re.sub(r"\s*(<[^>]+>)\s*", r"\1", re.sub(r"\s+", " ", xhtml)).strip()
+
+class TestEpubXhtml(unittest.TestCase):
+    def test_pretty(self):
+        _, xhtml = epub_xhtml.make_epub_xhtml(chapter, 8, css_files=["mobydick.css"], xhtml_format="pretty")
+        self.assertEqual(xhtml, prettify_xhtml(chapter, ["mobydick.css"]))
+
+    def test_compact(self):
+        _, pretty = epub_xhtml.make_epub_xhtml(chapter, 8, css_files=["mobydick.css"], xhtml_format="pretty")
+        _, compact = epub_xhtml.make_epub_xhtml(chapter, 8, css_files=["mobydick.css"], xhtml_format="compact")
+        etree.fromstring(compact.encode("utf-8"))
+        self.assertLess(len(compact), len(pretty))
+        self.assertIn("<pre>  keep   this  </pre>", compact)
+        self.assertEqual(normalize(compact), normalize(pretty))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            epub_xhtml.make_epub_xhtml(chapter, 8, xhtml_format="indented")
+
+img_fields = ["text_file", "img_name", "img_rename", "chapter", "target_chapter", "location",
+              "preceding_text", "following_text", "preceding_simp", "following_simp"]
+
+@unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs fork to share the patched module")
+class TestBuildAll(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.img_dir, self.src = (os.path.join(self.tmp.name, sub) for sub in ("img", "patched"))
+        os.makedirs(self.img_dir)
+        os.makedirs(self.src)
+        rows = []
+        for num in range(1, 6):
+            with open(os.path.join(self.src, f"chapter-{num:03d}.html"), "w", encoding="utf-8") as fp:
+                fp.write(chapter.replace("IX.", f"{num}."))
+            for idx, (location, width, following) in enumerate([("TOP", 600, ""), ("MID", 200, "right harpoon"),
+                                                                 ("MID", 200, "no such text")], start=1):
+                img_file = f"chap{num:03d}_img{idx:03d}.jpg"
+                Image.new("RGB", (width, 100)).save(os.path.join(self.img_dir, img_file))
+                rows.append(dict.fromkeys(img_fields, "") | {"img_rename": img_file, "chapter": str(num),
+                                                             "location": location, "following_text": following})
+        with open(os.path.join(self.img_dir, "custom_img_locations_final.csv"), "w", encoding="utf-8", newline="") as fp:
+            writer = csv.DictWriter(fp, fieldnames=img_fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_03(self, jobs: int) -> tuple[str, str]:
+        out = os.path.join(self.tmp.name, f"xhtml-{jobs}")
+        os.makedirs(out)
+        with mock.patch.object(epub_xhtml, "CUSTOM_IMG", self.img_dir):
+            epub_xhtml.build_all(self.src, out, cache_dir=os.path.join(self.tmp.name, f"cache-{jobs}"), jobs=jobs)
+        with open(os.path.join(self.img_dir, "log_insert_img.csv"), encoding="utf-8") as fp:
+            return out, fp.read()
+
+    def test_parallel_identical(self):
+        (serial, serial_log), (parallel, parallel_log) = self.run_03(1), self.run_03(3)
+        names = sorted(os.listdir(serial))
+        self.assertEqual(len(names), 5)
+        _, mismatch, errors = filecmp.cmpfiles(serial, parallel, names, shallow=False)
+        self.assertEqual((mismatch, errors), ([], []))
+        self.assertEqual(parallel_log, serial_log)
+        self.assertEqual(serial_log.count("[3]"), 2)               # TOP and MID placed, one row unplaced
+        with open(os.path.join(serial, "chapter_003.xhtml"), encoding="utf-8") as fp:
+            self.assertRegex(fp.read(), r'<img class="(left|right)_img" src="images/chap003_img002.jpg"/>')
+
+if __name__ == "__main__":
+    unittest.main()
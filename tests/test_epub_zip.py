@@ -0,0 +1,77 @@
+# Test 15 - Test utils/epub_zip.py function epub_chunks writes an EPUB zip, mimetype first and stored, images stored,
+# each entry as soon as it is compressed, and no zip over the limits without ZIP64
+import io
+import os
+import tempfile
+import time
+import unittest
+import zipfile
+from unittest import mock
+import utils.epub_zip as epub_zip
+from utils.epub_zip import EpubEntry, epub_chunks, format_report
+
+class TestEpubZip(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.jpg = os.path.join(self.tmp.name, "cover.jpg")
+        with open(self.jpg, "wb") as fp:
+            fp.write(b"\xff\xd8\xff" + os.urandom(2000))
+        chapter = "<p>Call me Ishmael. Some years ago, never mind how long precisely.</p>\n" * 200
+        self.entries = [EpubEntry("OEBPS/chapter_001.xhtml", chapter.encode("utf-8")),
+                        EpubEntry("OEBPS/images/cover.jpg", path=self.jpg),
+                        EpubEntry("META-INF/container.xml", b"<container/>"),
+                        EpubEntry("mimetype", b"application/epub+zip")]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def zip(self, jobs: int = 1, report: dict = None) -> zipfile.ZipFile:
+        return zipfile.ZipFile(io.BytesIO(b"".join(epub_chunks(self.entries, jobs=jobs, report=report))))
+
+    def test_layout(self):
+        report = {}
+        epub = self.zip(report=report)
+        self.assertIsNone(epub.testzip())
+        infos = epub.infolist()
+        self.assertEqual([info.filename for info in infos][:2], ["mimetype", "META-INF/container.xml"])
+        self.assertEqual((infos[0].compress_type, infos[0].extra), (zipfile.ZIP_STORED, b""))
+        self.assertEqual(epub.getinfo("OEBPS/images/cover.jpg").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(epub.getinfo("OEBPS/chapter_001.xhtml").compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(epub.read("OEBPS/chapter_001.xhtml"), self.entries[0].data)
+        self.assertLess(report["xhtml"][2], report["xhtml"][1] / 10)
+        self.assertEqual(report["jpg"][1:], [2003, 2003])
+        self.assertEqual(len(format_report(report, 0)), 6)
+
+    def test_parallel(self):
+        serial, parallel = self.zip(), self.zip(jobs=3)
+        self.assertEqual(parallel.namelist(), serial.namelist())
+        for name in serial.namelist():
+            self.assertEqual(parallel.read(name), serial.read(name))
+
+    def test_streamed(self):
+        """ Each entry written as it is compressed, not after all of them """
+        entries = self.entries + [EpubEntry(f"OEBPS/chapter_{n:03d}.xhtml", b"<p>Loomings.</p>" * 50) for n in range(2, 40)]
+        packed, pack_entry = [], epub_zip.pack_entry
+        def pack(entry, level):
+            packed.append(entry.arcname)
+            return pack_entry(entry, level)
+        with mock.patch.object(epub_zip, "pack_entry", pack):
+            chunks = epub_chunks(entries, jobs=2)
+            first = next(chunks)
+            time.sleep(0.2)  # time for the pool to run ahead, if unbounded
+            self.assertLessEqual(len(packed), 8)
+            epub = zipfile.ZipFile(io.BytesIO(first + b"".join(chunks)))
+        self.assertEqual(len(packed), len(entries))
+        self.assertIsNone(epub.testzip())
+
+    def test_zip64_limit(self):
+        with mock.patch.object(epub_zip, "ZIP32_LIMIT", 1000):
+            with self.assertRaisesRegex(ValueError, "without ZIP64: size of OEBPS/chapter_001.xhtml"):
+                b"".join(epub_chunks(self.entries))
+
+    def test_needs_mimetype(self):
+        with self.assertRaises(ValueError):
+            b"".join(epub_chunks(self.entries[:3]))
+
+if __name__ == "__main__":
+    unittest.main()
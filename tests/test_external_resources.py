@@ -0,0 +1,57 @@
+# Test 19 - Test report_external_resources.py function scan_file finds the matches of a findall per topic in one pass,
+# and scan_all rescans only the changed files of a prior result
+import os
+import tempfile
+import unittest
+from pathlib import Path
+import utils.utilities as utl
+
+rer = utl.load_script("report_external_resources.py")
+
+sample = ('<p>See <a href="http://www.powermobydick.com/Moby001.html">PMD</a> and https://en.wikipedia.org/wiki/Whale '
+          'of old.</p>\n<p onclick="window.open(\'https://example.org/a b\')">Map</p>\n<script src="js/notes.js"></script>'
+          '<img src="images/whale.jpg"/> ftp://ftp.example.org/moby.txt\n')
+
+class TestExternalResources(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = Path(self.tmp.name)
+        (self.src / "chapter_001.xhtml").write_text(sample, encoding="utf-8")
+        (self.src / "chapter_002.xhtml").write_text("<p>No links.</p>", encoding="utf-8")
+        (self.src / "chapter_003.xhtml").write_text("", encoding="utf-8")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_scan_file(self):
+        expected = {topic: pattern.findall(sample) for topic, pattern in rer.mtx_pattern.items()}
+        self.assertEqual(rer.scan_file(str(self.src / "chapter_001.xhtml")), expected)
+        self.assertEqual(expected["URLs"][1], "https://en.wikipedia.org/wiki/Whale")
+        self.assertEqual(len(expected["URLs"]), 4)
+        self.assertEqual(rer.scan_file(str(self.src / "chapter_003.xhtml")), {topic: [] for topic in rer.mtx_pattern})
+
+    def test_unicode_space(self):
+        """ URLs end at Unicode whitespace as in str, and bytes not UTF-8 do not shift the matches after them """
+        data = ("<p>https://a.org/Ahab\u00a0and https://b.org/Pequod\u3000ship\x1chttps://c.org/x</p>".encode("utf-8")
+                + b"\xff\xfe <p onclick=\"go('http://d.org/caf\xc3\xa9\xe2\x80\xa8')\">"
+                + b"<p>http://e.org/" + b"\xff" * 30 + b"http://f.org</p>")
+        (self.src / "chapter_004.xhtml").write_bytes(data)
+        text = data.decode("utf-8", errors="ignore")
+        expected = {topic: pattern.findall(text) for topic, pattern in rer.mtx_pattern.items()}
+        self.assertEqual(rer.scan_file(str(self.src / "chapter_004.xhtml")), expected)
+        self.assertEqual(expected["URLs"], ["https://a.org/Ahab", "https://b.org/Pequod", "https://c.org/x",
+                                            "http://d.org/caf\u00e9", "http://e.org/http://f.org"])
+
+    def test_incremental(self):
+        prior = rer.scan_all(self.src)
+        self.assertEqual(rer.scan_all(self.src, prior=prior), prior)
+
+        changed = self.src / "chapter_002.xhtml"
+        changed.write_text("<p>https://www.gutenberg.org/</p>", encoding="utf-8")
+        os.utime(changed, ns=(0, 0))
+        files = rer.scan_all(self.src, prior=prior)
+        self.assertIs(files["chapter_001.xhtml"], prior["chapter_001.xhtml"])
+        self.assertEqual(files["chapter_002.xhtml"]["matches"]["URLs"], ["https://www.gutenberg.org/"])
+
+if __name__ == "__main__":
+    unittest.main()
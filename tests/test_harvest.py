@@ -0,0 +1,57 @@
+# Test 22 - Test 00-get-archive-images.py function harvest_page drops a partial page file without a "done" manifest row
+# before downloading, and keeps an intact one. download_url replaced, to record what it finds on disk
+import os
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+from PIL import Image
+import utils.utilities as utl
+
+def jpeg_bytes() -> bytes:
+    buf = BytesIO()
+    Image.effect_noise((120, 160), 40).convert("RGB").save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+class TestHarvestPage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)  # the script logs to the working directory
+        self.harvester = utl.load_script("00-get-archive-images.py")
+        self.page_dir = os.path.join(self.tmp.name, "pages")
+        os.makedirs(self.page_dir)
+        self.patch = mock.patch.object(self.harvester, "PAGE_DIR", self.page_dir)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def harvest(self, page: int, data: bytes) -> tuple[dict, list[bool]]:
+        path = os.path.join(self.page_dir, f"{self.harvester.page_fname(page)}.jpg")
+        with open(path, "wb") as fp:
+            fp.write(data)
+        found = []
+        def download_url(url, out_dir, fname, verify=False):
+            found.append(os.path.exists(path))
+            if not os.path.exists(path):
+                with open(path, "wb") as fp:
+                    fp.write(self.jpeg)
+            return path
+        with mock.patch.object(utl, "download_url", download_url):
+            return self.harvester.harvest_page(page, utl.HostThrottle(1, 0)), found
+
+    def test_partial_and_intact(self):
+        self.jpeg = jpeg_bytes()
+        row, found = self.harvest(5, self.jpeg[:len(self.jpeg) // 2])
+        self.assertEqual(found, [False])
+        self.assertEqual((row["status"], row["size"]), ("done", len(self.jpeg)))
+
+        row, found = self.harvest(6, self.jpeg)
+        self.assertEqual(found, [True])
+        self.assertEqual(row["sha256"], self.harvester.file_sha256(os.path.join(self.page_dir, row["file"])))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# Test 03 - Test utils/fetch.py class HttpCache, against a local stand-in server
+import tempfile
+import unittest
+import requests
+from tests.stand_in_server import StandInServer
+from utils.fetch import CacheMissError, HttpCache
+
+chapter_html = "<html><body><div id=\"container\"><h1>Chapter I</h1><h2>Loomings</h2></div></body></html>".encode("utf-8")
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = StandInServer().__enter__()
+        self.server.add("/Moby001.html", chapter_html,
+                        {"Content-Type": "text/html; charset=utf-8", "ETag": '"abc123"',
+                         "Last-Modified": "Mon, 02 Mar 2020 10:00:00 GMT"})
+        self.server.add("/Moby002.html", chapter_html,
+                        {"Content-Type": "text/html; charset=utf-8", "Last-Modified": "Tue, 03 Mar 2020 10:00:00 GMT"})
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.tmp.cleanup()
+
+    def test_revalidate_with_etag(self):
+        cache = HttpCache(self.tmp.name)
+        url = self.server.url("/Moby001.html")
+
+        first = cache.get(url)
+        self.assertFalse(first.from_cache)
+        self.assertEqual(first.content, chapter_html)
+
+        second = cache.get(url)
+        self.assertTrue(second.from_cache)
+        self.assertEqual(second.text, chapter_html.decode("utf-8"))
+        self.assertEqual(self.server.log[-1][2].get("If-None-Match"), '"abc123"')
+
+    def test_revalidate_with_last_modified(self):
+        cache = HttpCache(self.tmp.name)
+        url = self.server.url("/Moby002.html")
+        cache.get(url)
+        self.assertTrue(cache.get(url).from_cache)
+        self.assertEqual(self.server.log[-1][2].get("If-Modified-Since"), "Tue, 03 Mar 2020 10:00:00 GMT")
+
+    def test_offline(self):
+        url = self.server.url("/Moby001.html")
+        HttpCache(self.tmp.name).get(url)
+        hits = len(self.server.log)
+
+        offline = HttpCache(self.tmp.name, offline=True)
+        self.assertEqual(offline.get(url).content, chapter_html)
+        self.assertEqual(len(self.server.log), hits)
+        with self.assertRaises(CacheMissError):
+            offline.get(self.server.url("/Moby002.html"))
+
+    def test_error_status(self):
+        cache = HttpCache(self.tmp.name)
+        with self.assertRaises(requests.HTTPError):
+            cache.get(self.server.url("/Moby999.html"))
+        self.assertIsNone(cache.lookup(self.server.url("/Moby999.html")))
+
+    def test_torn_meta_is_a_miss(self):
+        cache = HttpCache(self.tmp.name)
+        url = self.server.url("/Moby001.html")
+        cache.get(url)
+        with open(cache._paths(url)[1], "w", encoding="utf-8") as fp:
+            fp.write('{"url": "')
+        self.assertIsNone(cache.lookup(url))
+        self.assertFalse(cache.get(url).from_cache)
+        self.assertTrue(cache.get(url).from_cache)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+# Test 04 - Test utils/fetch.py class HttpClient retries, timeouts and stats, against a local stand-in server
+import time
+import unittest
+import requests
+from tests.stand_in_server import StandInServer
+from utils.fetch import HttpClient
+
+page = b"<html><body><p><i>page 315</i></p></body></html>"
+
+class TestHttpClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_retry_after(self):
+        self.server.add("/Moby035.html", page, {"Content-Type": "text/html"},
+                        statuses=[(503, {"Retry-After": "0.3"}), (429, {})])
+        client = HttpClient(retries=3, backoff=0.01)
+
+        begin = time.monotonic()
+        rsp = client.get(self.server.url("/Moby035.html"))
+        self.assertGreaterEqual(time.monotonic() - begin, 0.3)
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(rsp.content, page)
+        self.assertEqual((rsp.stats.retries, rsp.stats.bytes, rsp.stats.status), (2, len(page), 200))
+        self.assertEqual(self.server.hits("/Moby035.html"), 3)
+
+    def test_bounded_retries(self):
+        self.server.add("/BookReaderImages.php", b"", statuses=[(500, {})] * 5)
+        client = HttpClient(retries=2, backoff=0.01)
+        rsp = client.get(self.server.url("/BookReaderImages.php"))
+        self.assertEqual(rsp.status_code, 500)
+        self.assertEqual(self.server.hits("/BookReaderImages.php"), 3)
+        self.assertIn("1 failures", client.summary())
+
+    def test_no_retry_on_404(self):
+        client = HttpClient(retries=3, backoff=0.01)
+        self.assertEqual(client.get(self.server.url("/Moby999.html")).status_code, 404)
+        self.assertEqual(self.server.hits("/Moby999.html"), 1)
+
+    def test_read_timeout(self):
+        self.server.add("/slow.html", page, delay=0.5)
+        client = HttpClient(timeout=(1, 0.1), retries=1, backoff=0.01)
+        with self.assertRaises(requests.Timeout):
+            client.get(self.server.url("/slow.html"))
+        self.assertEqual(client.stats[-1].retries, 1)
+
+if __name__ == "__main__":
+    unittest.main()
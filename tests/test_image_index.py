@@ -0,0 +1,49 @@
+# Test 13 - Test utils/image_index.py class ImageIndex reads image headers once, refreshes changed files only, and saves atomically
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from utils.image_index import ImageIndex
+
+class TestImageIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        Image.new("RGB", (300, 200)).save(self.path("narrow.jpg"))
+        Image.new("RGB", (640, 480)).save(self.path("wide.png"))
+        with open(self.path("broken.jpg"), "wb") as fp:
+            fp.write(b"not an image")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, fname: str) -> str:
+        return os.path.join(self.tmp.name, fname)
+
+    def test_refresh(self):
+        index = ImageIndex(self.tmp.name).refresh()
+        self.assertEqual(index.updated, ["broken.jpg", "narrow.jpg", "wide.png"])
+        self.assertEqual((index.get("narrow.jpg")["width"], index.get("narrow.jpg")["height"]), (300, 200))
+        self.assertEqual(index.media_type("wide.png"), "image/png")
+        self.assertIsNone(index.get("broken.jpg")["width"])
+
+        index = ImageIndex(self.tmp.name).refresh()                   # from the saved CSV
+        self.assertEqual((index.updated, index.get("wide.png")["width"]), ([], 640))
+
+        Image.new("RGB", (400, 100)).save(self.path("narrow.jpg"))
+        os.utime(self.path("narrow.jpg"), ns=(1, 1))
+        os.remove(self.path("wide.png"))
+        index = ImageIndex(self.tmp.name).refresh()
+        self.assertEqual((index.updated, index.removed), (["narrow.jpg"], ["wide.png"]))
+        self.assertEqual(index.get("narrow.jpg")["width"], 400)
+
+    def test_concurrent_save(self):
+        """ Saves at once, as from pool workers, each through a temp file of its own """
+        indexes = [ImageIndex(self.tmp.name).refresh() for _ in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda index: [index.save() for _ in range(20)], indexes))
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["broken.jpg", "image_index.csv", "narrow.jpg", "wide.png"])
+        self.assertEqual(ImageIndex(self.tmp.name).records, indexes[0].records)
+
+if __name__ == "__main__":
+    unittest.main()
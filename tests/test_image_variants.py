@@ -0,0 +1,94 @@
+# Test 16 - Test utils/image_variants.py function make_variant, and 00-optimize-images.py function optimize_all
+# makes, reuses and prunes variants per profile
+import os
+import tempfile
+import unittest
+from unittest import mock
+from PIL import ExifTags, Image
+import utils.utilities as utl
+from utils.image_variants import make_variant
+
+optimize_images = utl.load_script("00-optimize-images.py")
+
+lowmem = {"max_width": 400, "max_height": 300, "quality": 70, "progressive": False}
+
+class TestImageVariants(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.img_dir = os.path.join(self.tmp.name, "images")
+        os.makedirs(self.img_dir)
+        Image.radial_gradient("L").resize((1000, 600)).save(os.path.join(self.img_dir, "scan.jpg"), quality=95)
+        Image.effect_noise((200, 100), 80).save(os.path.join(self.img_dir, "logo.jpg"), quality=20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_make_variant(self):
+        dest = os.path.join(self.tmp.name, "scan.jpg")
+        size, variant_size = make_variant(os.path.join(self.img_dir, "scan.jpg"), dest, lowmem)
+        self.assertLess(variant_size, size)
+        with Image.open(dest) as image:
+            self.assertEqual((image.size, image.mode, image.info.get("progressive")), ((400, 240), "L", None))
+
+        # Fits already, and re-encoding at quality 70 would not shrink it: kept as it is
+        dest = os.path.join(self.tmp.name, "logo.jpg")
+        size, variant_size = make_variant(os.path.join(self.img_dir, "logo.jpg"), dest, lowmem)
+        self.assertEqual(variant_size, size)
+
+    def test_orientation_and_icc(self):
+        """ Turned upright per EXIF, and the ICC profile of an RGB source kept, that of a CMYK one dropped """
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6                            # stored landscape, shown portrait
+        src, dest = os.path.join(self.img_dir, "turned.jpg"), os.path.join(self.tmp.name, "turned.jpg")
+        Image.new("RGB", (1000, 600), "navy").save(src, exif=exif, icc_profile=b"rgb profile")
+        make_variant(src, dest, lowmem)
+        with Image.open(dest) as image:
+            self.assertEqual((image.size, image.getexif().get(ExifTags.Base.Orientation)), ((180, 300), None))
+            self.assertEqual(image.info.get("icc_profile"), b"rgb profile")
+
+        Image.new("CMYK", (200, 100)).save(src, icc_profile=b"cmyk profile")
+        make_variant(src, dest, lowmem)
+        with Image.open(dest) as image:
+            self.assertEqual((image.mode, image.info.get("icc_profile")), ("RGB", None))
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["images", "turned.jpg"])  # no temp file left
+
+    def test_optimize_all(self):
+        def optimize():
+            with mock.patch.dict(optimize_images.IMAGE_PROFILES, {"lowmem": lowmem}):
+                return optimize_images.optimize_all("lowmem", (self.img_dir,), cache_dir=cache_dir, variants_root=variants)
+
+        cache_dir, variants = (os.path.join(self.tmp.name, sub) for sub in (".build_cache", "img_variants"))
+        report = optimize()
+        self.assertEqual(report["images"][:2], [2, sum(os.path.getsize(os.path.join(self.img_dir, fname))
+                                                       for fname in ("scan.jpg", "logo.jpg"))])
+        self.assertEqual(sorted(os.listdir(os.path.join(variants, "lowmem", "images"))), ["logo.jpg", "scan.jpg"])
+        self.assertEqual(optimize(), report)                                 # reused, same report
+
+        os.remove(os.path.join(self.img_dir, "logo.jpg"))
+        self.assertEqual(optimize()["images"][0], 1)
+        self.assertEqual(os.listdir(os.path.join(variants, "lowmem", "images")), ["scan.jpg"])
+
+    def test_failure_keeps_made(self):
+        """ The variants made before a bad image stay in the build cache, not made again """
+        with open(os.path.join(self.img_dir, "zz_broken.jpg"), "wb") as fp:
+            fp.write(b"not an image")
+        cache_dir, variants = (os.path.join(self.tmp.name, sub) for sub in (".build_cache", "img_variants"))
+        made = []
+        def counted(src, dest, profile):
+            made.append(os.path.basename(src))
+            return make_variant(src, dest, profile)
+
+        with mock.patch.dict(optimize_images.IMAGE_PROFILES, {"lowmem": lowmem}), \
+             mock.patch.object(optimize_images, "make_variant", counted):
+            with self.assertRaises(RuntimeError):
+                optimize_images.optimize_all("lowmem", (self.img_dir,), cache_dir=cache_dir, variants_root=variants)
+            os.remove(os.path.join(self.img_dir, "zz_broken.jpg"))
+            optimize_images.optimize_all("lowmem", (self.img_dir,), cache_dir=cache_dir, variants_root=variants)
+        self.assertEqual(made, ["logo.jpg", "scan.jpg", "zz_broken.jpg"])
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            optimize_images.load_profile("e-ink")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+# Test 12 - Test utils/utilities.py function insert_custom_images finds anchors through class BlockTextIndex
+import unittest
+import utils.utilities as utl
+
+chapter = """<div><h1>Chapter I</h1><h2>Loomings.</h2>
+<p>Call me Ishmael. Some years ago - never mind how long precisely.</p>
+<p>It is a way I have of driving off the spleen, and regulating the circulation.</p>
+<p>There now is your insular city of the Manhattoes, belted round by wharves.</p></div>"""
+
+def row(chapter: int, img: str, location: str = "MID", following: str = "", following_simp: str = "") -> dict:
+    return {"chapter": str(chapter), "img_rename": img, "location": location, "preceding_text": "",
+            "following_text": following, "preceding_simp": "", "following_simp": following_simp}
+
+class TestInsertImages(unittest.TestCase):
+    def test_block_text_index(self):
+        index = utl.BlockTextIndex(utl.parse_html(chapter))
+        self.assertEqual(index.find("call me ishmael", "").name, "p")
+        self.assertIn("Manhattoes", index.find("", "insularcityofthe").get_text())
+        self.assertIn("spleen", index.find("driving off", "insularcity").get_text())   # first block wins
+        self.assertIsNone(index.find("circulation. there now", ""))                     # not across blocks
+        self.assertIsNone(index.find("", ""))
+
+    def test_insert_by_chapter(self):
+        rows = [row(1, "ishmael.jpg", following="some years ago"), row(2, "other.jpg", following="call me"),
+                row(1, "manhattoes.jpg", following_simp="beltedroundbywharves"), row(1, "top.jpg", "TOP")]
+        rows, html = utl.insert_custom_images(1, chapter, "no_such_dir", rows)
+        self.assertEqual([r.get("chapters") for r in rows], [[1], None, [1], [1]])
+        self.assertLess(html.index("top.jpg"), html.index("<h1>"))
+        self.assertLess(html.index("ishmael.jpg"), html.index("Call me"))
+        self.assertLess(html.index("spleen"), html.index("manhattoes.jpg"))
+        self.assertNotIn("other.jpg", html)
+
+if __name__ == "__main__":
+    unittest.main()
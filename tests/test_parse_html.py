@@ -0,0 +1,28 @@
+# Test 09 - Test utils/utilities.py function parse_html serializes fragments the same with either parser backend
+import unittest
+import utils.utilities as utl
+
+fragments = ['<div id="container">\n<h1>Chapter XXXV</h1>\n<p><i>page 315</i></p>\n</div>\n',
+             "Specksynder: chief harpooner. Of the Dutch term <i>speksnijder</i>.",
+             "<a href='http://en.wikipedia.org/wiki/Queen_Mab' target='_blank'>Queen Mab:</a> A fairy",
+             '<link href="css/mobydick.css" rel="stylesheet"/><div class="header">x</div><!-- note --> tail',
+             "caf&eacute; &amp; tavern"]
+
+class TestParseHtml(unittest.TestCase):
+    def test_fragments(self):
+        for fragment in fragments:
+            expected = str(utl.parse_html(fragment, "html.parser"))
+            self.assertEqual(str(utl.parse_html(fragment, "lxml")), expected)
+
+    def test_document_kept(self):
+        doc = "<html><head><title>Loomings</title></head><body><h1>Chapter I</h1></body></html>"
+        self.assertEqual(str(utl.parse_html(doc, "lxml")), doc)
+
+    def test_get_html_parser(self):
+        self.assertEqual(utl.get_html_parser("lxml"), "lxml")
+        self.assertIn(utl.get_html_parser(), utl.html_parsers)
+        with self.assertRaises(ValueError):
+            utl.get_html_parser("html5lib")
+
+if __name__ == "__main__":
+    unittest.main()
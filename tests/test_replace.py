@@ -0,0 +1,41 @@
+# Test 07 - Test utils/replace.py class ReplaceRules gives the same result as sequential str.replace
+import random
+import unittest
+from utils.replace import ReplaceRules, overlaps
+
+class TestReplaceRules(unittest.TestCase):
+    def test_overlaps(self):
+        self.assertTrue(overlaps("&amp;", "amp"))
+        self.assertTrue(overlaps("Å", "Å«"))
+        self.assertTrue(overlaps("ab", "bc"))   # edge overlap, "abc"
+        self.assertFalse(overlaps("<h2>Sources</h2>", "&eacute;"))
+
+    def test_groups(self):
+        rules = ReplaceRules({"&eacute;": "é", "&amp;": "&",
+                              "&": "and",        # replaces output of prior rule
+                              "<!-- x -->": "",   # empty replacement closes its group
+                              "<h2>Blogs</h2>": "<h1>Blogs</h1>"})
+        self.assertEqual(rules.groups, [(0, 1), (2, 3), (4,)])
+
+    def test_chained_rules(self):
+        rules = ReplaceRules([("a", "b"), ("b", "c"), ("<!---->", ""), ("xy", "Z")])
+        text = "abab x<!---->y ba"
+        self.assertEqual(rules.apply(text), rules.apply_sequential(text))
+        self.assertEqual(rules.apply(text)[0], "cccc Z cc")
+
+    def test_random_rules(self):
+        rng = random.Random(1851)
+        word = lambda n: "".join(rng.choice("ab<>&") for _ in range(n))
+        for _ in range(500):
+            rules = ReplaceRules([(word(rng.randint(1, 3)), word(rng.randint(0, 3))) for _ in range(rng.randint(1, 8))])
+            text = word(60)
+            self.assertEqual(rules.apply(text, verify=True), rules.apply_sequential(text))
+
+    def test_hits(self):
+        rules = ReplaceRules({"&eacute;": "é", "&amp;": "&", "<h2>Sources</h2>": "<h1>Sources</h1>"})
+        text, hits = rules.apply("caf&eacute; &amp; caf&eacute; <h2>Sources</h2>")
+        self.assertEqual(text, "café & café <h1>Sources</h1>")
+        self.assertEqual(hits, [2, 1, 1])
+
+if __name__ == "__main__":
+    unittest.main()
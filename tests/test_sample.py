@@ -2,7 +2,7 @@
 import os
 import sys
 import unittest
-from utils.utilities import titlecase
+from utils.utilities import titlecase, titlecase_many
 import utils.config as config
 
 input_strs =   ["the dog's adventure AND IN THE \"big\" city",
@@ -38,5 +38,10 @@ class TestTitleCase(unittest.TestCase):
             print(f"Expected: {expected_str}")
             self.assertEqual(actual_str, expected_str)
 
+    def test_titlecase_many(self):
+        self.assertEqual(titlecase_many(input_strs, ignore_list), expect_strs)
+        self.assertEqual(titlecase_many(input_strs * 2, frozenset(ignore_list)), expect_strs * 2)
+        self.assertEqual(titlecase_many(["THE END", "end of THE line"], ["The"]), ["The End", "End Of the Line"])
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,85 @@
+# Test 21 - Test 01-scrape-chapters.py function scrape_all, incrementally from its scrape manifest, against a local
+# stand-in server: unchanged Last-Modified skipped, changed slices rewritten, an unreadable manifest a full scrape
+import os
+import tempfile
+import unittest
+from unittest import mock
+import utils.utilities as utl
+from tests.stand_in_server import StandInServer
+from utils.fetch import HttpClient
+
+scrape = utl.load_script("01-scrape-chapters.py")
+
+toc = b'<html><body><a href="Moby001.html">I</a> <a href="Moby002.html">II</a></body></html>'
+page = '<html><body><div id="container"><h1>Chapter {}</h1><p>{}</p></div><p style="text-align:right">next</p>{}</body></html>'
+
+class TestScrapeIncremental(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.server = StandInServer().__enter__()
+        self.server.add("/", toc, {"Content-Type": "text/html; charset=utf-8"})
+        self.chapter(1, "Call me Ishmael.", "Mon, 02 Mar 2020 10:00:00 GMT")
+        self.chapter(2, "The Carpet-Bag.", "Mon, 02 Mar 2020 10:00:00 GMT")
+        self.slots = []
+        test = self
+
+        class CountingThrottle(utl.HostThrottle):
+            def slot(self, url):
+                test.slots.append(url)
+                return super().slot(url)
+
+        self.patches = [mock.patch.object(scrape, "BASE_URL", self.server.url("/")),
+                        mock.patch.object(scrape, "MIN_INTERVAL", 0.05),
+                        mock.patch.object(utl, "http_client", HttpClient(retries=0)),
+                        mock.patch.object(utl, "get_http_cache", lambda: None),
+                        mock.patch.object(utl, "HostThrottle", CountingThrottle)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.server.__exit__()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def chapter(self, number: int, text: str, last_mod: str, footer: str = ""):
+        self.server.add(f"/Moby{number:03d}.html", page.format(number, text, footer).encode("utf-8"),
+                        {"Content-Type": "text/html; charset=utf-8", "Last-Modified": last_mod})
+
+    def raw(self, number: int) -> str:
+        with open(os.path.join(scrape.CHAP_RAW, f"chapter-{number:03d}.html"), encoding="utf-8") as fp:
+            return fp.read()
+
+    def test_incremental(self):
+        self.assertEqual(scrape.scrape_all(), [1, 2])
+        self.assertEqual(sorted(scrape.load_manifest()), [1, 2])
+
+        # Unchanged Last-Modified: HEAD only, no GET
+        self.assertEqual(scrape.scrape_all(incremental=True), [])
+        self.assertEqual([self.server.hits(f"/Moby00{n}.html") for n in (1, 2)], [1, 1])
+        self.assertEqual([self.server.hits(f"/Moby00{n}.html", "HEAD") for n in (1, 2)], [1, 1])
+
+        # Changed Last-Modified: chapter 1 changed outside its slice, chapter 2 inside. Only chapter 2 is rewritten
+        self.chapter(1, "Call me Ishmael.", "Tue, 03 Mar 2020 10:00:00 GMT", footer="<p>New footer</p>")
+        self.chapter(2, "The Carpet-Bag, revised.", "Tue, 03 Mar 2020 10:00:00 GMT")
+        self.assertEqual(scrape.scrape_all(jobs=2, incremental=True), [2])
+        self.assertIn("revised", self.raw(2))
+        self.assertEqual(scrape.load_manifest()[1]["last_modified"], "2020-03-03T10:00:00")
+        self.assertEqual(self.slots.count(self.server.url("/Moby002.html")), 2)  # a slot for the HEAD, one for the GET
+
+    def test_unreadable_manifest(self):
+        scrape.scrape_all()
+        with open(scrape.MANIFEST, "w", encoding="utf-8") as fp:
+            fp.write("chapter,url\nnot a number,\n")
+        self.assertEqual(scrape.load_manifest(), {})
+        self.assertEqual(scrape.scrape_all(incremental=True), [1, 2])
+        self.assertEqual([self.server.hits(f"/Moby00{n}.html") for n in (1, 2)], [2, 2])
+
+        os.remove(scrape.MANIFEST)
+        self.assertEqual(scrape.scrape_all(incremental=True), [1, 2])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# Test 06 - Test utils/utilities.py sweep_last_modified, against a local stand-in server, and 05-pmd-updates.py
+# reports changes against the last good observation of each page, past an error sweep
+import os
+import tempfile
+import unittest
+from unittest import mock
+import utils.utilities as utl
+from tests.stand_in_server import StandInServer
+from utils.fetch import HttpClient
+
+class TestSweepLastModified(unittest.TestCase):
+    def test_sweep(self):
+        with StandInServer() as server:
+            for i in range(1, 11):
+                server.add(f"/Moby{i:03d}.html", b"", {"Last-Modified": f"Mon, {i:02d} Mar 2020 10:00:00 GMT"})
+            server.add("/Moby0001.html", b"")
+            urls = [server.url(f"/Moby{i:03d}.html") for i in range(1, 11)]
+            urls += [server.url("/Moby0001.html"), server.url("/Moby999.html")]
+
+            with mock.patch.object(utl, "http_client", HttpClient(retries=0)):
+                results = utl.sweep_last_modified(urls, jobs=4, throttle=utl.HostThrottle(4, 0))
+
+            self.assertEqual(list(results), urls)
+            self.assertEqual(results[urls[0]], "2020-03-01T10:00:00")
+            self.assertEqual(results[urls[9]], "2020-03-10T10:00:00")
+            self.assertTrue(results[urls[10]].startswith("Error"))
+            self.assertEqual(results[urls[11]], "Error: HTTP status 404")
+            self.assertEqual(server.hits("/Moby005.html", "HEAD"), 1)
+
+class TestPmdUpdates(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)  # the script logs to the working directory
+        self.updates = utl.load_script("05-pmd-updates.py")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_recovered_after_error(self):
+        pages = {"u1": "Chapter 1", "u2": "Chapter 2"}
+        self.updates.append_history("2024-01-01T00:00:00Z", pages, {"u1": "2020-03-01T10:00:00", "u2": "2020-03-02T10:00:00"})
+        self.updates.append_history("2024-02-01T00:00:00Z", pages, {"u1": "Error: timed out", "u2": "2020-03-02T10:00:00"})
+        prior = self.updates.load_prior()
+        self.assertEqual(prior, {"u1": "2020-03-01T10:00:00", "u2": "2020-03-02T10:00:00"})
+
+        # u1 works again, unchanged since its last good observation. u2 changed
+        results = {"u1": "2020-03-01T10:00:00", "u2": "2020-04-02T10:00:00"}
+        self.assertEqual(self.updates.changed_since(prior, results), [("u2", "2020-03-02T10:00:00", "2020-04-02T10:00:00")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+# Test 02 - Test utils/utilities.py class HostThrottle
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from utils.utilities import HostThrottle
+
+class TestHostThrottle(unittest.TestCase):
+    def test_spacing_and_cap(self):
+        throttle = HostThrottle(max_per_host=2, min_interval=0.05)
+        lock = threading.Lock()
+        starts = []
+        in_flight = [0, 0]  # current, max
+
+        def request(url):
+            with throttle.slot(url):
+                with lock:
+                    starts.append(time.monotonic())
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight[1], in_flight[0])
+                time.sleep(0.02)
+                with lock:
+                    in_flight[0] -= 1
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            list(pool.map(request, ["http://example.com/Moby{:03d}.html".format(i) for i in range(6)]))
+
+        # 6 request starts, at least 5 intervals apart. Thread scheduling may skew individual gaps.
+        starts.sort()
+        self.assertLessEqual(in_flight[1], 2)
+        self.assertGreaterEqual(starts[-1] - starts[0], 5 * 0.05 - 0.01)
+
+    def test_hosts_are_independent(self):
+        throttle = HostThrottle(max_per_host=1, min_interval=0.2)
+        begin = time.monotonic()
+        with throttle.slot("http://www.powermobydick.com/"):
+            pass
+        with throttle.slot("https://ia800205.us.archive.org/BookReader/"):
+            pass
+        self.assertLess(time.monotonic() - begin, 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
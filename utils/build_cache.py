@@ -0,0 +1,88 @@
+'''
+Incremental builds for the chapter stages 02, 03 and 04, and the image variants of 00-optimize-images.py.
+- Per stage, a JSON record per chapter, or per image: the key it was built with, and the sha256 of each output file
+- A key hashes the chapter input, whatever config and data the stage reads for that chapter,
+  and the stage code version, a hash of the stage script and the utils it imports
+- A chapter is reused only with the same key and its outputs intact on disk. Else it is rebuilt
+- Outputs of chapters whose input is gone are removed
+'''
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def sha256_file(path: str) -> str:
+    with open(path, "rb") as fp:
+        return sha256_bytes(fp.read())
+
+def item_id(item: str) -> int | str:
+    """ Chapter number, or other item id, such as an image path, of a record """
+    return int(item) if item.isdigit() else item
+
+def code_version(*paths: str) -> str:
+    """ Hash of the source files of a stage """
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(Path(path).read_bytes().replace(b"\r\n", b"\n"))
+    return sha.hexdigest()
+
+class BuildCache:
+    """ Build records of one stage, saved as cache_dir/<stage>.json. Records of chapters, or of other units """
+    def __init__(self, stage: str, cache_dir: str, code_files: list[str], unit: str = "chapters"):
+        self.stage = stage
+        self.unit = unit
+        self.path = os.path.join(cache_dir, f"{stage}.json")
+        self.version = code_version(*code_files)
+        self.records = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as fp:
+                self.records = json.load(fp)
+        self.rebuilt, self.reused, self.removed = [], [], []
+
+    def key(self, *parts) -> str:
+        """ Build key of a chapter, from its input hash, config values and data rows. Parts must be JSON """
+        return sha256_bytes(json.dumps([self.version, parts], sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+    def lookup(self, chapter: int | str, key: str) -> dict | None:
+        """ Record of a chapter built with this key, with its outputs unchanged. Else None """
+        record = self.records.get(str(chapter))
+        if not record or record["key"] != key:
+            return None
+        for path, sha in record["outputs"].items():
+            if not os.path.exists(path) or sha256_file(path) != sha:
+                return None
+        self.reused.append(chapter)
+        return record
+
+    def store(self, chapter: int | str, key: str, outputs: list[str], **extra):
+        """ Record a rebuilt chapter, its output files, and any extra results to restore when reused """
+        self.records[str(chapter)] = {"key": key, "outputs": {path: sha256_file(path) for path in outputs}, **extra}
+        self.rebuilt.append(chapter)
+
+    def prune(self, chapters) -> list[int | str]:
+        """ Forget chapters not in chapters, the chapters with input, and remove their outputs """
+        keep = {str(chapter) for chapter in chapters}
+        for chapter in sorted(set(self.records) - keep, key=item_id):
+            for path in self.records.pop(chapter)["outputs"]:
+                if os.path.exists(path):
+                    os.remove(path)
+                    logger.info(f"Removed stale {path}")
+            self.removed.append(item_id(chapter))
+        return self.removed
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".part"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(self.records, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def summary(self) -> str:
+        return (f"Build cache {self.stage}: rebuilt {len(self.rebuilt)}, reused {len(self.reused)}, "
+                f"removed {len(self.removed)} {self.unit}.")
@@ -0,0 +1,43 @@
+# EpubCheck validation, run once per book: the verdict and the messages both come from its JSON report.
+# - content_hash() identifies a book by its entries, not its zip bytes, and ignores the dcterms:modified date,
+#   which changes with every build, so that an unchanged book need not be validated again
+# - write_xls() writes the report as the epubcheck command line -x did, from that same JSON
+import hashlib
+import re
+import zipfile
+
+import tablib
+from epubcheck import EpubCheck, __version__ as EPUBCHECK_VERSION
+from epubcheck.models import Checker, Message, Meta
+
+MODIFIED = re.compile(rb'(property="dcterms:modified"[^>]*>)[^<]*')
+
+def content_hash(epub_path: str) -> str:
+    """ sha256 of the entry names and data of the EPUB, in zip order, with dcterms:modified blanked in the OPF """
+    sha = hashlib.sha256()
+    with zipfile.ZipFile(epub_path) as epub:
+        for info in epub.infolist():
+            data = epub.read(info)
+            if info.filename.endswith(".opf"):
+                data = MODIFIED.sub(rb"\1", data)
+            sha.update(info.filename.encode("utf-8") + b"\0" + str(len(data)).encode() + b"\0")
+            sha.update(data)
+    return sha.hexdigest()
+
+def run_epubcheck(epub_path: str) -> dict:
+    """ Validate the EPUB with one EpubCheck run. Return {"valid": verdict, "result": its JSON report} """
+    check = EpubCheck(epub_path)
+    return {"valid": check.valid, "result": check.result_data}
+
+def messages(result: dict) -> list[Message]:
+    return Message.from_data(result)
+
+def write_xls(result: dict, xls_path: str):
+    """ Checker and publication sheet, and messages sheet, of the JSON report """
+    metas = tablib.Dataset(headers=Checker._fields + Meta._fields)
+    metas.append(Checker.from_data(result) + Meta.from_data(result).flatten())
+    message_rows = tablib.Dataset(headers=Message._fields)
+    for message in messages(result):
+        message_rows.append(message)
+    with open(xls_path, "wb") as fp:
+        fp.write(bytes(tablib.Databook((metas, message_rows)).export("xls")))
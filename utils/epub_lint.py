@@ -0,0 +1,120 @@
+# Structural pre-validation of an EPUB from its entries, before zipping. Far less than EpubCheck, but in well
+# under a second, so that every build runs it:
+# - one book-wide index of the ids, and of the internal href and src links, of every XHTML document
+# - every link resolves to a file of the book, and its fragment, if any, to an id of that file
+# - ids unique per document
+# - the content.opf manifest matches the files, the spine refers to manifest items, and no resource is orphaned
+import posixpath
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from urllib.parse import unquote, urlsplit
+
+from lxml import etree
+
+OPF_NS = "{http://www.idpf.org/2007/opf}"
+LINK_ATTRS = ("href", "src", "{http://www.w3.org/1999/xlink}href")  # xlink:href of SVG <image>
+CSS_URL = re.compile(rb"""url\(\s*['"]?([^'")\s]+)""")
+XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+@dataclass
+class LintReport:
+    errors: list[str] = field(default_factory=list)
+    warnings: list[str] = field(default_factory=list)
+    documents: int = 0
+    ids: int = 0
+    links: int = 0
+
+    def summary(self) -> str:
+        return (f"EPUB pre-validation: {self.documents} documents, {self.ids} ids, {self.links} internal links, "
+                f"{len(self.errors)} errors, {len(self.warnings)} warnings.")
+
+def resolve(base: str, url: str) -> tuple[str, str] | None:
+    """ (path in the zip, fragment) of an internal link from the entry base. None for external links """
+    parts = urlsplit(url)
+    if parts.scheme or parts.netloc:
+        return None
+    path = posixpath.normpath(posixpath.join(posixpath.dirname(base), unquote(parts.path))) if parts.path else base
+    return path, unquote(parts.fragment)
+
+def index_xhtml(arcname: str, data: bytes) -> tuple[Counter, list[tuple[str, str]]]:
+    """ Counter of the ids, and the (target, fragment) of each internal link, of one XHTML document """
+    ids = Counter()
+    links = []
+    for elem in etree.fromstring(data, XML_PARSER).iter(tag=etree.Element):
+        if (elem_id := elem.get("id")) is not None:
+            ids[elem_id] += 1
+        for attr in LINK_ATTRS:
+            if (url := elem.get(attr)) and (target := resolve(arcname, url)):
+                links.append(target)
+    return ids, links
+
+def read_opf(data: bytes) -> tuple[list[dict], list[str]]:
+    """ Manifest items, as dicts of their attributes, and spine idrefs, of content.opf """
+    root = etree.fromstring(data, XML_PARSER)
+    manifest = [dict(item.attrib) for item in root.iter(f"{OPF_NS}item")]
+    spine = [itemref.get("idref") for itemref in root.iter(f"{OPF_NS}itemref")]
+    return manifest, spine
+
+def lint_entries(entries: dict, opf_name: str = "OEBPS/content.opf") -> LintReport:
+    """
+    Check the book of entries, {path in the zip: EpubEntry}. Errors are what EpubCheck would fail:
+    unresolved links and fragments, duplicate ids, manifest items without file, spine items outside the manifest.
+    Warnings: files outside the manifest, and orphans, manifest items nothing refers to.
+    """
+    report = LintReport()
+    id_index = {}  # {path in the zip: ids}
+    links = {}     # {(target, fragment): first path in the zip linking there}
+    for arcname, entry in entries.items():
+        if arcname.endswith(".xhtml"):
+            try:
+                ids, doc_links = index_xhtml(arcname, entry.read())
+            except etree.XMLSyntaxError as exc:
+                report.errors.append(f"{arcname}: not well-formed XML, {exc}")
+                continue
+            id_index[arcname] = ids
+            report.documents += 1
+            report.ids += len(ids)
+            report.links += len(doc_links)
+            for dup_id, count in ids.items():
+                if count > 1:
+                    report.errors.append(f"{arcname}: id {dup_id} {count} times")
+            for target in doc_links:
+                links.setdefault(target, arcname)
+        elif arcname.endswith(".css"):
+            for url in CSS_URL.findall(entry.read()):
+                if target := resolve(arcname, url.decode("utf-8")):
+                    links.setdefault(target, arcname)
+
+    for (path, fragment), source in links.items():
+        if path not in entries:
+            report.errors.append(f"{source}: link to missing {path}")
+        elif fragment and path in id_index and fragment not in id_index[path]:
+            report.errors.append(f"{source}: link to missing id {path}#{fragment}")
+
+    if opf_name not in entries:
+        report.errors.append(f"No {opf_name}")
+        return report
+    manifest, spine = read_opf(entries[opf_name].read())
+    oebps = posixpath.dirname(opf_name)
+    hrefs = {posixpath.normpath(posixpath.join(oebps, item["href"])): item for item in manifest}
+    for item_id, count in Counter(item["id"] for item in manifest).items():
+        if count > 1:
+            report.errors.append(f"{opf_name}: manifest id {item_id} {count} times")
+    for path, item in hrefs.items():
+        if path not in entries:
+            report.errors.append(f"{opf_name}: manifest item {item['id']} without file {path}")
+    manifest_ids = {item["id"] for item in manifest}
+    for idref in spine:
+        if idref not in manifest_ids:
+            report.errors.append(f"{opf_name}: spine itemref {idref} not in the manifest")
+
+    linked = {path for path, _ in links}
+    for arcname in entries:
+        if arcname.startswith(oebps + "/") and arcname != opf_name and arcname not in hrefs:
+            report.warnings.append(f"{arcname}: not in the manifest")
+    spine_ids = set(spine)
+    for path, item in hrefs.items():
+        if path in entries and item["id"] not in spine_ids and path not in linked and not item.get("properties"):
+            report.warnings.append(f"{path}: orphan, nothing refers to manifest item {item['id']}")
+    return report
@@ -0,0 +1,247 @@
+# HTTP access for the scrapers: pooled session with timeouts and retries,
+# and a persistent on-disk cache, revalidated with conditional GET
+import hashlib
+import json
+import logging
+import os
+import os.path as osp
+import tempfile
+import threading
+import time
+import requests
+
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from requests.compat import chardet
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+@dataclass
+class FetchStats:
+    """ One HTTP call. Latency is seconds to response headers, including retries and their waits.
+    For streamed bodies, the consumer adds to bytes as it reads. """
+    url: str
+    method: str = "GET"
+    status: int = 0
+    bytes: int = 0
+    latency: float = 0.0
+    retries: int = 0
+
+class HttpClient:
+    """
+    Shared, pooled HTTP session for all scraping: keep-alive connections, (connect, read) timeouts,
+    and bounded exponential-backoff retries on connection errors and 429/5xx, honoring Retry-After.
+    Every call is recorded as FetchStats in stats.
+    """
+
+    def __init__(self, timeout=(5, 30), retries: int = 4, backoff: float = 1.0, max_backoff: float = 60,
+                 pool_size: int = 8):
+        self.timeout = tuple(timeout) if isinstance(timeout, (list, tuple)) else timeout
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = []
+        self._lock = threading.Lock()
+
+    def _delay(self, attempt: int, rsp=None) -> float:
+        """ Seconds to wait before the next attempt: Retry-After if the server sent one, else exponential """
+        retry_after = rsp.headers.get("Retry-After") if rsp is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = self.backoff * 2 ** attempt
+        else:
+            delay = self.backoff * 2 ** attempt
+        return min(max(0.0, delay), self.max_backoff)
+
+    def request(self, method: str, url: str, headers: dict = None, stream: bool = False) -> requests.Response:
+        """ Request with retries. Return the final response, with its FetchStats as rsp.stats """
+        stats = FetchStats(url, method)
+        start = time.monotonic()
+        for attempt in range(self.retries + 1):
+            try:
+                rsp = self.session.request(method, url, headers=headers, stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt == self.retries:
+                    stats.latency = time.monotonic() - start
+                    self._record(stats)
+                    raise
+                delay = self._delay(attempt)
+                logger.warning(f"{method} {url} failed ({exc}), retry {attempt + 1} in {delay:.1f}s.")
+            else:
+                if rsp.status_code not in RETRY_STATUS or attempt == self.retries:
+                    break
+                delay = self._delay(attempt, rsp)
+                logger.warning(f"{method} {url} status {rsp.status_code}, retry {attempt + 1} in {delay:.1f}s.")
+                rsp.close()
+            stats.retries += 1
+            time.sleep(delay)
+
+        stats.status = rsp.status_code
+        stats.latency = time.monotonic() - start
+        if not stream:
+            stats.bytes = len(rsp.content)
+        rsp.stats = stats
+        self._record(stats)
+        return rsp
+
+    def get(self, url: str, headers: dict = None, stream: bool = False) -> requests.Response:
+        return self.request("GET", url, headers=headers, stream=stream)
+
+    def head(self, url: str, headers: dict = None) -> requests.Response:
+        return self.request("HEAD", url, headers=headers)
+
+    def _record(self, stats: FetchStats):
+        with self._lock:
+            self.stats.append(stats)
+
+    def summary(self) -> str:
+        """ Totals over all calls so far, for the log """
+        with self._lock:
+            calls = list(self.stats)
+        if not calls:
+            return "HTTP: no requests."
+        total_bytes = sum(call.bytes for call in calls)
+        latency = sum(call.latency for call in calls)
+        return (f"HTTP: {len(calls)} requests, {total_bytes:,} bytes, {sum(call.retries for call in calls)} retries, "
+                f"{sum(1 for call in calls if call.status >= 400 or not call.status)} failures, "
+                f"mean latency {latency / len(calls):.3f}s, max {max(call.latency for call in calls):.3f}s.")
+
+class CacheMissError(RuntimeError):
+    """ Offline mode, and the URL has never been fetched into the HTTP cache. """
+
+@dataclass
+class CachedResponse:
+    """ Response body held on disk by HttpCache. Quacks enough like requests.Response for utilities. """
+    url: str
+    path: str                 # cached body file
+    headers: dict = field(default_factory=dict)
+    encoding: str = None
+    from_cache: bool = False  # served from disk, either offline or after 304 Not Modified
+    status_code: int = 200
+
+    @property
+    def content(self) -> bytes:
+        with open(self.path, "rb") as fp:
+            return fp.read()
+
+    @property
+    def text(self) -> str:
+        content = self.content
+        encoding = self.encoding or chardet.detect(content)["encoding"] or "utf-8"
+        return str(content, encoding, errors="replace")
+
+    def iter_content(self, chunk_size: int = CHUNK_SIZE):
+        with open(self.path, "rb") as fp:
+            while (chunk := fp.read(chunk_size)):
+                yield chunk
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_atomic(chunks, out_path: str) -> int:
+    """ Stream byte chunks to a temp file beside out_path, then rename into place. Return bytes written. """
+    fd, tmp_path = tempfile.mkstemp(dir=osp.dirname(out_path) or ".", suffix=".part")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return size
+
+class HttpCache:
+    """
+    Persistent HTTP cache keyed by URL. For each URL, store the body and a JSON record of
+    ETag, Last-Modified, Content-Type and text encoding.
+    - Online, revalidate with If-None-Match / If-Modified-Since, and serve 304 Not Modified from disk.
+    - Offline, never touch the network, and raise CacheMissError for URLs not yet cached.
+    """
+
+    def __init__(self, cache_dir: str, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url: str) -> tuple[str, str]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        sub_dir = osp.join(self.cache_dir, key[:2])
+        return osp.join(sub_dir, f"{key}.body"), osp.join(sub_dir, f"{key}.json")
+
+    def lookup(self, url: str) -> CachedResponse | None:
+        """ The cached response for url, without any network access, or None """
+        body_path, meta_path = self._paths(url)
+        if not (osp.exists(body_path) and osp.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path, encoding="utf-8") as fp:
+                meta = json.load(fp)
+        except json.JSONDecodeError:
+            logger.warning(f"Unreadable HTTP cache record {meta_path}, treated as a cache miss for {url}.")
+            return None
+        return CachedResponse(url, body_path, meta.get("headers", {}), meta.get("encoding"), from_cache=True)
+
+    def get(self, url: str, session=requests, **kwargs) -> CachedResponse:
+        """ GET url through the cache, with session a HttpClient or requests.
+        Raises requests.HTTPError for error statuses, like raise_for_status. """
+        cached = self.lookup(url)
+        if self.offline:
+            if cached is None:
+                raise CacheMissError(f"Offline, and URL is not in HTTP cache {self.cache_dir}: {url}")
+            logger.debug(f"Offline, serving {url} from HTTP cache.")
+            return cached
+
+        headers = {}
+        if cached is not None:
+            if cached.headers.get("ETag"):
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if cached.headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        with session.get(url, headers=headers, stream=True, **kwargs) as rsp:
+            if rsp.status_code == 304 and cached is not None:
+                logger.debug(f"Not modified, serving {url} from HTTP cache.")
+                return cached
+            rsp.raise_for_status()
+            return self._store(url, rsp)
+
+    def _store(self, url: str, rsp) -> CachedResponse:
+        """ Stream the response body to the cache, then record its validators """
+        body_path, meta_path = self._paths(url)
+        os.makedirs(osp.dirname(body_path), exist_ok=True)
+
+        keep = {name: rsp.headers[name] for name in ("ETag", "Last-Modified", "Content-Type") if name in rsp.headers}
+
+        def body_chunks():
+            for chunk in rsp.iter_content(CHUNK_SIZE):
+                if hasattr(rsp, "stats"):
+                    rsp.stats.bytes += len(chunk)
+                yield chunk
+        write_atomic(body_chunks(), body_path)
+        meta = json.dumps({"url": url, "headers": keep, "encoding": rsp.encoding}, indent=2)
+        write_atomic([meta.encode("utf-8")], meta_path)
+
+        logger.debug(f"Stored {url} in HTTP cache.")
+        return CachedResponse(url, body_path, keep, rsp.encoding, from_cache=False, status_code=rsp.status_code)
@@ -0,0 +1,86 @@
+# Persistent index of the images in a directory: width, height, format, byte size, mtime and sha256,
+# read from image headers, saved as CSV next to the images, refreshed for changed files only
+import csv
+import hashlib
+import io
+import logging
+import os
+import os.path as osp
+
+from PIL import Image
+from utils.fetch import write_atomic
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".svg", ".webp")
+FIELDS = ["file", "width", "height", "format", "bytes", "mtime_ns", "sha256"]
+
+class ImageIndex:
+    """
+    {file name: record} of the images in img_dir, saved as img_dir/index_name.
+    - refresh() re-reads a file only when its byte size or mtime changed, and only its header, besides the hash
+    - Files Pillow cannot read are indexed without width, height and format
+    """
+
+    def __init__(self, img_dir: str, index_name: str = "image_index.csv"):
+        self.img_dir = img_dir
+        self.path = osp.join(img_dir, index_name)
+        self.records = {}
+        self.updated, self.removed = [], []
+        if osp.exists(self.path):
+            with open(self.path, encoding="utf-8", newline="") as fp:
+                for row in csv.DictReader(fp):
+                    for name in ("width", "height", "bytes", "mtime_ns"):
+                        row[name] = int(row[name]) if row[name] else None
+                    self.records[row["file"]] = row
+
+    def read(self, fname: str, stat: os.stat_result) -> dict:
+        """ Record of one image, from its bytes and header """
+        with open(osp.join(self.img_dir, fname), "rb") as fp:
+            data = fp.read()
+        record = {"file": fname, "width": None, "height": None, "format": "",
+                  "bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hashlib.sha256(data).hexdigest()}
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                record["width"], record["height"] = image.size
+                record["format"] = image.format
+        except Exception as exc:
+            logger.warning(f"Could not read image header of {fname} in {self.img_dir}: {exc}")
+        return record
+
+    def refresh(self) -> "ImageIndex":
+        """ Index new and changed images, forget removed ones, and save if anything changed """
+        if not osp.isdir(self.img_dir):
+            return self
+        fnames = {fname for fname in os.listdir(self.img_dir) if fname.lower().endswith(IMAGE_EXTS)}
+        for fname in sorted(fnames):
+            stat = os.stat(osp.join(self.img_dir, fname))
+            record = self.records.get(fname)
+            if record and (record["bytes"], record["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            self.records[fname] = self.read(fname, stat)
+            self.updated.append(fname)
+        for fname in sorted(set(self.records) - fnames):
+            del self.records[fname]
+            self.removed.append(fname)
+        if self.updated or self.removed:
+            self.save()
+            logger.info(f"Image index {self.path}: {len(self.updated)} images indexed, {len(self.removed)} removed.")
+        return self
+
+    def get(self, fname: str) -> dict | None:
+        return self.records.get(fname)
+
+    def media_type(self, fname: str, default: str = "image/jpeg") -> str:
+        """ MIME type of an indexed image, from its format """
+        record = self.records.get(fname)
+        return Image.MIME.get(record["format"], default) if record and record["format"] else default
+
+    def save(self):
+        """ Write the index through a temp file of its own, so that pool workers saving at once do not clash """
+        buf = io.StringIO(newline="")
+        writer = csv.DictWriter(buf, fieldnames=FIELDS)
+        writer.writeheader()
+        for fname in sorted(self.records):
+            writer.writerow(self.records[fname])
+        write_atomic([buf.getvalue().encode("utf-8")], self.path)
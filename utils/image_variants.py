@@ -0,0 +1,66 @@
+# Image variants per device profile: each image resized to fit the profile's max width and height, and
+# re-encoded as JPEG at its quality, progressive or baseline. Made by 00-optimize-images.py, packaged by 04
+import io
+import os.path as osp
+
+from PIL import ExifTags, Image, ImageOps
+from utils.fetch import write_atomic
+
+ORIGINAL = "original"  # the source images, as they are
+PROFILE_FIELDS = ("max_width", "max_height", "quality", "progressive")
+VARIANT_EXTS = (".jpg", ".jpeg")  # the images 04 packages
+
+def check_profile(name: str, profile: dict) -> dict:
+    """ The profile, if it has every field in range. Else ValueError """
+    missing = [field for field in PROFILE_FIELDS if field not in profile]
+    if missing:
+        raise ValueError(f"Image profile {name} lacks {', '.join(missing)}")
+    if not 1 <= profile["quality"] <= 95:
+        raise ValueError(f"Image profile {name}: JPEG quality {profile['quality']} not in 1 to 95")
+    if profile["max_width"] < 1 or profile["max_height"] < 1:
+        raise ValueError(f"Image profile {name}: max width and height must be positive")
+    return {field: profile[field] for field in PROFILE_FIELDS}
+
+def variant_dir(src_dir: str, profile: str, variants_root: str) -> str:
+    """ Folder of the variants of the images in src_dir for profile: variants_root/profile/folder, or src_dir for original """
+    return src_dir if profile == ORIGINAL else osp.join(variants_root, profile, osp.basename(osp.normpath(src_dir)))
+
+def make_variant(src_path: str, dest_path: str, profile: dict) -> tuple[int, int]:
+    """
+    Write the variant of one image for profile, upright per its EXIF orientation. Return the source and the
+    variant bytes. An upright image that fits the profile, progressive or baseline as the profile wants, is kept
+    as it is when re-encoding would not shrink it.
+    The ICC profile is kept for L and RGB sources only. One of a CMYK source does not describe the RGB variant.
+    """
+    with open(src_path, "rb") as fp:
+        data = fp.read()
+    with Image.open(io.BytesIO(data)) as image:
+        orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+        # Orientations 5 to 8 turn the image a quarter: the profile box, in stored pixels, turns with it
+        box = (profile["max_width"], profile["max_height"])[::1 if orientation < 5 else -1]
+        fits = image.width <= box[0] and image.height <= box[1]
+        as_wanted = orientation == 1 and fits and bool(image.info.get("progressive")) == bool(profile["progressive"])
+        icc_profile = image.info.get("icc_profile") if image.mode in ("L", "RGB") else None
+        # Decode JPEG at a reduced scale, as thumbnail() would, since exif_transpose() decodes it
+        image.draft(None, (box[0] * 2, box[1] * 2))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((profile["max_width"], profile["max_height"]), Image.Resampling.LANCZOS)
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=profile["quality"], progressive=bool(profile["progressive"]),
+                   optimize=True, icc_profile=icc_profile)
+    variant = out.getvalue()
+    if as_wanted and len(variant) >= len(data):
+        variant = data
+    write_atomic([variant], dest_path)
+    return len(data), len(variant)
+
+def format_report(report: dict, profile: str) -> list[str]:
+    """ Lines of the before and after size report, {folder: [images, source bytes, variant bytes]} """
+    lines = [f"{'folder':<16} {'images':>7} {'source':>12} {profile:>12} {'ratio':>6}"]
+    for folder, (count, size, variant) in report.items():
+        lines.append(f"{folder:<16} {count:>7} {size:>12,} {variant:>12,} {variant / size if size else 1:>6.1%}")
+    count, size, variant = (sum(stats[idx] for stats in report.values()) for idx in range(3))
+    lines.append(f"{'total':<16} {count:>7} {size:>12,} {variant:>12,} {variant / size if size else 1:>6.1%}")
+    return lines
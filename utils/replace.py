@@ -0,0 +1,96 @@
+'''
+Ordered string replacement rules, applied like a chain of str.replace calls, but in fewer passes.
+- Consecutive rules that cannot interact are grouped, and each group is applied in one regex pass
+- Rules interact when one's source overlaps another's source, or an earlier rule's replacement
+  could create a later rule's source. Such a rule starts a new group, keeping the sequential result
+- A rule with an empty replacement can join the text either side of it, so it closes its group
+- Every pass counts hits per rule, to spot dead rules and unexpectedly hot ones
+'''
+import re
+
+def overlaps(a: str, b: str) -> bool:
+    """ True if a and b can share characters in some text: one contains the other, or they overlap at an edge """
+    if not a or not b:
+        return False
+    if a in b or b in a:
+        return True
+    for k in range(1, min(len(a), len(b))):
+        if a.endswith(b[:k]) or b.endswith(a[:k]):
+            return True
+    return False
+
+class ReplaceRules:
+    """
+    Ordered replacement rules, {source: replacement} or (source, replacement) pairs.
+    apply() returns the same text as applying str.replace for each rule in order, and hits per rule.
+    """
+    def __init__(self, rules):
+        self.rules = list(rules.items() if isinstance(rules, dict) else rules)
+        if any(not src for src, _ in self.rules):
+            raise ValueError("Replacement rule with an empty source.")
+        self.groups = self._group()
+        self._patterns = {}
+
+    def compatible(self, i: int, j: int) -> bool:
+        """ Rules i < j may run in the same pass """
+        src_i, rpl_i = self.rules[i]
+        src_j, _ = self.rules[j]
+        return rpl_i != "" and not overlaps(src_i, src_j) and not overlaps(rpl_i, src_j)
+
+    def _group(self) -> list[tuple[int, ...]]:
+        groups, current = [], []
+        for j, (_, rpl) in enumerate(self.rules):
+            if current and not all(self.compatible(i, j) for i in current):
+                groups.append(tuple(current))
+                current = []
+            current.append(j)
+            if rpl == "":
+                groups.append(tuple(current))
+                current = []
+        if current:
+            groups.append(tuple(current))
+        return groups
+
+    def _pattern(self, indexes: tuple[int, ...]):
+        """ One alternation for the rules of a group with hits. Their sources never overlap, so order is moot """
+        if indexes not in self._patterns:
+            lookup = dict(self.rules[i] for i in indexes)
+            pattern = re.compile("|".join(re.escape(self.rules[i][0]) for i in indexes))
+            self._patterns[indexes] = pattern, lambda m: lookup[m[0]]
+        return self._patterns[indexes]
+
+    def apply(self, text: str, verify: bool = False) -> tuple[str, list[int]]:
+        """ Return the replaced text, and hits per rule. With verify, check against apply_sequential """
+        hits = [0] * len(self.rules)
+        result = text
+        for group in self.groups:
+            live = []
+            for i in group:
+                hits[i] = result.count(self.rules[i][0])
+                if hits[i]:
+                    live.append(i)
+            if len(live) == 1:
+                result = result.replace(*self.rules[live[0]])
+            elif live:
+                pattern, repl = self._pattern(tuple(live))
+                result = pattern.sub(repl, result)
+
+        if verify:
+            expected, expected_hits = self.apply_sequential(text)
+            if (result, hits) != (expected, expected_hits):
+                diff = [self.label(i) for i, (a, b) in enumerate(zip(hits, expected_hits)) if a != b]
+                raise ValueError(f"Grouped replacement differs from sequential replacement. Rules: {diff or 'same hits'}")
+        return result, hits
+
+    def apply_sequential(self, text: str) -> tuple[str, list[int]]:
+        """ Reference semantics: str.replace for each rule, in order """
+        hits = []
+        for src, rpl in self.rules:
+            hits.append(text.count(src))
+            text = text.replace(src, rpl)
+        return text, hits
+
+    def label(self, i: int, width: int = 40) -> str:
+        """ Short printable name for rule i """
+        src = self.rules[i][0]
+        return f"#{i:02d} {src[:width]!r}" + ("..." if len(src) > width else "")
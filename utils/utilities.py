@@ -1,18 +1,32 @@
 # Generic utilities to import to other modules
+import importlib.util
 import logging
 import mimetypes
+import multiprocessing
 import os
 import os.path as osp
 import requests
 import re
 import shutil
 import sys
+import threading
+import time
+import zlib
 
+from bisect import bisect_right
 from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timezone
-from io import BytesIO
+from functools import lru_cache
+from itertools import chain
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from PIL import Image
+from urllib.parse import urlsplit
+from utils.fetch import CacheMissError, HttpCache, HttpClient, write_atomic
+from utils.image_index import ImageIndex
+import utils.config as config
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +35,45 @@ image_ext = {"image/bmp" : "bmp",
              "image/jpeg": "jpg",
              "image/png" : "png"}
 
+# Leading "magic" bytes of the image_ext formats
+image_magic = {b"\xff\xd8\xff"      : "image/jpeg",
+               b"\x89PNG\r\n\x1a\n": "image/png",
+               b"GIF87a"            : "image/gif",
+               b"GIF89a"            : "image/gif",
+               b"BM"                : "image/bmp"}
+
+def sniff_image_mimetype(head: bytes, content_type: str = "") -> str | None:
+    """ Image mimetype from the leading bytes of the content, else from an image/* Content-Type header """
+    for magic, mime_type in image_magic.items():
+        if head.startswith(magic):
+            return mime_type
+    content_type = content_type.split(";")[0].strip().lower()
+    return content_type if content_type in image_ext else None
+
+# BeautifulSoup parser backends for chapter HTML. html.parser is the reference, lxml the faster one.
+# Check lxml against html.parser with report_parser_parity.py
+html_parsers = ("html.parser", "lxml")
+lxml_wrappers = {name: re.compile(rf"<{name}[\s/>]", re.IGNORECASE) for name in ("head", "body", "html")}
+
+def get_html_parser(name: str = "") -> str:
+    """ Parser backend: name if given, as from a --parser flag, else config exe_mode parser, else html.parser """
+    name = name or config.load_config()["exe_mode"].get("parser", "html.parser")
+    if name not in html_parsers:
+        raise ValueError(f"Unknown HTML parser '{name}', expected one of {html_parsers}.")
+    return name
+
+def parse_html(html: str, parser: str = "html.parser") -> BeautifulSoup:
+    """ Parse chapter HTML, or a fragment of it, with either backend.
+    lxml wraps fragments in html, head and body tags. Unwrap those not in the source,
+    so that str(soup) serializes the fragment, as with html.parser """
+    soup = BeautifulSoup(html, parser)
+    if parser != "html.parser":
+        for name, patt in lxml_wrappers.items():
+            tag = soup.find(name)
+            if tag is not None and not patt.search(html):
+                tag.unwrap()
+    return soup
+
 def init_logger (level=logging.INFO) -> logging.Logger:
     ''' initialize a basic logger for the calling module. Default level is INFO '''
     logfile = Path(osp.basename(sys.argv[0])).stem
@@ -36,6 +89,74 @@ def init_logger (level=logging.INFO) -> logging.Logger:
     logger.info(f"Initialized log file {logfile}")
     return logger
 
+class LogTag(logging.Filter):
+    """ Prefix log records of a pool worker with the item it is working on, e.g. [chapter 035] """
+    tag = ""
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.tag:
+            record.msg = f"[{self.tag}] {record.getMessage()}"
+            record.args = None
+        return True
+
+log_tag = LogTag()
+
+def init_worker_logger(queue, level=logging.INFO):
+    """ Process pool initializer: send this worker's log records to queue, tagged per log_tag.
+    The parent writes them to its own log file, within log_listener(queue) """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = QueueHandler(queue)
+    handler.addFilter(log_tag)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+@contextmanager
+def log_listener(queue):
+    """ Write log records that pool workers put on queue to the handlers of this process """
+    listener = QueueListener(queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        yield listener
+    finally:
+        listener.stop()
+
+def run_pool(fn, items: dict, jobs: int = 1, done=None) -> dict:
+    """
+    fn(*args) for each {item: args} of items, as {item: result}, in the order of items.
+    With jobs > 1, on a pool of worker processes, which log to the log of this process, per init_worker_logger.
+    done(item, result), if given, runs in this process as each item completes.
+    Fail fast: the first failure cancels the items not yet started, and raises RuntimeError "Failed {item}".
+    """
+    results = {}
+    if jobs <= 1:
+        for item, args in items.items():
+            try:
+                results[item] = fn(*args)
+                if done:
+                    done(item, results[item])
+            except Exception as exc:
+                logger.error(f"Failed {item}: {exc!r}")
+                raise RuntimeError(f"Failed {item}") from exc
+    else:
+        queue = multiprocessing.Queue()
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker_logger,
+                                 initargs=(queue, logging.getLogger().level)) as pool:
+            futures = {pool.submit(fn, *args): item for item, args in items.items()}
+            # Forked workers start on the first submit. Only then start the listener thread, not to fork a threaded process
+            with log_listener(queue):
+                for future in as_completed(futures):
+                    item = futures[future]
+                    try:
+                        results[item] = future.result()
+                        if done:
+                            done(item, results[item])
+                    except Exception as exc:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        logger.error(f"Failed {item}: {exc!r}")
+                        raise RuntimeError(f"Failed {item}") from exc
+    return {item: results[item] for item in items}
+
 def init_dir(DIR:str) -> int:
     if osp.isdir(DIR):
         shutil.rmtree(DIR)
@@ -44,63 +165,226 @@ def init_dir(DIR:str) -> int:
     logger.info(f"Fresh start created {DIR}")
     return 0
 
+def load_script(fname: str, name: str = ""):
+    """
+    Import a numbered stage script, e.g. 02-clean-html.py, from the project root, as module name, by default
+    clean_html. Registered in sys.modules, so that pool workers find its functions.
+    """
+    path = Path(__file__).parent.parent / fname
+    name = name or Path(fname).stem.lstrip("0123456789-").replace("-", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
 def get_utc_now() -> str:
     """ Today's date in EPUB 3.3 modified format CCYY-MM-DDThh:mm:ssZ """
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
+class HostThrottle:
+    """ Scrape politely from concurrent workers.
+    Per host, cap the number of requests in flight and space the start of consecutive requests
+    by at least min_interval seconds. Share one throttle across all workers of a run. """
+
+    def __init__(self, max_per_host: int = 2, min_interval: float = 0.5):
+        self.max_per_host = max(1, int(max_per_host))
+        self.min_interval = max(0.0, float(min_interval))
+        self._lock = threading.Lock()
+        self._hosts = {}  # host: [semaphore, next allowed start time]
+
+    def _host_state(self, host: str) -> list:
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = [threading.BoundedSemaphore(self.max_per_host), 0.0]
+            return self._hosts[host]
+
+    @contextmanager
+    def slot(self, url: str):
+        """ Block until a request to the host of url may start, and hold a slot while it runs. """
+        state = self._host_state(urlsplit(url).netloc.lower())
+        with state[0]:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, state[1])
+                state[1] = start + self.min_interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+# Pooled HTTP session and on-disk HTTP cache shared by fetch_html and download_url. Created from config on first use.
+# Set proj_dirs http_cache to "" to disable, or exe_mode offline to True to never touch the network.
+http_client = None
+http_cache = None
+
+def get_http_client() -> HttpClient:
+    global http_client
+    if http_client is None:
+        ext = config.load_config()["ext_resource"]
+        http_client = HttpClient(timeout=ext.get("timeout", (5, 30)),
+                                 retries=ext.get("retries", 4),
+                                 backoff=ext.get("backoff", 1.0),
+                                 max_backoff=ext.get("max_backoff", 60),
+                                 pool_size=ext.get("pool_size", 8))
+    return http_client
+
+def get_http_cache() -> HttpCache | None:
+    global http_cache
+    if http_cache is None:
+        config_data = config.load_config()
+        cache_dir = config_data["proj_dirs"].get("http_cache")
+        if cache_dir:
+            http_cache = HttpCache(cache_dir, offline=config_data["exe_mode"].get("offline", False))
+            logger.info(f"HTTP cache {cache_dir}, offline {http_cache.offline}.")
+    return http_cache
+
+image_indexes = {}
+
+def get_image_index(img_dir: str) -> ImageIndex:
+    """ Image index of img_dir, per config proj_dirs image_index, refreshed once per process """
+    if img_dir not in image_indexes:
+        index_name = config.load_config()["proj_dirs"].get("image_index", "image_index.csv")
+        image_indexes[img_dir] = ImageIndex(img_dir, index_name).refresh()
+    return image_indexes[img_dir]
+
+def fetch(url: str, stream: bool = False, cache: bool = True):
+    """ GET a URL, through the HTTP cache when enabled. Raise for error status codes.
+    With stream, read the body later, in chunks with iter_content. The HTTP cache always streams to disk.
+    With cache False, for large files, bypass the HTTP cache online, so that the body streams once, to its
+    destination. Offline, serve from the HTTP cache all the same. """
+    http_store = get_http_cache()
+    if http_store is not None and (cache or http_store.offline):
+        return http_store.get(url, session=get_http_client())
+    resp = get_http_client().get(url, stream=stream)
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError:
+        resp.close()  # a streamed response holds its pooled connection until closed
+        raise
+    return resp
+
 def fetch_html(url: str) -> str:
     """Fetch raw HTML text from a URL."""
-    resp = requests.get(url)
-    resp.raise_for_status()
-    return resp.text
-
-def download_url(target_url: str, out_dir=".", fname=""):
+    return fetch(url).text
+
+def last_modified_iso(last_mod_str: str) -> str:
+    """ HTTP Last-Modified date, like 'Mon, 02 Mar 2020 10:00:00 GMT', as ISO date-time. "" if missing """
+    if not last_mod_str:
+        return ""
+    return datetime.strptime(last_mod_str, '%a, %d %b %Y %H:%M:%S %Z').isoformat(timespec="seconds")
+
+def head_last_modified(url: str) -> str:
+    """ Last-Modified of a URL as ISO date-time, "" if unavailable. Offline, from the HTTP cache. """
+    cache = get_http_cache()
+    try:
+        if cache is not None and cache.offline:
+            cached = cache.lookup(url)
+            return last_modified_iso(cached.headers.get("Last-Modified", "")) if cached else ""
+        rsp = get_http_client().head(url)
+        return last_modified_iso(rsp.headers.get("Last-Modified", ""))
+    except (requests.RequestException, ValueError) as exc:
+        logger.warning(f"No Last-Modified for {url}: {exc}")
+        return ""
+
+def sweep_last_modified(urls: list[str], jobs: int = 8, throttle: HostThrottle = None) -> dict[str, str]:
+    """ HEAD many URLs on a bounded thread pool, optionally throttled per host.
+    Return {url: ISO Last-Modified}, or "Error: ..." for URLs without a usable Last-Modified. """
+    client = get_http_client()
+
+    def head(url: str) -> str:
+        try:
+            with (throttle.slot(url) if throttle else nullcontext()):
+                rsp = client.head(url)
+            if rsp.status_code >= 400:
+                return f"Error: HTTP status {rsp.status_code}"
+            if not rsp.headers.get("Last-Modified"):
+                return "Error: No Last-Modified date available"
+            return last_modified_iso(rsp.headers["Last-Modified"])
+        except (requests.RequestException, ValueError) as exc:
+            return f"Error: {exc}"
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return dict(zip(urls, pool.map(head, urls)))
+
+def verify_image_header(img_path: str, mime_type: str) -> bool:
+    """ Optional check, with Pillow reading only the image header, that the file is the expected format """
+    try:
+        with Image.open(img_path) as image:
+            return image.get_format_mimetype() == mime_type
+    except IOError:
+        return False
+
+def download_url(target_url: str, out_dir=".", fname="", verify: bool = False) -> str | None:
+    """ Download a URL to out_dir, by default named as in the URL. Never overwrite an existing file.
+    Return the path of the downloaded, or already present, file. None if the download failed. """
     if not fname:
         fname = osp.basename(target_url)
 
     mime_type, encoding = mimetypes.guess_type(target_url)
+    if not mime_type and urlsplit(target_url).path.endswith(".php"):
+        mime_type = 'application/x-httpd-php'  # archive.org BookReader, with the .php hidden by its query string
 
     if mime_type in ['text/css', 'text/html']:
         ''' Download to same filetype '''
         try:
-            url_text = fetch_html(target_url)
             url_file = osp.join(out_dir, fname)
             # Do not overwrite - instead start fresh when needed
             if not osp.exists(url_file):
+                url_text = fetch_html(target_url)
                 logger.info(f"Downloading URL: {target_url}")
                 with open(url_file, "w", encoding="utf-8") as fp:
                     fp.write(url_text)
+            return url_file
+        except CacheMissError:
+            raise
         except Exception as exc:
             logger.error(f"Failed to download {target_url} of mimetype {mime_type}: {exc}")
 
     elif mime_type == 'application/x-httpd-php':
-        ''' Expect a PHP image file, only, so use Pillow to get raw image bytes '''
-        rsp = requests.get(target_url)
-
-        if rsp.status_code == 200:
-            try:
-                image = Image.open(BytesIO(rsp.content))
-                imgext = image_ext.get(image.get_format_mimetype())
-                img_name = osp.join(out_dir, f"{fname}.{imgext}")
-                # Do not overwrite - instead start fresh when needed
-                if not osp.exists(img_name):
-                    logger.info(f"Downloading image {img_name} from {target_url}.")
-                    image.save(img_name)
-            except IOError:
-                logger.error(f"The content received was not a valid image: URL {target_url}, mimetype {mime_type}, filename {fname}.")
-        else:
-            logger.error(f"Failed to retrieve mimetype {mime_type} content from URL {target_url}. Status code: {rsp.status_code}")
+        ''' Expect a PHP image file, only. Stream the original image bytes to disk, no decode and re-encode '''
+        # Do not overwrite - instead start fresh when needed. The extension is known from the image bytes only
+        for ext in image_ext.values():
+            if osp.exists(img_name := osp.join(out_dir, f"{fname}.{ext}")):
+                return img_name
+        try:
+            with fetch(target_url, stream=True, cache=False) as rsp:
+                chunks = rsp.iter_content(64 * 1024)
+                head = next(chunks, b"")
+                img_mime = sniff_image_mimetype(head, rsp.headers.get("Content-Type", ""))
+                if img_mime is None:
+                    logger.error(f"The content received was not a valid image: URL {target_url}, mimetype {mime_type}, filename {fname}.")
+                    return
+                img_name = osp.join(out_dir, f"{fname}.{image_ext[img_mime]}")
+                logger.info(f"Downloading image {img_name} from {target_url}.")
+                size = write_atomic(chain([head], chunks), img_name)
+                if hasattr(rsp, "stats"):
+                    rsp.stats.bytes += size
+                if verify and not verify_image_header(img_name, img_mime):
+                    os.remove(img_name)
+                    logger.error(f"The content received was not a valid image: URL {target_url}, mimetype {mime_type}, filename {fname}.")
+                    return
+                return img_name
+        except CacheMissError:
+            raise
+        except requests.RequestException as exc:
+            logger.error(f"Failed to retrieve mimetype {mime_type} content from URL {target_url}. {exc}")
     elif not mime_type:
         # Unknown mimetype, try to download as binary
+        out_path = osp.join(out_dir, fname)
+        # Do not overwrite - instead start fresh when needed
+        if osp.exists(out_path):
+            return out_path
         try:
-            rsp = requests.get(target_url, stream=True)
-            rsp.raise_for_status()
-            out_path = osp.join(out_dir, fname)
-            # Do not overwrite - instead start fresh when needed
-            if not osp.exists(out_path):
+            with fetch(target_url, stream=True, cache=False) as rsp:
                 logger.info(f"Downloading binary content from URL {target_url} to {out_path}.")
-                with open(out_path, 'wb') as out_file:
-                    shutil.copyfileobj(rsp.raw, out_file)
+                size = write_atomic(rsp.iter_content(64 * 1024), out_path)
+                if hasattr(rsp, "stats"):
+                    rsp.stats.bytes += size
+                return out_path
+        except CacheMissError:
+            raise
         except Exception as exc:
             logger.error(f"Failed to download binary content from URL {target_url}: {exc}")
     else:
@@ -115,48 +399,71 @@ def simplify_text(text) -> str:
     text = text.lower()                   # convert to lowercase
     return text
 
-def titlecase_word(word: str, idx:int, ignore: list = []) -> str:
-    """
-    Title case text, not marked up text, like HTML or Markdown.
-    Handle contractions and possessives. Do not capitalize letters after apostrophes.
-    Handle quoted words, leadinig + terminal matching single- or double-quotes
-    If word is already a snake or camel case, leave it alone
-    Skip any word with numbers in it
-    Skip any word in the ignore list, unless it is the first word in the string
-    """
-    if re.search(r'[0-9]', word):
+# Title case rules, compiled once
+TC_WORDS = re.compile(r'[\S]+')
+TC_DIGIT = re.compile(r'[0-9]')
+TC_DOTTED = re.compile(r'\.[^\.]')
+TC_SNAKE_CAMEL = (re.compile(r'^[a-z]+(_[A-Z]+)+$'),
+                  re.compile(r'^[A-Z][a-z]+([A-Z_]+)'),
+                  re.compile(r'^[a-z][A-Z]+([A-Z_]+)'))
+TC_DASHED = re.compile(r'^(.+)([\-–—])(.+)$')  # See various dashes in 02-clean-html.py
+TC_LEADING_QUOTE = re.compile(r'^([\*\'"<\[\(\{]+)(.+)')
+TC_TRAILING_QUOTE = re.compile(r'(.+)([\*\'">\]\)\}])$')
+
+def ignore_set(ignore) -> frozenset:
+    """ Lowercase frozenset of the words to ignore, as titlecase_word compares them """
+    return ignore if isinstance(ignore, frozenset) else frozenset(w.lower() for w in ignore)
+
+@lru_cache(maxsize=8192)
+def _titlecase_word(word: str, leading: bool, ignore: frozenset) -> str:
+    """ titlecase_word, memoized per word, position class and lowercase ignore set """
+    if TC_DIGIT.search(word):
         return word
-    elif re.search(r'\.[^\.]', word):
+    elif TC_DOTTED.search(word):
         return word
-    elif (re.match(r'^[a-z]+(_[A-Z]+)+$', word) or 
-        re.match(r'^[A-Z][a-z]+([A-Z_]+)', word) or 
-        re.match(r'^[a-z][A-Z]+([A-Z_]+)', word)):
+    elif any(pattern.match(word) for pattern in TC_SNAKE_CAMEL):
         return word
-    elif idx>0 and word.lower() in [w.lower() for w in ignore]:
+    elif not leading and word.lower() in ignore:
         return word.lower()
 
-    # See various dashes in 02-clean-html.py
-    if (regexp := re.match(r'^(.+)([\-–—])(.+)$', word)):
+    if (regexp := TC_DASHED.match(word)):
         first_part = regexp.group(1)
         dash = regexp.group(2)
         second_part = regexp.group(3)
-        return titlecase_word(first_part, idx, ignore) + dash + titlecase_word(second_part, idx, ignore)
-    elif (regexp := re.match(r'^([\*\'"<\[\(\{]+)(.+)', word)):
+        return _titlecase_word(first_part, leading, ignore) + dash + _titlecase_word(second_part, leading, ignore)
+    elif (regexp := TC_LEADING_QUOTE.match(word)):
         leading_quote = regexp.group(1)
         core_word = regexp.group(2)
 
-        if (regexp := re.match(r'(.+)([\*\'">\]\)\}])$', core_word)):
+        if (regexp := TC_TRAILING_QUOTE.match(core_word)):
             core_word = regexp.group(1)
             trailing_quote = regexp.group(2)
         else:
             trailing_quote = ''
-        return leading_quote + titlecase_word(core_word, idx, ignore) + trailing_quote
+        return leading_quote + _titlecase_word(core_word, leading, ignore) + trailing_quote
     elif "'\"" in word: # handle contractions and possessives
         parts = word.split("'\"")
         return "'".join([parts[0].capitalize()] + [part.lower() for part in parts[1:]])
     else:
         return word.capitalize()
 
+def titlecase_word(word: str, idx:int, ignore: list = []) -> str:
+    """
+    Title case text, not marked up text, like HTML or Markdown.
+    Handle contractions and possessives. Do not capitalize letters after apostrophes.
+    Handle quoted words, leadinig + terminal matching single- or double-quotes
+    If word is already a snake or camel case, leave it alone
+    Skip any word with numbers in it
+    Skip any word in the ignore list, unless it is the first word in the string
+    """
+    return _titlecase_word(word, idx == 0, ignore_set(ignore))
+
+def titlecase_many(texts, ignore: list = []) -> list[str]:
+    """ titlecase of each of texts, with the ignore list lowercased once, and the words memoized across texts """
+    ignore = ignore_set(ignore)
+    return [' '.join(_titlecase_word(word, idx == 0, ignore) for idx, word in enumerate(TC_WORDS.findall(text)))
+            for text in texts]
+
 def titlecase(text: str, ignore: list = []) -> str:
     """ Convert a string to title case, handling contractions properly.
         OPTIONALLY ignore certain words, regardless of case, if not first in string.
@@ -166,18 +473,53 @@ def titlecase(text: str, ignore: list = []) -> str:
     Returns:
         str: Title-cased string. 
         ignore (list): List of words to ignore, except leading words."""
-    # Split the text into words and apply titlecase_word to each. See various dashes in 02-clean-html.py
-    words = re.findall(r'[\S]+', text)
-    titlecased_words = [titlecase_word(word, idx, ignore) for idx, word in enumerate(words)]
-    return ' '.join(titlecased_words)
+    # Split the text into words and title case each. See various dashes in 02-clean-html.py
+    return titlecase_many([text], ignore)[0]
 
+def group_by_chapter(img_instructions: list[dict]) -> dict[int, list[dict]]:
+    """ Image insertion instructions by their "chapter", in order. The same dicts, so updates show in img_instructions """
+    by_chapter = {}
+    for insertion in img_instructions:
+        by_chapter.setdefault(int(insertion.get("chapter")), []).append(insertion)
+    return by_chapter
 
-def insert_custom_images(chap_num: int, html: str, img_dir: str, img_instructions: list[dict]) -> tuple[list, str]:
+class BlockTextIndex:
+    """
+    Text of the h1, h2, h3 and p blocks of a chapter, read once, to find the block holding an anchor text.
+    - text: the lowercased text of each block, and simp: its simplify_text, each joined in one string
+    - A lookup is one str.find in each, then a bisect from the match offset to its block
+    """
+    block_tags = ['h1', 'h2', 'h3', 'p']
+    sep = "\x00"  # never in anchor text, so a match stays within one block
+
+    def __init__(self, soup: BeautifulSoup):
+        self.blocks = soup.find_all(self.block_tags)
+        texts = [tag.get_text(separator=" ", strip=True).strip().lower() for tag in self.blocks]
+        self.text, self.text_starts = self.join(texts)
+        self.simp, self.simp_starts = self.join([simplify_text(text) for text in texts])
+
+    def join(self, texts: list[str]) -> tuple[str, list[int]]:
+        starts, offset = [], 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + len(self.sep)
+        return self.sep.join(texts), starts
+
+    def find(self, text: str, text_simp: str):
+        """ First block, in document order, holding text, or holding text_simp in its simplified text. Else None """
+        found = []
+        for joined, starts, target in ((self.text, self.text_starts, text), (self.simp, self.simp_starts, text_simp)):
+            if target and (offset := joined.find(target)) >= 0:
+                found.append(bisect_right(starts, offset) - 1)
+        return self.blocks[min(found)] if found else None
+
+def insert_custom_images(chap_num: int, html: str, img_dir: str, img_instructions: list[dict],
+                         parser: str = "html.parser") -> tuple[list, str]:
     """ Insert custom images into HTML content based on insertion instructions.
 
     Args:
         html (str): Original HTML content.
-        img_instructions (list[dict]): List of insertion instructions, each dict containing:
+        img_instructions (list[dict]): List of insertion instructions, of this chapter or all, each dict containing:
             - text_file: (ignore, original text reference)
             - img_name: (ignore, original image name)
             - img_rename: image to place in XHTML
@@ -188,17 +530,19 @@ def insert_custom_images(chap_num: int, html: str, img_dir: str, img_instruction
             - following_text: original text following image
             - preceding_simp: simplified text preceding image, used to match original text reference to target text
             - following_simp: simplified text following image, used to match original text reference to target text
+        parser (str): BeautifulSoup parser backend, one of html_parsers.
     Returns:
         list: Updated img_instructions, "chapters" key added with chapter numbers where image was inserted.
         str: Modified HTML content with images inserted. """
-    soup = BeautifulSoup(html, "html.parser")
+    soup = parse_html(html, parser)
+    return insert_soup_images(chap_num, soup, img_dir, img_instructions), str(soup)
 
-    for insertion in img_instructions:
-        target_chap_num = int(insertion.get("chapter"))
-        if target_chap_num != chap_num:
-            continue  # Skip if not for this chapter
-        else:
-            logger.debug(f"Processing image insertion for chapter {chap_num}, image {insertion.get('img_rename')}.")
+def insert_soup_images(chap_num: int, soup: BeautifulSoup, img_dir: str, img_instructions: list[dict]) -> list[dict]:
+    """ insert_custom_images into an already parsed chapter, in place. Returns the updated img_instructions """
+    text_index = None  # built on the first MID insertion. Inserted images leave the text of blocks as is
+
+    for insertion in group_by_chapter(img_instructions).get(chap_num, []):
+        logger.debug(f"Processing image insertion for chapter {chap_num}, image {insertion.get('img_rename')}.")
 
         img_file = insertion.get("img_rename")
         location = insertion.get("location", "MID").upper()
@@ -213,15 +557,14 @@ def insert_custom_images(chap_num: int, html: str, img_dir: str, img_instruction
         max_side_width = 350
         img_class = "center_img"
         if location == "MID":
-            # Decide left or right based on image width
-            img_path = osp.join(img_dir, img_file)
-            try:
-                with Image.open(img_path) as img:
-                    width, _ = img.size
-                    if width < max_side_width:
-                        img_class = "left_img" if (chap_num + hash(img_file)) % 2 == 0 else "right_img"
-            except Exception as exc:
-                logger.warning(f"Could not open image {img_path} to determine width: {exc}")
+            # Decide left or right based on image width, from the image index rather than the image.
+            # crc32, not hash(), which varies per process: the same side in every run and every pool worker
+            img_record = get_image_index(img_dir).get(img_file)
+            if img_record and img_record["width"] is not None:
+                if img_record["width"] < max_side_width:
+                    img_class = "left_img" if (chap_num + zlib.crc32(img_file.encode("utf-8"))) % 2 == 0 else "right_img"
+            else:
+                logger.warning(f"Could not open image {osp.join(img_dir, img_file)} to determine width: not in image index.")
 
             if img_file.startswith("chapNAT_"):
                 img_class = "center_img"  # Override to center for this specific Dedication image
@@ -230,17 +573,8 @@ def insert_custom_images(chap_num: int, html: str, img_dir: str, img_instruction
             anchor_text = {"img_loc": "before", "text": following_text} if following_text else {"img_loc": "after", "text": preceding_text}
             anchor_text_simp = {"img_loc": "before", "text": following_simp} if following_simp else {"img_loc": "after", "text": preceding_simp}
 
-            for thistag in soup.find_all(['h1', 'h2', 'h3', 'p']):
-                anchor = None
-                tag_text = thistag.get_text(separator=" ", strip=True).strip().lower()
-                tag_text_simp = simplify_text(tag_text)
-
-                if anchor_text["text"] and anchor_text["text"] in tag_text:
-                    anchor = thistag
-                    break
-                elif anchor_text_simp["text"] and anchor_text_simp["text"] in tag_text_simp:
-                    anchor = thistag
-                    break
+            text_index = text_index or BlockTextIndex(soup)
+            anchor = text_index.find(anchor_text["text"], anchor_text_simp["text"])
         else:
             # For TOP or BOTTOM locations:
             # Chapters are divided into TWO MAIN <DIV> sections: Text and optional Footnotes
@@ -279,4 +613,4 @@ def insert_custom_images(chap_num: int, html: str, img_dir: str, img_instruction
             logger.warning(f":=-- Using simplified preceding text '{preceding_simp}'.")
             logger.warning(f":=-- Using simplified following text '{following_simp}'.")
 
-    return img_instructions, str(soup)
+    return img_instructions